@@ -0,0 +1,183 @@
+"""
+Pub/Sub Backplane
+
+This module carries session events between worker processes and nodes so
+chat history and WebSocket delivery work when the backend runs more than one
+uvicorn worker or container. Two implementations are provided:
+
+- InProcessBackplane: workers in the same process share a hub (tests, single worker)
+- RedisBackplane: workers share a Redis server (the ``redis`` docker-compose service)
+
+Every backplane also hands out globally unique message ids and, for Redis,
+keeps a bounded durable copy of each session's history for workers that
+join after the messages were sent.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import socket
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+EventHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+def make_worker_id() -> str:
+    """A process-unique id used to ignore our own events"""
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+class Backplane:
+    """Interface shared by backplane implementations"""
+
+    def __init__(self, worker_id: Optional[str] = None):
+        self.worker_id = worker_id or make_worker_id()
+        self.published = 0
+        self.received = 0
+
+    async def start(self, handler: EventHandler):
+        """Start delivering events from other workers to ``handler``"""
+        raise NotImplementedError
+
+    async def stop(self):
+        raise NotImplementedError
+
+    async def publish(self, event: Dict[str, Any]):
+        """Send an event to every other worker"""
+        raise NotImplementedError
+
+    async def next_id(self) -> int:
+        """Allocate a message id that is unique across workers"""
+        raise NotImplementedError
+
+    async def save_message(self, message: Dict[str, Any]):
+        """Persist a message for workers that have not seen it yet"""
+
+    async def load_session(self, session_id: str) -> List[Dict[str, Any]]:
+        """Durable history of a session, if the backplane keeps any"""
+        return []
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "type": type(self).__name__,
+            "worker_id": self.worker_id,
+            "published": self.published,
+            "received": self.received,
+        }
+
+class InProcessHub:
+    """Shared state for in-process backplanes"""
+
+    def __init__(self):
+        self.subscribers: Dict[str, EventHandler] = {}
+        self.ids = itertools.count(1)
+
+class InProcessBackplane(Backplane):
+    """Backplane for workers living in one process"""
+
+    def __init__(self, hub: Optional[InProcessHub] = None, worker_id: Optional[str] = None):
+        super().__init__(worker_id)
+        self.hub = hub or InProcessHub()
+
+    async def start(self, handler: EventHandler):
+        self.hub.subscribers[self.worker_id] = handler
+
+    async def stop(self):
+        self.hub.subscribers.pop(self.worker_id, None)
+
+    async def publish(self, event: Dict[str, Any]):
+        self.published += 1
+        event = dict(event, origin=self.worker_id)
+        for worker_id, handler in list(self.hub.subscribers.items()):
+            if worker_id == self.worker_id:
+                continue
+            try:
+                await handler(event)
+            except Exception as e:
+                logger.error(f"Backplane handler of worker {worker_id} failed: {e}")
+
+    async def next_id(self) -> int:
+        return next(self.hub.ids)
+
+class RedisBackplane(Backplane):
+    """Backplane using Redis pub/sub, INCR for ids and lists for history"""
+
+    def __init__(
+        self,
+        url: str,
+        channel: str = "oasiz:events",
+        history_limit: int = 1000,
+        worker_id: Optional[str] = None,
+    ):
+        super().__init__(worker_id)
+        # Imported here so the redis package is only needed when configured
+        import redis.asyncio as redis
+
+        self.url = url
+        self.channel = channel
+        self.history_limit = history_limit
+        self.redis = redis.from_url(url)
+        self._pubsub = None
+        self._reader: Optional[asyncio.Task] = None
+
+    async def start(self, handler: EventHandler):
+        self._pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(self.channel)
+        self._reader = asyncio.create_task(self._read(handler))
+        logger.info(f"Redis backplane subscribed to {self.channel} as {self.worker_id}")
+
+    async def _read(self, handler: EventHandler):
+        while True:
+            try:
+                message = await self._pubsub.get_message(timeout=1.0)
+                if message is None:
+                    continue
+                event = json.loads(message["data"])
+                if event.get("origin") == self.worker_id:
+                    continue
+                self.received += 1
+                await handler(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Redis backplane read failed: {e}")
+                await asyncio.sleep(1.0)
+
+    async def stop(self):
+        if self._reader is not None:
+            self._reader.cancel()
+            self._reader = None
+        if self._pubsub is not None:
+            await self._pubsub.unsubscribe(self.channel)
+            await self._pubsub.close()
+            self._pubsub = None
+        await self.redis.close()
+
+    async def publish(self, event: Dict[str, Any]):
+        self.published += 1
+        await self.redis.publish(self.channel, json.dumps(dict(event, origin=self.worker_id)))
+
+    async def next_id(self) -> int:
+        return int(await self.redis.incr(f"{self.channel}:message_id"))
+
+    async def save_message(self, message: Dict[str, Any]):
+        key = f"{self.channel}:history:{message['session_id']}"
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.rpush(key, json.dumps(message))
+            pipe.ltrim(key, -self.history_limit, -1)
+            await pipe.execute()
+
+    async def load_session(self, session_id: str) -> List[Dict[str, Any]]:
+        raw = await self.redis.lrange(f"{self.channel}:history:{session_id}", 0, -1)
+        return [json.loads(item) for item in raw]
+
+def create_backplane(url: Optional[str] = None) -> Backplane:
+    """Build the backplane selected by a URL (``redis://...`` or empty for in-process)"""
+    if url and url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackplane(url)
+    if url:
+        logger.warning(f"Unsupported backplane URL {url}, falling back to in-process")
+    return InProcessBackplane()
@@ -0,0 +1,58 @@
+"""
+Chat history serialization benchmark
+
+Measures the time to build a /chat/history response body for sessions of
+1k and 10k messages three ways: the framework default (jsonable_encoder plus
+the standard JSONResponse), the fast encoder on the same path, and joining
+the bytes the message store cached when each message was added.
+
+Usage (from backend/):
+    python -m benchmarks.bench_history --sizes 1000 10000 --repeat 50
+"""
+
+import argparse
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from message_store import MessageStore
+from serialization import ENCODER, FastJSONResponse, RawJSONResponse
+
+def fill(store: MessageStore, size: int):
+    for index in range(size):
+        store.add({
+            "id": index + 1,
+            "sender": "bot" if index % 2 else "user",
+            "text": f"Message {index}: here's a quick overview of Python's design philosophy 🌟",
+            "timestamp": "2025-07-20T08:15:39.654321",
+            "session_id": "bench-session",
+        })
+
+def timed(build, repeat: int) -> float:
+    """Milliseconds per call, best of ``repeat``"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        build()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"encoder: {ENCODER}")
+    print(f"{'messages':>9}{'default ms':>12}{'fast ms':>10}{'cached ms':>11}{'speedup':>9}")
+    for size in args.sizes:
+        store = MessageStore()
+        fill(store, size)
+        default = timed(lambda: JSONResponse(jsonable_encoder(store.history("bench-session"))), args.repeat)
+        fast = timed(lambda: FastJSONResponse(jsonable_encoder(store.history("bench-session"))), args.repeat)
+        cached = timed(lambda: RawJSONResponse(store.history_json("bench-session")), args.repeat)
+        print(f"{size:>9}{default:>12.2f}{fast:>10.2f}{cached:>11.3f}{default / cached:>8.0f}x")
+
+if __name__ == "__main__":
+    main()
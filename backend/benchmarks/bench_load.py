@@ -0,0 +1,243 @@
+"""
+Load benchmark
+
+Starts the stand-in upstreams and the backend (uvicorn in a subprocess, or an
+already running server with --url), then drives each scenario with a fixed
+number of concurrent clients for a fixed time:
+
+- chat_send:    POST /chat/send
+- chat_history: GET /chat/history
+- ai_stream:    POST /ai/stream, time to first event and to the end of the stream
+- websocket:    one /ws/{session_id} connection per client, message to bot_response
+
+Latencies are reported as p50/p95/p99 with throughput, plus time to first
+token for the streaming scenarios, and can be saved as, or compared against,
+a baseline. --server selects how the backend is started, to compare the
+production launcher (serve.py) with plain or reloading uvicorn. Rate limits
+are off in the backend started here; load shedding stays on.
+
+Usage (from backend/):
+    python -m benchmarks.bench_load --concurrency 20 --duration 5
+    python -m benchmarks.bench_load --scenarios ai_stream --upstream-latency 0.1 --tokens-per-second 50
+    python -m benchmarks.bench_load --baseline benchmarks/baselines/load.json
+    python -m benchmarks.bench_load --server serve --workers 4
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+from dataclasses import replace
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from benchmarks import report
+from stand_ins import UPSTREAMS, StandInConfig, StandInServer
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# One request: returns (latency, time to first token or None)
+Request = Callable[[aiohttp.ClientSession, int], Awaitable[Tuple[float, Optional[float]]]]
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+# How the backend is started: plain uvicorn, the former Dockerfile command
+# (uvicorn with the reloader) or the production launcher, serve.py
+SERVERS = ("uvicorn", "reload", "serve")
+
+# A few benchmark sessions send far more than any user would, so the per-session and
+# per-client rate limits are off unless the env passed to start_backend sets them
+RATE_LIMITS_OFF = {"RATE_LIMIT_SESSION_RATE": "0", "RATE_LIMIT_CLIENT_RATE": "0"}
+
+def start_backend(port: int, env: Dict[str, str], workers: int, server: str = "uvicorn") -> subprocess.Popen:
+    if server == "serve":
+        command = [
+            sys.executable, "serve.py", "--host", "127.0.0.1", "--port", str(port),
+            "--log-level", "warning", "--no-access-log", "--workers", str(workers),
+        ]
+    else:
+        command = [
+            sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+            "--log-level", "warning", "--no-access-log",
+        ]
+        command += ["--reload"] if server == "reload" else ["--workers", str(workers)]
+    return subprocess.Popen(command, cwd=BACKEND_DIR, env=dict(os.environ, **RATE_LIMITS_OFF, **env))
+
+async def wait_ready(url: str, timeout: float = 20.0):
+    deadline = time.perf_counter() + timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.get(f"{url}/health") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            if time.perf_counter() > deadline:
+                raise RuntimeError(f"Backend at {url} did not become ready")
+            await asyncio.sleep(0.1)
+
+def scenarios(url: str) -> Dict[str, Request]:
+    async def chat_send(session: aiohttp.ClientSession, client: int):
+        started = time.perf_counter()
+        body = {"sender": "user", "text": "Benchmark message", "session_id": f"bench-{client}"}
+        async with session.post(f"{url}/chat/send", json=body) as response:
+            await response.read()
+            response.raise_for_status()
+        return time.perf_counter() - started, None
+
+    async def chat_history(session: aiohttp.ClientSession, client: int):
+        started = time.perf_counter()
+        async with session.get(f"{url}/chat/history", params={"session_id": f"bench-{client}"}) as response:
+            await response.read()
+            response.raise_for_status()
+        return time.perf_counter() - started, None
+
+    async def ai_stream(session: aiohttp.ClientSession, client: int):
+        started = time.perf_counter()
+        first = None
+        body = {"message": "Tell me about Python", "session_id": f"bench-{client}"}
+        async with session.post(f"{url}/ai/stream", json=body) as response:
+            response.raise_for_status()
+            async for line in response.content:
+                if first is None and line.startswith(b"data: "):
+                    first = time.perf_counter() - started
+        return time.perf_counter() - started, first
+
+    return {"chat_send": chat_send, "chat_history": chat_history, "ai_stream": ai_stream}
+
+async def run_http(request: Request, concurrency: int, duration: float) -> Dict[str, float]:
+    latencies: List[float] = []
+    first_tokens: List[float] = []
+    errors = 0
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        deadline = time.perf_counter() + duration
+
+        async def client(index: int):
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                try:
+                    latency, first = await request(session, index)
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    errors += 1
+                    continue
+                latencies.append(latency)
+                if first is not None:
+                    first_tokens.append(first)
+
+        started = time.perf_counter()
+        await asyncio.gather(*[client(index) for index in range(concurrency)])
+        elapsed = time.perf_counter() - started
+    summary = report.summarize(latencies, elapsed, errors)
+    if first_tokens:
+        summary.update(report.summarize(first_tokens, elapsed, prefix="ttft_"))
+    return summary
+
+async def run_websocket(url: str, concurrency: int, duration: float) -> Dict[str, float]:
+    ws_url = url.replace("http", "ws", 1)
+    latencies: List[float] = []
+    first_frames: List[float] = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def client(session: aiohttp.ClientSession, index: int):
+        nonlocal errors
+        async with session.ws_connect(f"{ws_url}/ws/bench-ws-{index}", protocols=["oasiz.json"]) as ws:
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                first = None
+                await ws.send_str(json.dumps({"type": "message", "message": "Tell me about Python"}))
+                while True:
+                    frame = await ws.receive(timeout=30)
+                    if frame.type != aiohttp.WSMsgType.TEXT:
+                        errors += 1
+                        return
+                    if first is None:
+                        first = time.perf_counter() - started
+                    data = json.loads(frame.data)
+                    if data.get("type") in ("bot_response", "error"):
+                        break
+                if data["type"] == "error":
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+                first_frames.append(first)
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*[client(session, index) for index in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    summary = report.summarize(latencies, elapsed, errors)
+    # The acknowledgement is the first frame back, the WebSocket counterpart of a first token
+    summary.update(report.summarize(first_frames, elapsed, prefix="ttft_"))
+    return summary
+
+async def run(args) -> report.Results:
+    config = StandInConfig(latency=args.upstream_latency, tokens_per_second=args.tokens_per_second)
+    stand_in = StandInServer(configs={name: replace(config) for name in UPSTREAMS}, seed=1)
+    backend = None
+    with stand_in.running():
+        url = args.url
+        if url is None:
+            port = free_port()
+            env = dict(stand_in.base_urls(), OPENAI_API_KEY="sk-stand-in", WEATHER_API_KEY="stand-in-weather-key")
+            backend = start_backend(port, env, args.workers, args.server)
+            url = f"http://127.0.0.1:{port}"
+        try:
+            await wait_ready(url)
+            requests = scenarios(url)
+            results: report.Results = {}
+            print(f"{'scenario':<14}{'reqs':>7}{'errs':>6}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'ttft p50':>10}{'ttft p95':>10}")
+            for name in args.scenarios:
+                if name == "websocket":
+                    summary = await run_websocket(url, args.concurrency, args.duration)
+                else:
+                    summary = await run_http(requests[name], args.concurrency, args.duration)
+                results[name] = summary
+                ttft = "".join(f"{summary.get(key, float('nan')):>10.1f}" for key in ("ttft_p50_ms", "ttft_p95_ms"))
+                print(
+                    f"{name:<14}{summary['requests']:>7}{summary['errors']:>6}{summary['throughput']:>9.1f}"
+                    f"{summary['p50_ms']:>9.1f}{summary['p95_ms']:>9.1f}{summary['p99_ms']:>9.1f}{ttft}"
+                )
+            return results
+        finally:
+            if backend is not None:
+                backend.terminate()
+                backend.wait(timeout=10)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", default=["chat_send", "chat_history", "ai_stream", "websocket"],
+                        choices=["chat_send", "chat_history", "ai_stream", "websocket"])
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent clients per scenario")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds per scenario")
+    parser.add_argument("--url", help="Benchmark a running backend instead of starting one")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the started backend")
+    parser.add_argument("--server", choices=SERVERS, default="uvicorn", help="How to start the backend")
+    parser.add_argument("--upstream-latency", type=float, default=0.02, help="Stand-in upstream latency in seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="Stand-in streaming speed")
+    parser.add_argument("--baseline", help="Compare against this baseline file and exit 1 on regressions")
+    parser.add_argument("--save-baseline", help="Write the results to this baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed change before a regression")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    results = asyncio.run(run(args))
+    if args.save_baseline:
+        report.save(args.save_baseline, results)
+    if args.baseline:
+        metrics = ["p50_ms", "p95_ms", "throughput", "ttft_p95_ms"]
+        sys.exit(report.check(results, args.baseline, metrics, args.tolerance))
+
+if __name__ == "__main__":
+    main()
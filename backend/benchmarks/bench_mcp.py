@@ -0,0 +1,89 @@
+"""
+MCP execution benchmark
+
+Starts local streamable HTTP MCP servers that take a fixed time per tool
+call and runs the same set of calls three ways: one execute_tool at a time,
+execute_many against servers that accept JSON-RPC batches, and execute_many
+against servers that do not (pipelined requests over one session).
+
+Usage (from backend/):
+    python -m benchmarks.bench_mcp --servers 3 --calls 10 --latency 0.05
+"""
+
+import argparse
+import asyncio
+import time
+
+from aiohttp import web
+
+from mcp_integration import MCPManager, MCPServer
+
+async def start_server(latency: float, protocol_version: str):
+    """MCP server whose tool calls take ``latency`` seconds each"""
+    async def answer(message):
+        if message["method"] == "tools/call":
+            await asyncio.sleep(latency)
+            result = {"content": [{"type": "text", "text": "ok"}]}
+        else:
+            result = {"protocolVersion": protocol_version, "capabilities": {"tools": {}}, "serverInfo": {"name": "bench"}}
+        return {"jsonrpc": "2.0", "id": message["id"], "result": result}
+
+    async def handle(request: web.Request) -> web.Response:
+        payload = await request.json()
+        if isinstance(payload, list):
+            return web.json_response(await asyncio.gather(*[answer(m) for m in payload if "id" in m]))
+        if "id" not in payload:
+            return web.Response(status=202)
+        return web.json_response(await answer(payload))
+
+    app = web.Application()
+    app.router.add_post("/mcp", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/mcp"
+
+async def measure(servers: int, calls: int, latency: float, protocol_version: str, mode: str) -> float:
+    started_servers = [await start_server(latency, protocol_version) for _ in range(servers)]
+    manager = MCPManager(idle_timeout=0, health_interval=0)
+    for index, (_, url) in enumerate(started_servers):
+        manager.servers[f"s{index}"] = MCPServer(f"s{index}", url, ["bench"], "benchmark server")
+    work = [(f"s{index}", "bench", {"i": i}) for index in range(servers) for i in range(calls)]
+    try:
+        for name in list(manager.servers)[-servers:]:
+            await manager.connect_to_server(name)
+        started = time.perf_counter()
+        if mode == "sequential":
+            for server_name, tool_name, params in work:
+                await manager.execute_tool(server_name, tool_name, params)
+        else:
+            await manager.execute_many(work)
+        return time.perf_counter() - started
+    finally:
+        await manager.pool.stop()
+        for runner, _ in started_servers:
+            await runner.cleanup()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--servers", type=int, default=3)
+    parser.add_argument("--calls", type=int, default=10, help="calls per server")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per tool call")
+    args = parser.parse_args()
+
+    runs = [
+        ("sequential", "2025-03-26", "sequential"),
+        ("execute_many, batched", "2025-03-26", "many"),
+        ("execute_many, pipelined", "2025-06-18", "many"),
+    ]
+    total = args.servers * args.calls
+    print(f"{total} calls over {args.servers} servers, {args.latency * 1000:.0f} ms each")
+    baseline = None
+    for label, protocol_version, mode in runs:
+        elapsed = asyncio.run(measure(args.servers, args.calls, args.latency, protocol_version, mode))
+        baseline = baseline or elapsed
+        print(f"{label:<26}{elapsed * 1000:>9.1f} ms{baseline / elapsed:>8.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Microbenchmarks
+
+Times the in-process hot paths of a chat turn in isolation: message routing,
+message store appends and reads, serialization and the search cache. Each
+benchmark reports nanoseconds per operation (best of several repeats) and
+can be saved as, or compared against, a baseline.
+
+Usage (from backend/):
+    python -m benchmarks.bench_micro
+    python -m benchmarks.bench_micro --baseline benchmarks/baselines/micro.json
+    python -m benchmarks.bench_micro --save-baseline benchmarks/baselines/micro.json
+"""
+
+import argparse
+import asyncio
+import gc
+import itertools
+import logging
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+from benchmarks import report
+from generations import Generation
+from message_store import MessageStore
+from search_cache import SearchCache
+from serialization import ENCODER, dumps
+from ws_codec import JSON_CODEC, MSGPACK_CODEC, msgpack
+
+MESSAGE = {
+    "id": 1,
+    "sender": "bot",
+    "text": "Here's a quick overview of Python's design philosophy 🌟 Readability counts.",
+    "timestamp": "2025-07-20T08:15:39.654321",
+    "session_id": "bench-session",
+}
+
+def make_store(size: int) -> MessageStore:
+    store = MessageStore()
+    for index in range(size):
+        store.add(dict(MESSAGE, id=index + 1))
+    return store
+
+def routing_benchmarks() -> Dict[str, Callable]:
+    import main
+    from mcp_integration import MCP_PATTERNS, mcp_manager
+
+    message = "Can you tell me about the history of the Python programming language?"
+
+    def fast_path():
+        for pattern, _ in main.FAST_PATH_PATTERNS:
+            pattern.match(message)
+
+    def mcp_route():
+        for pattern, tool_name in MCP_PATTERNS:
+            if pattern.search("git status please"):
+                mcp_manager.server_for(tool_name)
+
+    return {"routing.fast_path_miss": fast_path, "routing.mcp_index": mcp_route}
+
+def storage_benchmarks() -> Dict[str, Callable]:
+    appended = MessageStore()
+    ids = itertools.count(1)
+    history = make_store(1000)
+    return {
+        "storage.append": lambda: appended.add(dict(MESSAGE, id=next(ids))),
+        "storage.history_1k": lambda: history.history("bench-session"),
+        "storage.history_json_1k": lambda: history.history_json("bench-session"),
+    }
+
+def serialization_benchmarks() -> Dict[str, Callable]:
+    frame = {"type": "bot_response", "message": MESSAGE, "generation_id": "1"}
+    benchmarks = {
+        "serialization.dumps_message": lambda: dumps(MESSAGE),
+        "serialization.ws_json_frame": lambda: JSON_CODEC.encode(frame),
+    }
+    if msgpack is not None:
+        benchmarks["serialization.ws_msgpack_frame"] = lambda: MSGPACK_CODEC.encode(frame)
+    generation = Generation("bench-session", buffer_size=1024)
+    benchmarks["stream.generation_append"] = lambda: generation.append("token ")
+    return benchmarks
+
+def cache_benchmarks() -> Dict[str, Callable]:
+    cache = SearchCache(max_entries=1024)
+    keys = itertools.count()
+
+    async def fetch(query: str):
+        return {"kind": "answer", "text": query}, False
+
+    async def hit():
+        await cache.get_or_fetch("python programming language", fetch)
+
+    async def miss():
+        await cache.get_or_fetch(f"query {next(keys)}", fetch)
+
+    return {"cache.search_hit": hit, "cache.search_miss_store": miss}
+
+def measure(operation: Callable, number: int, repeat: int) -> float:
+    """Best nanoseconds per call over ``repeat`` runs of ``number`` calls, without GC pauses"""
+    gc.collect()
+    gc.disable()
+    try:
+        return _measure(operation, number, repeat)
+    finally:
+        gc.enable()
+
+def _measure(operation: Callable, number: int, repeat: int) -> float:
+    if asyncio.iscoroutinefunction(operation):
+        async def run_async() -> float:
+            best = float("inf")
+            for _ in range(repeat):
+                started = time.perf_counter_ns()
+                for _ in range(number):
+                    await operation()
+                best = min(best, (time.perf_counter_ns() - started) / number)
+            return best
+        return asyncio.run(run_async())
+
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter_ns()
+        for _ in range(number):
+            operation()
+        best = min(best, (time.perf_counter_ns() - started) / number)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=2000, help="Calls per timed run")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--filter", default="", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--baseline", help="Compare against this baseline file and exit 1 on regressions")
+    parser.add_argument("--save-baseline", help="Write the results to this baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed slowdown before a regression")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    benchmarks: List[Tuple[str, Callable]] = []
+    for group in (routing_benchmarks, storage_benchmarks, serialization_benchmarks, cache_benchmarks):
+        benchmarks.extend(group().items())
+
+    print(f"encoder: {ENCODER}")
+    print(f"{'benchmark':<34}{'ns/op':>12}{'ops/sec':>14}")
+    results: report.Results = {}
+    for name, operation in benchmarks:
+        if args.filter not in name:
+            continue
+        ns = measure(operation, args.number, args.repeat)
+        results[name] = {"ns_per_op": ns, "ops_per_sec": 1e9 / ns}
+        print(f"{name:<34}{ns:>12.0f}{1e9 / ns:>14.0f}")
+
+    if args.save_baseline:
+        report.save(args.save_baseline, results)
+    if args.baseline:
+        sys.exit(report.check(results, args.baseline, ["ns_per_op"], args.tolerance))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Traffic replay benchmark
+
+Re-issues a log written by the traffic recorder (TRAFFIC_RECORD_PATH)
+against a local backend with stand-in upstreams, keeping the recorded
+arrival times at 1x or a scaled speed. HTTP requests are sent with bodies
+synthesized from their recorded shapes; each recorded WebSocket connection
+is reopened and sends its frames at their recorded offsets.
+
+Latency is reported per route with p50/p95/p99, time to first chunk for
+streams and the recorded production latency for comparison. Schedule lag
+shows how late the replayer issued requests; when it grows, the replay is
+limited by this client rather than by the backend.
+
+Usage (from backend/):
+    python -m benchmarks.bench_replay traffic.jsonl.gz
+    python -m benchmarks.bench_replay traffic.jsonl --speed 4 --baseline benchmarks/baselines/replay.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from collections import defaultdict, deque
+from dataclasses import replace
+from typing import Any, Deque, Dict, List
+
+import aiohttp
+
+from benchmarks import report
+from benchmarks.bench_load import free_port, start_backend, wait_ready
+from stand_ins import UPSTREAMS, StandInConfig, StandInServer
+from traffic import read_log, synthesize
+
+class Replay:
+    """Schedules recorded traffic and collects latencies per route"""
+
+    def __init__(self, url: str, speed: float):
+        self.url = url
+        self.speed = speed
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.first_chunks: Dict[str, List[float]] = defaultdict(list)
+        self.recorded: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.lag: List[float] = []
+        self.started = 0.0
+
+    async def wait_until(self, offset: float):
+        """Sleep until a recorded offset, scaled by the replay speed"""
+        delay = self.started + offset / self.speed - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            self.lag.append(-delay)
+
+    async def http(self, session: aiohttp.ClientSession, record: Dict[str, Any]):
+        route = f"{record['m']} {record.get('r') or record['p']}"
+        query = {k: synthesize(v) for k, v in (record.get("q") or {}).items()}
+        body = synthesize(record["b"]) if "b" in record else None
+        self.recorded[route].append(record["d"])
+        started = time.perf_counter()
+        first = None
+        try:
+            async with session.request(record["m"], self.url + record["p"], params=query, json=body) as response:
+                async for _ in response.content.iter_any():
+                    if first is None:
+                        first = time.perf_counter() - started
+                if response.status >= 500:
+                    self.errors[route] += 1
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.errors[route] += 1
+            return
+        self.latencies[route].append(time.perf_counter() - started)
+        if first is not None and record.get("n", 0) > 1:
+            self.first_chunks[route].append(first)
+
+    async def websocket(self, session: aiohttp.ClientSession, events: List[Dict[str, Any]]):
+        opening = events[0]
+        route = "WEBSOCKET /ws/{session_id}"
+        ws_url = self.url.replace("http", "ws", 1) + opening["p"]
+        sent: Deque[float] = deque()
+        try:
+            async with session.ws_connect(ws_url, protocols=opening.get("sp") or ()) as ws:
+                async def receive():
+                    async for frame in ws:
+                        if frame.type != aiohttp.WSMsgType.TEXT:
+                            continue
+                        kind = json.loads(frame.data).get("type")
+                        if kind in ("bot_response", "error") and sent:
+                            started = sent.popleft()
+                            if kind == "error":
+                                self.errors[route] += 1
+                            else:
+                                self.latencies[route].append(time.perf_counter() - started)
+
+                receiver = asyncio.create_task(receive())
+                for event in events[1:]:
+                    await self.wait_until(event["t"])
+                    if event["e"] == "in":
+                        frame = synthesize(event["b"])
+                        if isinstance(frame, dict) and frame.get("type") == "message":
+                            sent.append(time.perf_counter())
+                        await ws.send_str(json.dumps(frame))
+                # Let replies to the last messages arrive before closing
+                deadline = time.perf_counter() + 30
+                while sent and time.perf_counter() < deadline:
+                    await asyncio.sleep(0.01)
+                receiver.cancel()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.errors[route] += 1
+
+    async def run(self, records: List[Dict[str, Any]]):
+        connections: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+        for record in records:
+            if record["k"] == "ws":
+                connections[record["c"]].append(record)
+        tasks = []
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            self.started = time.perf_counter()
+            for record in records:
+                if record["k"] == "http":
+                    await self.wait_until(record["t"])
+                    tasks.append(asyncio.create_task(self.http(session, record)))
+                elif record["e"] == "open":
+                    await self.wait_until(record["t"])
+                    tasks.append(asyncio.create_task(self.websocket(session, connections[record["c"]])))
+            await asyncio.gather(*tasks)
+        return time.perf_counter() - self.started
+
+    def results(self, elapsed: float) -> report.Results:
+        results: report.Results = {}
+        for route in sorted(set(self.latencies) | set(self.errors)):
+            summary = report.summarize(self.latencies[route], elapsed, self.errors[route])
+            if self.first_chunks[route]:
+                summary.update(report.summarize(self.first_chunks[route], elapsed, prefix="ttft_"))
+            if self.recorded[route]:
+                summary["recorded_p95_ms"] = report.percentile(sorted(self.recorded[route]), 0.95) * 1000
+            results[route] = summary
+        return results
+
+async def run(args) -> report.Results:
+    records = read_log(args.log)
+    if args.limit:
+        records = records[:args.limit]
+    config = StandInConfig(latency=args.upstream_latency, tokens_per_second=args.tokens_per_second)
+    stand_in = StandInServer(configs={name: replace(config) for name in UPSTREAMS}, seed=1)
+    backend = None
+    with stand_in.running():
+        url = args.url
+        if url is None:
+            port = free_port()
+            env = dict(stand_in.base_urls(), OPENAI_API_KEY="sk-stand-in", WEATHER_API_KEY="stand-in-weather-key")
+            backend = start_backend(port, env, args.workers)
+            url = f"http://127.0.0.1:{port}"
+        try:
+            await wait_ready(url)
+            replay = Replay(url, args.speed)
+            elapsed = await replay.run(records)
+        finally:
+            if backend is not None:
+                backend.terminate()
+                backend.wait(timeout=10)
+
+    results = replay.results(elapsed)
+    lag = sorted(replay.lag)
+    print(f"replayed {len(records)} records in {elapsed:.1f}s at {args.speed:g}x; "
+          f"schedule lag p95 {report.percentile(lag, 0.95) * 1000 if lag else 0.0:.1f} ms")
+    print(f"{'route':<36}{'reqs':>6}{'errs':>6}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'ttft p95':>10}{'rec p95':>9}")
+    for route, summary in results.items():
+        print(
+            f"{route:<36}{summary['requests']:>6}{summary['errors']:>6}{summary['p50_ms']:>9.1f}"
+            f"{summary['p95_ms']:>9.1f}{summary['p99_ms']:>9.1f}{summary.get('ttft_p95_ms', float('nan')):>10.1f}"
+            f"{summary.get('recorded_p95_ms', float('nan')):>9.1f}"
+        )
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("log", help="Traffic log written by the recorder")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed; 2 replays twice as fast")
+    parser.add_argument("--limit", type=int, default=0, help="Only replay the first N records")
+    parser.add_argument("--url", help="Replay against a running backend instead of starting one")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the started backend")
+    parser.add_argument("--upstream-latency", type=float, default=0.02, help="Stand-in upstream latency in seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="Stand-in streaming speed")
+    parser.add_argument("--baseline", help="Compare against this baseline file and exit 1 on regressions")
+    parser.add_argument("--save-baseline", help="Write the results to this baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed change before a regression")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    results = asyncio.run(run(args))
+    if args.save_baseline:
+        report.save(args.save_baseline, results)
+    if args.baseline:
+        sys.exit(report.check(results, args.baseline, ["p50_ms", "p95_ms", "ttft_p95_ms"], args.tolerance))
+
+if __name__ == "__main__":
+    main()
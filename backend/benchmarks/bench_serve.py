@@ -0,0 +1,75 @@
+"""
+Server mode comparison
+
+Runs the load benchmark (bench_load) against the backend started each way
+and prints throughput and p95 latency per scenario side by side, relative to
+the first mode. The default compares the former Dockerfile command
+(uvicorn with --reload) with the production launcher, serve.py, at one
+worker and at one worker per CPU.
+
+Multiple workers only pay off with CPUs to spare for them: on a single core
+the benchmark client and the workers compete for the same CPU.
+
+Usage (from backend/):
+    python -m benchmarks.bench_serve
+    python -m benchmarks.bench_serve --modes reload serve:1 serve:4 --duration 10
+"""
+
+import argparse
+import asyncio
+import logging
+from argparse import Namespace
+from typing import Dict, List
+
+from benchmarks import bench_load, report
+from serve import cpu_count
+
+def parse_mode(mode: str) -> Namespace:
+    """``server[:workers]``, e.g. ``reload`` or ``serve:4``"""
+    server, _, workers = mode.partition(":")
+    if server not in bench_load.SERVERS:
+        raise argparse.ArgumentTypeError(f"Unknown server {server!r}")
+    return Namespace(name=mode, server=server, workers=int(workers or 1))
+
+def print_comparison(modes: List[Namespace], results: Dict[str, report.Results]):
+    base = modes[0].name
+    print(f"\n{'scenario':<14}{'mode':<12}{'req/s':>9}{'vs ' + base:>14}{'p95 ms':>9}{'vs ' + base:>14}")
+    for scenario in results[base]:
+        for mode in modes:
+            summary = results[mode.name][scenario]
+            reference = results[base][scenario]
+            throughput = summary["throughput"] / reference["throughput"] - 1 if reference["throughput"] else 0.0
+            p95 = summary["p95_ms"] / reference["p95_ms"] - 1 if reference["p95_ms"] else 0.0
+            print(
+                f"{scenario:<14}{mode.name:<12}{summary['throughput']:>9.1f}{throughput:>+14.1%}"
+                f"{summary['p95_ms']:>9.1f}{p95:>+14.1%}"
+            )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", type=parse_mode,
+                        default=[parse_mode("reload"), parse_mode("serve:1"), parse_mode(f"serve:{cpu_count()}")])
+    parser.add_argument("--scenarios", nargs="+", default=["chat_send", "chat_history", "ai_stream", "websocket"],
+                        choices=["chat_send", "chat_history", "ai_stream", "websocket"])
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent clients per scenario")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds per scenario")
+    parser.add_argument("--upstream-latency", type=float, default=0.02, help="Stand-in upstream latency in seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="Stand-in streaming speed")
+    parser.add_argument("--save", help="Write the results of every mode to this file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    # Drop duplicates such as serve:1 twice on a single CPU
+    modes = list({mode.name: mode for mode in args.modes}.values())
+    results: Dict[str, report.Results] = {}
+    for mode in modes:
+        print(f"\n== {mode.name}")
+        run_args = Namespace(**vars(args), url=None, server=mode.server, workers=mode.workers)
+        results[mode.name] = asyncio.run(bench_load.run(run_args))
+    print_comparison(modes, results)
+    if args.save:
+        report.save(args.save, {f"{mode}/{scenario}": summary
+                                for mode, scenarios in results.items() for scenario, summary in scenarios.items()})
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Sharded throughput benchmark
+
+Starts the backend in sharded mode with an increasing number of workers and
+measures request throughput against a mixed /chat/send + /chat/history load
+spread over many sessions. Throughput should grow with the worker count up to
+the number of available cores. More than one worker needs a shared
+backplane, so set BACKPLANE_URL (a local Redis will do).
+
+Usage (from backend/):
+    BACKPLANE_URL=redis://localhost:6379 python -m benchmarks.bench_sharding --workers 1 2 4 --duration 10
+"""
+
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+async def wait_ready(url: str, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(f"{url}/health") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f"{url} did not become ready")
+
+async def drive(url: str, sessions: int, concurrency: int, duration: float, history_size: int) -> float:
+    """Run the mixed load and return requests per second"""
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        # Seed every session so history reads do real serialization work
+        for index in range(sessions):
+            for _ in range(history_size):
+                async with session.post(f"{url}/chat/send", json={
+                    "sender": "user", "text": "seed message " * 4, "session_id": f"bench-{index}"
+                }) as response:
+                    await response.read()
+
+        completed = 0
+        deadline = time.perf_counter() + duration
+
+        async def client(worker: int):
+            nonlocal completed
+            request = worker
+            while time.perf_counter() < deadline:
+                session_id = f"bench-{request % sessions}"
+                if request % 10 == 0:
+                    async with session.post(f"{url}/chat/send", json={
+                        "sender": "user", "text": "hello", "session_id": session_id
+                    }) as response:
+                        await response.read()
+                else:
+                    async with session.get(f"{url}/chat/history", params={"session_id": session_id}) as response:
+                        await response.read()
+                completed += 1
+                request += concurrency
+
+        started = time.perf_counter()
+        await asyncio.gather(*[client(worker) for worker in range(concurrency)])
+        return completed / (time.perf_counter() - started)
+
+def run_cluster(workers: int, args) -> float:
+    command = [
+        sys.executable, "sharding.py", "serve", "--workers", str(workers),
+        "--host", "127.0.0.1", "--port", str(args.port), "--base-port", str(args.base_port),
+    ]
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{args.port}"
+    try:
+        asyncio.run(wait_ready(url))
+        return asyncio.run(drive(url, args.sessions, args.concurrency, args.duration, args.history_size))
+    finally:
+        process.send_signal(signal.SIGINT)
+        process.wait(timeout=30)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--history-size", type=int, default=20)
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--base-port", type=int, default=8190)
+    args = parser.parse_args()
+    if max(args.workers) > 1 and not os.getenv("BACKPLANE_URL"):
+        parser.error("more than one worker needs a shared backplane; set BACKPLANE_URL")
+
+    print(f"cores available: {os.cpu_count()}")
+    baseline = None
+    for workers in args.workers:
+        throughput = run_cluster(workers, args)
+        baseline = baseline or throughput
+        print(f"workers={workers:<3} {throughput:10.1f} req/s  x{throughput / baseline:.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Cold start benchmark
+
+Reports what a cold start of the backend costs:
+
+- Import time of the app module in a fresh interpreter, best of several
+  runs, with the modules that took longest by themselves according to
+  ``python -X importtime``
+- Time from spawning the server to its first successful /health response,
+  per server mode, with the milestones the app itself recorded (see
+  startup.py) read back from /stats
+
+Results can be saved as, or compared against, a baseline.
+
+Usage (from backend/):
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --modes uvicorn serve:1 serve:2 --runs 5
+    python -m benchmarks.bench_startup --baseline benchmarks/baselines/startup.json
+"""
+
+import argparse
+import asyncio
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import aiohttp
+
+from benchmarks import report
+from benchmarks.bench_load import BACKEND_DIR, free_port, start_backend, wait_ready
+from benchmarks.bench_serve import parse_mode
+
+IMPORT_SCRIPT = "import time; started = time.perf_counter(); import {module}; print(time.perf_counter() - started)"
+
+def import_seconds(module: str) -> float:
+    """Seconds ``import module`` takes in a fresh interpreter"""
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT.format(module=module)],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+    ).stdout
+    return float(output.split()[-1])
+
+def import_profile(module: str) -> List[Tuple[str, float, float]]:
+    """(module, self ms, cumulative ms) for every module imported by ``import module``"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+    ).stderr
+    modules = []
+    for line in stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        modules.append((name.strip(), int(own) / 1000, int(cumulative) / 1000))
+    return modules
+
+def print_profile(modules: List[Tuple[str, float, float]], top: int):
+    packages: Dict[str, float] = {}
+    for name, own, _ in modules:
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0.0) + own
+    print(f"\n{'package':<32}{'ms':>9}")
+    for package, own in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+        print(f"{package:<32}{own:>9.1f}")
+    print(f"\n{'module':<48}{'self ms':>9}{'cumul ms':>10}")
+    for name, own, cumulative in sorted(modules, key=lambda module: -module[1])[:top]:
+        print(f"{name:<48}{own:>9.1f}{cumulative:>10.1f}")
+
+async def time_to_first_response(mode: argparse.Namespace) -> Dict[str, float]:
+    """Seconds from spawning the server until /health answers, and the app's own milestones"""
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    process = start_backend(port, {}, mode.workers, mode.server)
+    try:
+        await wait_ready(url, timeout=60.0)
+        ready = time.perf_counter() - started
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"{url}/stats") as response:
+                milestones = (await response.json())["startup"]
+    finally:
+        process.terminate()
+        process.wait()
+    return {
+        "first_response_ms": ready * 1000,
+        **{f"{name}_ms": milestones[name] * 1000 for name in ("app_imported", "ready") if name in milestones},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main", help="Module whose import is timed")
+    parser.add_argument("--modes", nargs="+", type=parse_mode,
+                        default=[parse_mode("uvicorn"), parse_mode("serve:1")])
+    parser.add_argument("--runs", type=int, default=3, help="Cold starts per measurement; the best one counts")
+    parser.add_argument("--top", type=int, default=15, help="Slowest packages and modules to list")
+    parser.add_argument("--baseline", help="Compare against this baseline file and exit 1 on regressions")
+    parser.add_argument("--save-baseline", help="Write the results to this baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed slowdown before a regression")
+    args = parser.parse_args()
+
+    results: report.Results = {}
+    seconds = [import_seconds(args.module) for _ in range(args.runs)]
+    results[f"import/{args.module}"] = {"import_ms": min(seconds) * 1000, "median_ms": statistics.median(seconds) * 1000}
+    print(f"import {args.module}: best {min(seconds) * 1000:.1f} ms, median {statistics.median(seconds) * 1000:.1f} ms")
+    print_profile(import_profile(args.module), args.top)
+
+    print(f"\n{'mode':<12}{'first 200 ms':>14}{'imported ms':>13}{'ready ms':>10}")
+    for mode in {mode.name: mode for mode in args.modes}.values():
+        runs = [asyncio.run(time_to_first_response(mode)) for _ in range(args.runs)]
+        best = min(runs, key=lambda run: run["first_response_ms"])
+        results[f"serve/{mode.name}"] = best
+        print(
+            f"{mode.name:<12}{best['first_response_ms']:>14.1f}"
+            f"{best.get('app_imported_ms', float('nan')):>13.1f}{best.get('ready_ms', float('nan')):>10.1f}"
+        )
+
+    if args.save_baseline:
+        report.save(args.save_baseline, results)
+    if args.baseline:
+        sys.exit(report.check(results, args.baseline, ["import_ms", "first_response_ms"], args.tolerance))
+
+if __name__ == "__main__":
+    main()
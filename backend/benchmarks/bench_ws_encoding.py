@@ -0,0 +1,75 @@
+"""
+WebSocket encoding benchmark
+
+Compares bytes on the wire and encode CPU time per chat turn (acknowledgement
+plus bot response) for each negotiated frame codec, with and without
+permessage-deflate. Deflate is modelled as RFC 7692 does it: one raw deflate
+stream per connection with context takeover, flushed per message.
+
+Usage (from backend/):
+    python -m benchmarks.bench_ws_encoding --turns 5000
+"""
+
+import argparse
+import random
+import time
+import zlib
+
+from ws_codec import LEGACY_CODEC, JSON_CODEC, MSGPACK_CODEC, msgpack
+
+REPLY = (
+    "Here's a quick overview! 🌟 Python is a high-level, general-purpose programming language. "
+    "Its design philosophy emphasizes code readability with the use of significant indentation. "
+    "Python is dynamically typed and garbage-collected, and it supports multiple programming "
+    "paradigms, including structured, object-oriented and functional programming. Want an example?"
+)
+
+def make_turn(index: int):
+    # Vary the reply so deflate cannot simply reference the previous turn
+    words = REPLY.split()
+    random.Random(index).shuffle(words)
+    session_id = "3f2b8c1e-5d4a-4c3b-9a8e-7f6d5c4b3a21"
+    user = {
+        "id": 2 * index + 1, "sender": "user", "text": "Can you tell me about Python?",
+        "timestamp": "2025-07-20T08:15:38.123456", "session_id": session_id,
+    }
+    bot = {
+        "id": 2 * index + 2, "sender": "bot", "text": " ".join(words),
+        "timestamp": "2025-07-20T08:15:39.654321", "session_id": session_id,
+    }
+    return user, bot
+
+def measure(codec, turns: int, deflate: bool):
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+    wire_bytes = 0
+    conversation = [make_turn(index) for index in range(turns)]
+    started = time.process_time()
+    for user, bot in conversation:
+        for frame in (codec.ack(user), {"type": "bot_response", "message": bot}):
+            payload = codec.encode(frame)
+            if isinstance(payload, str):
+                payload = payload.encode("utf-8")
+            if deflate:
+                # RFC 7692 strips the trailing empty block of each flushed message
+                payload = (compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH))[:-4]
+            # Server frames are unmasked: 2 header bytes, plus 2 for payloads over 125 bytes
+            wire_bytes += len(payload) + (2 if len(payload) <= 125 else 4)
+    cpu = time.process_time() - started
+    return wire_bytes / turns, cpu / turns * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=5000)
+    args = parser.parse_args()
+
+    codecs = [LEGACY_CODEC, JSON_CODEC] + ([MSGPACK_CODEC] if msgpack is not None else [])
+    baseline = None
+    print(f"{'codec':<16}{'deflate':<9}{'bytes/turn':>12}{'vs legacy':>11}{'cpu us/turn':>13}")
+    for codec in codecs:
+        for deflate in (False, True):
+            size, cpu = measure(codec, args.turns, deflate)
+            baseline = baseline or size
+            print(f"{codec.name:<16}{str(deflate):<9}{size:>12.1f}{size / baseline:>10.2f}x{cpu:>13.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmark reporting
+
+Percentile summaries shared by the benchmark suite, and the comparison of a
+run against a stored baseline. Baselines are JSON files mapping each
+benchmark name to its metrics; a metric regresses when it is worse than the
+baseline by more than the tolerance, in the direction that matters for it.
+"""
+
+import json
+import math
+from typing import Dict, List, Sequence
+
+# Metrics where a larger value is better; every other metric is a cost
+HIGHER_IS_BETTER = {"throughput", "ops_per_sec"}
+
+Results = Dict[str, Dict[str, float]]
+
+def percentile(ordered: Sequence[float], fraction: float) -> float:
+    """Nearest-rank percentile of already sorted values"""
+    if not ordered:
+        return math.nan
+    index = max(0, math.ceil(fraction * len(ordered)) - 1)
+    return ordered[index]
+
+def summarize(latencies: List[float], elapsed: float, errors: int = 0, prefix: str = "") -> Dict[str, float]:
+    """p50/p95/p99 in milliseconds and requests per second for one scenario"""
+    ordered = sorted(latencies)
+    summary = {
+        f"{prefix}p50_ms": percentile(ordered, 0.50) * 1000,
+        f"{prefix}p95_ms": percentile(ordered, 0.95) * 1000,
+        f"{prefix}p99_ms": percentile(ordered, 0.99) * 1000,
+    }
+    if not prefix:
+        summary["requests"] = len(latencies)
+        summary["errors"] = errors
+        summary["throughput"] = len(latencies) / elapsed if elapsed > 0 else 0.0
+    return summary
+
+def compare(results: Results, baseline: Results, metrics: Sequence[str], tolerance: float) -> List[str]:
+    """Describe every compared metric that regressed past the tolerance"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for metric in metrics:
+            if metric not in current or metric not in previous or not previous[metric]:
+                continue
+            now, before = current[metric], previous[metric]
+            if metric in HIGHER_IS_BETTER:
+                worse = now < before * (1 - tolerance)
+            else:
+                worse = now > before * (1 + tolerance)
+            if worse:
+                regressions.append(f"{name} {metric}: {now:.3f} vs baseline {before:.3f}")
+    return regressions
+
+def load(path: str) -> Results:
+    with open(path) as f:
+        return json.load(f)
+
+def save(path: str, results: Results):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+def check(results: Results, baseline_path: str, metrics: Sequence[str], tolerance: float) -> int:
+    """Print regressions against a baseline file; returns the process exit status"""
+    regressions = compare(results, load(baseline_path), metrics, tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if not regressions:
+        print(f"No regressions against {baseline_path} (tolerance {tolerance:.0%})")
+    return 1 if regressions else 0
@@ -0,0 +1,303 @@
+"""
+WebSocket Connection Registry
+
+This module tracks live WebSocket connections by session id and connection id.
+Each connection owns a bounded outbound queue drained by its own writer task,
+so a broadcast only enqueues and one slow client can never stall delivery to
+the others. When a queue overflows the slow consumer either loses the message
+or is disconnected, depending on the configured policy.
+
+The registry also admits connections against global, per-IP and per-session
+caps, sends application-level heartbeats and reaps connections that have
+been silent for longer than the idle timeout.
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from typing import Any, Dict, Optional, Union
+
+from fastapi import WebSocket
+
+from memory import deep_sizeof, shallow_sizeof
+from ws_codec import FrameCodec, LEGACY_CODEC
+
+logger = logging.getLogger(__name__)
+
+Message = Union[str, bytes]
+
+# Frames are either pre-encoded or dicts encoded with each connection's codec
+Outbound = Union[Message, Dict[str, Any]]
+
+# Close code sent to consumers that cannot keep up ("try again later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+# Close codes for upgrades refused at admission and for reaped idle sockets
+SATURATED_CLOSE_CODE = 1013
+LIMIT_CLOSE_CODE = 1008
+IDLE_CLOSE_CODE = 1001
+
+class Connection:
+    """A registered WebSocket with its outbound queue"""
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        session_id: str,
+        queue_size: int,
+        codec: FrameCodec = LEGACY_CODEC,
+        client_ip: str = "unknown",
+    ):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.websocket = websocket
+        self.codec = codec
+        self.client_ip = client_ip
+        self.last_seen = time.monotonic()
+        self.queue: "asyncio.Queue[Message]" = asyncio.Queue(maxsize=queue_size)
+        self.writer: Optional[asyncio.Task] = None
+        self.dropped = 0
+        self.closed = False
+
+class ConnectionManager:
+    """Registry of WebSocket connections indexed by session and connection id"""
+
+    def __init__(
+        self,
+        queue_size: int = 256,
+        overflow_policy: str = "disconnect",
+        max_connections: int = 0,
+        max_per_ip: int = 0,
+        max_per_session: int = 0,
+        heartbeat_interval: float = 0,
+        idle_timeout: float = 0,
+    ):
+        if overflow_policy not in ("drop", "disconnect"):
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        # Limits of 0 are disabled
+        self.max_connections = max_connections
+        self.max_per_ip = max_per_ip
+        self.max_per_session = max_per_session
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.active_connections: Dict[str, Connection] = {}
+        self.sessions: Dict[str, Dict[str, Connection]] = {}
+        self.ips: Dict[str, int] = {}
+        self.messages_dropped = 0
+        self.slow_disconnects = 0
+        self.send_errors = 0
+        self.rejected: Dict[str, int] = {"saturated": 0, "per_ip": 0, "per_session": 0}
+        self.idle_reaped = 0
+        self.heartbeat_failures = 0
+        self.heartbeats_sent = 0
+        self._heartbeat_task: Optional[asyncio.Task] = None
+
+    def admission_check(self, session_id: str, client_ip: str) -> Optional[str]:
+        """Reason a new connection must be refused, or None to admit it"""
+        if self.max_connections and len(self.active_connections) >= self.max_connections:
+            return "saturated"
+        if self.max_per_ip and self.ips.get(client_ip, 0) >= self.max_per_ip:
+            return "per_ip"
+        if self.max_per_session and len(self.sessions.get(session_id, ())) >= self.max_per_session:
+            return "per_session"
+        return None
+
+    async def connect(
+        self,
+        websocket: WebSocket,
+        session_id: str,
+        codec: FrameCodec = LEGACY_CODEC,
+        client_ip: str = "unknown",
+    ) -> Optional[Connection]:
+        """Admit, accept and register a WebSocket, or refuse it and return None"""
+        reason = self.admission_check(session_id, client_ip)
+        if reason is not None:
+            self.rejected[reason] += 1
+            logger.warning(f"Refusing WebSocket for session {session_id} from {client_ip}: {reason}")
+            # Closing before accept answers the upgrade with HTTP 403
+            await websocket.close(code=SATURATED_CLOSE_CODE if reason == "saturated" else LIMIT_CLOSE_CODE)
+            return None
+        await websocket.accept(subprotocol=codec.subprotocol)
+        return self.register(websocket, session_id, codec, client_ip)
+
+    def register(
+        self,
+        websocket: WebSocket,
+        session_id: str,
+        codec: FrameCodec = LEGACY_CODEC,
+        client_ip: str = "unknown",
+    ) -> Connection:
+        """Register an already accepted WebSocket and start its writer"""
+        connection = Connection(websocket, session_id, self.queue_size, codec, client_ip)
+        self.active_connections[connection.id] = connection
+        self.sessions.setdefault(session_id, {})[connection.id] = connection
+        self.ips[client_ip] = self.ips.get(client_ip, 0) + 1
+        connection.writer = asyncio.create_task(self._writer(connection))
+        return connection
+
+    def touch(self, connection: Connection):
+        """Record inbound activity on a connection"""
+        connection.last_seen = time.monotonic()
+
+    def disconnect(self, connection: Connection):
+        """Unregister a connection and stop its writer"""
+        if connection.closed:
+            return
+        connection.closed = True
+        self.active_connections.pop(connection.id, None)
+        session = self.sessions.get(connection.session_id)
+        if session is not None:
+            session.pop(connection.id, None)
+            if not session:
+                del self.sessions[connection.session_id]
+        remaining = self.ips.get(connection.client_ip, 0) - 1
+        if remaining > 0:
+            self.ips[connection.client_ip] = remaining
+        else:
+            self.ips.pop(connection.client_ip, None)
+        if connection.writer is not None and connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
+
+    async def _writer(self, connection: Connection):
+        """Drain a connection's queue onto its socket"""
+        websocket = connection.websocket
+        try:
+            while True:
+                message = await connection.queue.get()
+                if isinstance(message, bytes):
+                    await websocket.send_bytes(message)
+                else:
+                    await websocket.send_text(message)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.send_errors += 1
+            logger.warning(f"Dropping WebSocket {connection.id} of session {connection.session_id}: {e}")
+            self.disconnect(connection)
+
+    async def _close(self, connection: Connection, code: int):
+        try:
+            await connection.websocket.close(code=code)
+        except Exception as e:
+            logger.debug(f"Error closing WebSocket {connection.id}: {e}")
+
+    def enqueue(self, connection: Connection, message: Message) -> bool:
+        """Queue a message for a connection without waiting on the socket"""
+        if connection.closed:
+            return False
+        try:
+            connection.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            connection.dropped += 1
+            self.messages_dropped += 1
+            if self.overflow_policy == "disconnect":
+                self.slow_disconnects += 1
+                logger.warning(
+                    f"Disconnecting slow WebSocket {connection.id} of session {connection.session_id}"
+                )
+                self.disconnect(connection)
+                asyncio.create_task(self._close(connection, SLOW_CONSUMER_CLOSE_CODE))
+            return False
+
+    @staticmethod
+    def _encoder(message: Outbound):
+        """Encode a frame once per codec while fanning it out"""
+        if not isinstance(message, dict):
+            return lambda connection: message
+        encoded: Dict[str, Message] = {}
+
+        def encode(connection: Connection) -> Message:
+            codec = connection.codec
+            if codec.name not in encoded:
+                encoded[codec.name] = codec.encode(message)
+            return encoded[codec.name]
+
+        return encode
+
+    async def send_personal_message(self, message: Outbound, connection: Connection):
+        self.enqueue(connection, self._encoder(message)(connection))
+
+    async def send_to_session(self, session_id: str, message: Outbound, exclude: Optional[str] = None) -> int:
+        """Queue a message for every connection of a session"""
+        encode = self._encoder(message)
+        delivered = 0
+        for connection in list(self.sessions.get(session_id, {}).values()):
+            if connection.id != exclude and self.enqueue(connection, encode(connection)):
+                delivered += 1
+        return delivered
+
+    async def broadcast(self, message: Outbound) -> int:
+        """Queue a message for every connection; writers deliver concurrently"""
+        encode = self._encoder(message)
+        delivered = 0
+        for connection in list(self.active_connections.values()):
+            if self.enqueue(connection, encode(connection)):
+                delivered += 1
+        return delivered
+
+    async def reap_idle(self) -> int:
+        """Close connections silent for longer than the idle timeout and ping the rest"""
+        now = time.monotonic()
+        reaped = 0
+        for connection in list(self.active_connections.values()):
+            if self.idle_timeout and now - connection.last_seen > self.idle_timeout:
+                logger.info(f"Reaping idle WebSocket {connection.id} of session {connection.session_id}")
+                self.disconnect(connection)
+                await self._close(connection, IDLE_CLOSE_CODE)
+                reaped += 1
+            elif self.heartbeat_interval:
+                if self.enqueue(connection, connection.codec.encode({"type": "ping"})):
+                    self.heartbeats_sent += 1
+                else:
+                    self.heartbeat_failures += 1
+        self.idle_reaped += reaped
+        return reaped
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval or self.idle_timeout)
+            try:
+                await self.reap_idle()
+            except Exception as e:
+                logger.error(f"WebSocket heartbeat failed: {e}")
+
+    def start(self):
+        """Start the heartbeat and idle reaper"""
+        if (self.heartbeat_interval or self.idle_timeout) and self._heartbeat_task is None:
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def stop(self):
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+
+    def memory_usage(self) -> int:
+        """Estimated bytes held by the registry and the frames queued for each socket"""
+        size = shallow_sizeof(self.active_connections, self.sessions, self.ips)
+        size += sum(shallow_sizeof(session) for session in self.sessions.values())
+        for connection in self.active_connections.values():
+            size += shallow_sizeof(connection, vars(connection), connection.id, connection.queue)
+            # asyncio.Queue keeps its items in a deque with no public accessor
+            size += deep_sizeof(connection.queue._queue)
+        return size
+
+    def stats(self) -> Dict[str, Any]:
+        """Get registry statistics"""
+        return {
+            "connections": len(self.active_connections),
+            "max_connections": self.max_connections,
+            "sessions": len(self.sessions),
+            "client_ips": len(self.ips),
+            "max_connections_per_ip": max(self.ips.values(), default=0),
+            "queued_messages": sum(c.queue.qsize() for c in self.active_connections.values()),
+            "messages_dropped": self.messages_dropped,
+            "slow_disconnects": self.slow_disconnects,
+            "send_errors": self.send_errors,
+            "rejected": dict(self.rejected),
+            "idle_reaped": self.idle_reaped,
+            "heartbeats_sent": self.heartbeats_sent,
+            "heartbeat_failures": self.heartbeat_failures,
+        }
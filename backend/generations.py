@@ -0,0 +1,249 @@
+"""
+Resumable Generations
+
+This module decouples an AI generation from the connection that requested it.
+Each generation gets an id and a bounded ring buffer of the chunks it has
+emitted; the upstream stream is drained by a background task, so a client
+that drops halfway through can reconnect and resume from the last chunk it
+saw instead of paying for the whole generation again. Finished generations
+are kept for a short grace period before being discarded.
+
+A generation nobody is following any more is cancelled once its last reader
+has been gone for the cancel grace period, which closes the upstream request
+instead of paying for tokens no client will read.
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import AsyncIterator, Callable, Deque, Dict, Optional, Set, Tuple
+
+from memory import deep_sizeof, shallow_sizeof
+
+logger = logging.getLogger(__name__)
+
+class ReplayGapError(Exception):
+    """The requested offset has already been evicted from the replay buffer"""
+
+class Generation:
+    """One AI generation and its replay buffer"""
+
+    def __init__(self, session_id: str, buffer_size: int, generation_id: Optional[str] = None):
+        self.id = generation_id or uuid.uuid4().hex
+        self.session_id = session_id
+        self.chunks: Deque[Tuple[int, str]] = deque(maxlen=buffer_size)
+        self.next_offset = 0
+        self.done = False
+        self.error: Optional[str] = None
+        self.created_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self.followers = 0
+        self.on_abandoned: Optional[Callable[["Generation"], None]] = None
+        self.on_followed: Optional[Callable[["Generation"], None]] = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def append(self, chunk: str):
+        self.chunks.append((self.next_offset, chunk))
+        self.next_offset += 1
+        self._notify()
+
+    def finish(self, error: Optional[str] = None):
+        self.done = True
+        self.error = error
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    @property
+    def complete(self) -> bool:
+        """Whether every chunk emitted so far is still buffered"""
+        return not self.chunks or self.chunks[0][0] == 0
+
+    @property
+    def text(self) -> str:
+        """The buffered output; everything emitted so far while ``complete``"""
+        return "".join(chunk for _, chunk in self.chunks)
+
+    async def wait(self) -> str:
+        """Wait for the generation to finish and return its buffered output"""
+        while not self.done:
+            await self._changed.wait()
+        return self.text
+
+    async def follow(self, offset: int = 0) -> AsyncIterator[Tuple[int, str]]:
+        """Yield ``(offset, chunk)`` pairs from ``offset`` until the generation ends"""
+        self.followers += 1
+        if self.on_followed is not None:
+            self.on_followed(self)
+        try:
+            while True:
+                changed = self._changed
+                if self.chunks:
+                    oldest = self.chunks[0][0]
+                    if offset < oldest:
+                        raise ReplayGapError(f"Offset {offset} evicted, oldest buffered is {oldest}")
+                    for chunk_offset, chunk in list(islice(self.chunks, offset - oldest, None)):
+                        yield chunk_offset, chunk
+                        offset = chunk_offset + 1
+                if self.done and offset >= self.next_offset:
+                    return
+                if offset >= self.next_offset:
+                    await changed.wait()
+        finally:
+            self.followers -= 1
+            if not self.followers and not self.done and self.on_abandoned is not None:
+                self.on_abandoned(self)
+
+class GenerationRegistry:
+    """Tracks live and recently finished generations"""
+
+    def __init__(
+        self,
+        buffer_size: int = 1024,
+        grace_period: float = 60.0,
+        max_generations: int = 1000,
+        cancel_grace: float = 5.0,
+    ):
+        self.buffer_size = buffer_size
+        self.grace_period = grace_period
+        self.max_generations = max_generations
+        # Seconds an unfollowed generation may keep running for a reconnect
+        self.cancel_grace = cancel_grace
+        self._generations: "OrderedDict[str, Generation]" = OrderedDict()
+        self._pending_cancels: Dict[str, asyncio.TimerHandle] = {}
+        self.started = 0
+        self.resumed = 0
+        self.cancelled = 0
+        # Chunks left of max_tokens in cancelled streams: what they could have cost, not what they would have
+        self.tokens_saved_upper_bound = 0
+        # Set while the worker drains for shutdown; callers refuse new generations
+        self.draining = False
+
+    def start(
+        self, session_id: str, producer: AsyncIterator[str], generation_id: Optional[str] = None
+    ) -> Generation:
+        """Start draining ``producer`` into a new generation"""
+        self.purge()
+        generation = Generation(session_id, self.buffer_size, generation_id)
+        generation.on_abandoned = self._abandoned
+        generation.on_followed = self._followed
+        self._generations[generation.id] = generation
+        generation.task = asyncio.create_task(self._run(generation, producer))
+        self.started += 1
+        return generation
+
+    async def _run(self, generation: Generation, producer: AsyncIterator[str]):
+        try:
+            async for chunk in producer:
+                generation.append(chunk)
+            generation.finish()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            logger.info(
+                f"Cancelled generation {generation.id} after {generation.next_offset} chunks; "
+                f"partial output: {generation.text[:200]!r}"
+            )
+            generation.finish("cancelled")
+            raise
+        except Exception as e:
+            logger.error(f"Generation {generation.id} failed: {e}")
+            generation.finish(str(e))
+        finally:
+            handle = self._pending_cancels.pop(generation.id, None)
+            if handle is not None:
+                handle.cancel()
+
+    def _abandoned(self, generation: Generation):
+        """Schedule cancellation of a generation whose last reader went away"""
+        if generation.task is None or generation.id in self._pending_cancels:
+            return
+        if self.cancel_grace <= 0:
+            generation.task.cancel()
+        else:
+            self._pending_cancels[generation.id] = asyncio.get_running_loop().call_later(
+                self.cancel_grace, generation.task.cancel
+            )
+
+    def _followed(self, generation: Generation):
+        """Keep a generation running once a reader reattaches"""
+        handle = self._pending_cancels.pop(generation.id, None)
+        if handle is not None:
+            handle.cancel()
+
+    def count_saved_tokens(self, tokens: int):
+        """Record the most upstream tokens a cancelled stream could still have generated"""
+        self.tokens_saved_upper_bound += max(0, tokens)
+
+    def get(self, generation_id: str) -> Optional[Generation]:
+        self.purge()
+        return self._generations.get(generation_id)
+
+    def resume(self, generation_id: str, session_id: str) -> Optional[Generation]:
+        """Look up a generation of ``session_id`` to resume, or None if it is unknown, expired or another session's"""
+        generation = self.get(generation_id)
+        if generation is None or generation.session_id != session_id:
+            return None
+        self.resumed += 1
+        return generation
+
+    def purge(self):
+        """Drop generations past their grace period, then the oldest finished ones over the cap"""
+        now = time.monotonic()
+        for generation_id, generation in list(self._generations.items()):
+            if generation.done and now - generation.finished_at > self.grace_period:
+                del self._generations[generation_id]
+        if len(self._generations) >= self.max_generations:
+            for generation_id, generation in list(self._generations.items()):
+                if len(self._generations) < self.max_generations:
+                    break
+                if generation.done:
+                    del self._generations[generation_id]
+
+    async def drain(self, timeout: float) -> int:
+        """Mark the registry draining and wait up to ``timeout`` for running generations; returns those left"""
+        self.draining = True
+        tasks = [g.task for g in self._generations.values() if g.task is not None and not g.task.done()]
+        if not tasks:
+            return 0
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        return len(pending)
+
+    async def stop(self):
+        """Cancel generations that are still running"""
+        tasks = [g.task for g in self._generations.values() if g.task is not None and not g.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def memory_usage(self) -> int:
+        """Estimated bytes held by the replay buffers of retained generations"""
+        seen: Set[int] = set()
+        size = shallow_sizeof(self._generations, self._pending_cancels)
+        for generation in self._generations.values():
+            size += shallow_sizeof(generation) + deep_sizeof(generation.chunks, seen)
+        return size
+
+    def active(self) -> int:
+        """Generations still producing output"""
+        return sum(1 for g in self._generations.values() if not g.done)
+
+    def stats(self) -> Dict[str, int]:
+        """Get registry statistics; ``tokens_saved_upper_bound`` assumes every cancelled stream ran to max_tokens"""
+        generations = list(self._generations.values())
+        return {
+            "active": self.active(),
+            "retained": len(generations),
+            "buffered_chunks": sum(len(g.chunks) for g in generations),
+            "started": self.started,
+            "resumed": self.resumed,
+            "cancelled": self.cancelled,
+            "tokens_saved_upper_bound": self.tokens_saved_upper_bound,
+            "draining": self.draining,
+        }
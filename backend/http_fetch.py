@@ -0,0 +1,141 @@
+"""
+Bounded HTTP Fetching
+
+This module fetches arbitrary URLs for the MCP ``http_get`` tool without
+buffering whole bodies. The body is streamed and decoded incrementally until
+a byte cap is reached, at which point the connection is dropped. Responses
+carrying an ETag or Last-Modified validator are kept in a small LRU and
+revalidated with a conditional GET, so an unchanged page costs a 304.
+"""
+
+import codecs
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import Any, Dict, Optional
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class FetchResult:
+    """The capped, decoded body of a fetched URL"""
+    url: str
+    status: int
+    text: str
+    bytes_read: int
+    truncated: bool
+    content_type: str = ""
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    from_cache: bool = False
+
+class HTTPFetcher:
+    """Streams URLs up to a byte cap and revalidates cached responses"""
+
+    def __init__(
+        self,
+        max_bytes: int = 65536,
+        cache_entries: int = 128,
+        timeout: float = 10.0,
+        chunk_size: int = 8192,
+    ):
+        self.max_bytes = max_bytes
+        self.cache_entries = cache_entries
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self._cache: "OrderedDict[str, FetchResult]" = OrderedDict()
+        self.fetches = 0
+        self.revalidated = 0
+        self.truncated = 0
+        self.bytes_read = 0
+        self.evictions = 0
+
+    async def fetch(self, url: str) -> FetchResult:
+        """GET a URL, reading at most ``max_bytes`` of its body"""
+        self.fetches += 1
+        cached = self._cache.get(url)
+        headers: Dict[str, str] = {}
+        if cached is not None:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.get(url, headers=headers) as response:
+                if response.status == 304 and cached is not None:
+                    self.revalidated += 1
+                    self._cache.move_to_end(url)
+                    return replace(cached, from_cache=True)
+                result = await self._read(url, response)
+
+        if response.status == 200 and (result.etag or result.last_modified):
+            self._store(url, result)
+        else:
+            self._cache.pop(url, None)
+        return result
+
+    async def _read(self, url: str, response: aiohttp.ClientResponse) -> FetchResult:
+        decoder = codecs.getincrementaldecoder(self._charset(response))(errors="replace")
+        parts = []
+        read = 0
+        truncated = False
+        async for chunk in response.content.iter_chunked(self.chunk_size):
+            if read + len(chunk) > self.max_bytes:
+                chunk = chunk[:self.max_bytes - read]
+                truncated = True
+            read += len(chunk)
+            parts.append(decoder.decode(chunk))
+            if truncated:
+                # Leaving the response context without reading on closes the connection
+                break
+        else:
+            parts.append(decoder.decode(b"", final=True))
+        self.bytes_read += read
+        if truncated:
+            self.truncated += 1
+            logger.info(f"Stopped reading {url} after {read} bytes")
+        return FetchResult(
+            url=url,
+            status=response.status,
+            text="".join(parts),
+            bytes_read=read,
+            truncated=truncated,
+            content_type=response.content_type,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+        )
+
+    @staticmethod
+    def _charset(response: aiohttp.ClientResponse) -> str:
+        charset = response.charset or "utf-8"
+        try:
+            codecs.lookup(charset)
+        except LookupError:
+            charset = "utf-8"
+        return charset
+
+    def _store(self, url: str, result: FetchResult):
+        self._cache[url] = result
+        self._cache.move_to_end(url)
+        while len(self._cache) > self.cache_entries:
+            self._cache.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Get fetcher statistics"""
+        return {
+            "fetches": self.fetches,
+            "revalidated": self.revalidated,
+            "truncated": self.truncated,
+            "bytes_read": self.bytes_read,
+            "cached": len(self._cache),
+            "cached_bytes": sum(len(r.text.encode("utf-8")) for r in self._cache.values()),
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,193 @@
+"""
+Event Loop Monitor
+
+This module measures how late the event loop runs and catches handlers that
+block it. A coroutine sleeps for a fixed interval and records how much later
+than asked it woke up (the loop lag). A watchdog thread watches the same
+deadline: once the loop is overdue by more than the threshold it reads the
+loop thread's current stack, so the log shows the call doing the blocking
+and the route being served rather than just that something was slow.
+
+In test mode (``fail_after``) every stall beyond the limit is held against
+the request that caused it, and the middleware fails that request with
+LoopBlockedError once the handler returns.
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Weight of the newest sample in the smoothed lag
+LAG_SMOOTHING = 0.2
+
+class LoopBlockedError(Exception):
+    """A handler blocked the event loop for longer than test mode allows"""
+
+@dataclass
+class Stall:
+    """One period in which the event loop did not run"""
+    route: str
+    duration: float
+    stack: str
+
+class LoopMonitor:
+    """Measures event loop lag and captures the stack of long stalls"""
+
+    def __init__(
+        self,
+        interval: float = 0.05,
+        threshold: float = 0.1,
+        fail_after: Optional[float] = None,
+        lag_histogram=None,
+        max_stalls: int = 50,
+    ):
+        self.interval = interval
+        # Test mode captures, and fails, at its own limit
+        self.threshold = fail_after if fail_after is not None else threshold
+        self.fail_after = fail_after
+        self.lag_histogram = lag_histogram
+        self.stalls: Deque[Stall] = deque(maxlen=max_stalls)
+        self.stall_count = 0
+        self.max_lag = 0.0
+        # Exponentially smoothed, so one slow tick does not read as sustained lag
+        self.lag = 0.0
+        self._due: Optional[float] = None
+        self._requests: Dict[asyncio.Task, Dict[str, Any]] = {}
+        self._failures: Dict[Optional[asyncio.Task], Stall] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    async def _tick(self):
+        while True:
+            self._due = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - self._due)
+            self.max_lag = max(self.max_lag, lag)
+            self.lag += (lag - self.lag) * LAG_SMOOTHING
+            if self.lag_histogram is not None:
+                self.lag_histogram.observe(lag)
+
+    def _watch(self):
+        poll = min(self.threshold / 4, 0.01)
+        reported = None
+        while not self._stopping.wait(poll):
+            due = self._due
+            if due is None or due == reported:
+                continue
+            overdue = time.perf_counter() - due
+            if overdue >= self.threshold:
+                reported = due
+                self._capture(overdue)
+
+    def _capture(self, overdue: float):
+        frame = sys._current_frames().get(self._loop_thread)
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+        # Reading the loop's current task from another thread is a plain dict lookup
+        task = asyncio.current_task(self._loop)
+        stall = Stall(self._route(task), overdue, stack)
+        self.stall_count += 1
+        self.stalls.append(stall)
+        logger.warning(
+            f"Event loop blocked for over {overdue * 1000:.0f} ms serving {stall.route}:\n{stack}"
+        )
+        if self.fail_after is not None:
+            self._failures[task] = stall
+
+    def _route(self, task: Optional[asyncio.Task]) -> str:
+        scope = self._requests.get(task) if task is not None else None
+        if scope is None:
+            return f"task {task.get_name()}" if task is not None else "loop callback"
+        route = getattr(scope.get("route"), "path", None) or scope.get("path", "")
+        return f"{scope.get('method', 'WEBSOCKET')} {route}"
+
+    def track(self, scope: Dict[str, Any]) -> Optional[asyncio.Task]:
+        """Attribute stalls in the current task to a request until ``untrack``"""
+        task = asyncio.current_task()
+        if task is not None:
+            self._requests[task] = scope
+        return task
+
+    def untrack(self, task: Optional[asyncio.Task]):
+        """Stop attributing stalls to a request; in test mode, raise for any it caused"""
+        if task is None:
+            return
+        self._requests.pop(task, None)
+        stall = self._failures.pop(task, None)
+        if stall is not None:
+            raise LoopBlockedError(
+                f"{stall.route} blocked the event loop for over {stall.duration * 1000:.0f} ms:\n{stall.stack}"
+            )
+
+    def check(self):
+        """Raise for stalls beyond the test mode limit not yet reported through a request"""
+        if self._failures:
+            stall = next(iter(self._failures.values()))
+            self._failures.clear()
+            raise LoopBlockedError(
+                f"{stall.route} blocked the event loop for over {stall.duration * 1000:.0f} ms:\n{stall.stack}"
+            )
+
+    def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._stopping.clear()
+        self._due = None
+        self._task = asyncio.create_task(self._tick())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stopping.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join()
+            self._watchdog = None
+        # Nothing measures the lag any more; do not leave the last reading standing
+        self.lag = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """Get event loop statistics"""
+        return {
+            "interval": self.interval,
+            "threshold": self.threshold,
+            "lag": self.lag,
+            "max_lag": self.max_lag,
+            "stalls": self.stall_count,
+            "recent_stalls": [{"route": s.route, "duration": s.duration} for s in self.stalls],
+        }
+
+class LoopMonitorMiddleware:
+    """ASGI middleware telling the monitor which request each task is serving"""
+
+    def __init__(self, app, monitor: LoopMonitor):
+        self.app = app
+        self.monitor = monitor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        task = self.monitor.track(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.monitor.untrack(task)
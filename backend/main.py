@@ -1,24 +1,85 @@
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Header, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import List, Dict, AsyncGenerator, Any
+from typing import List, Dict, AsyncGenerator, Any, Optional, Tuple
 from pydantic import BaseModel
 import os
 import json
 import aiohttp
 import asyncio
-import subprocess
-import tempfile
+import functools
+import hmac
 import re
 import random
+import logging
+import threading
 from dotenv import load_dotenv
+from search_cache import SearchCache
+from connections import ConnectionManager
+from message_store import MessageStore
+from backplane import create_backplane, make_worker_id
+from ws_codec import negotiate, receive_frame
+from generations import Generation, GenerationRegistry, ReplayGapError
+from serialization import FastJSONResponse, RawJSONResponse, sse_event
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, MetricsRegistry, TokenStreamTimer
+from tracing import Tracer, TracingMiddleware, create_exporter
+from loop_monitor import LoopMonitor, LoopMonitorMiddleware
+from memory import MemoryAccountant, SnapshotNotFoundError, SnapshotStore, rss_bytes
+from startup import StartupTimer, StartupTimingMiddleware, lazy_import
+from rate_limit import Limit, LoadShedder, RateLimitedError, RateLimiter
 # from mcp_integration import mcp_manager, get_mcp_response
 
+# Optional subsystems load on first use so cold starts only pay for what they serve
+profiling = lazy_import("profiling")
+traffic = lazy_import("traffic")
+
 # Load environment variables from .env file
 load_dotenv()
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+# Cold start milestones, reported at /stats and logged with the first response
+startup_timer = StartupTimer()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start and stop background subsystems"""
+    await backplane.start(handle_backplane_event)
+    manager.start()
+    tracer.start()
+    loop_monitor.start()
+    if traffic_recorder is not None:
+        traffic_recorder.start()
+    startup_timer.mark("ready")
+    yield
+    await loop_monitor.stop()
+    if traffic_recorder is not None:
+        await traffic_recorder.stop()
+    await generations.stop()
+    await manager.stop()
+    await backplane.stop()
+    await tracer.stop()
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+
+# Prometheus metrics, exported at /metrics
+metrics = MetricsRegistry(prefix="oasiz_")
+http_requests = metrics.counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+http_latency = metrics.histogram("http_request_duration_seconds", "HTTP request duration by route", ("method", "route"))
+tool_latency = metrics.histogram("tool_duration_seconds", "Tool call duration by tool", ("tool",))
+upstream_latency = metrics.histogram(
+    "upstream_request_duration_seconds", "Time until an upstream sends response headers", ("upstream",)
+)
+upstream_responses = metrics.counter("upstream_responses_total", "Upstream responses by status", ("upstream", "status"))
+openai_first_token = metrics.histogram(
+    "openai_time_to_first_token_seconds", "Time from an OpenAI request to its first streamed token"
+)
+openai_token_rate = metrics.histogram(
+    "openai_tokens_per_second", "Streamed OpenAI tokens per second after the first",
+    buckets=(5, 10, 20, 40, 60, 80, 100, 150, 200, 400),
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -27,30 +88,95 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware, requests=http_requests, latency=http_latency)
 
-# WebSocket connection manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+# Tracing: spans are kept in memory and, with TRACE_EXPORTER set to "json" or "otlp",
+# exported to TRACE_EXPORT_TARGET (a JSON lines file or an OTLP/HTTP collector URL)
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER") or None
+TRACE_EXPORT_TARGET = os.getenv("TRACE_EXPORT_TARGET") or None
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+tracer = Tracer(exporter=create_exporter(TRACE_EXPORTER, TRACE_EXPORT_TARGET))
+app.add_middleware(TracingMiddleware, tracer=tracer)
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+# Debug endpoints other than /debug/env need this token in X-Debug-Token; unset disables them
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN") or None
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
 
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
+@functools.lru_cache(maxsize=None)
+def get_profiler() -> "profiling.SamplingProfiler":
+    """The sampling profiler, created with the first profile request"""
+    return profiling.SamplingProfiler()
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except:
-                pass
+# Event loop lag: sampled every LOOP_MONITOR_INTERVAL seconds; stalls longer than
+# LOOP_BLOCK_THRESHOLD_MS are logged with the blocking stack. Setting LOOP_BLOCK_FAIL_MS
+# (test mode) makes requests that block the loop that long fail with LoopBlockedError
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", "0.05"))
+LOOP_BLOCK_THRESHOLD_MS = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "100"))
+LOOP_BLOCK_FAIL_MS = float(os.getenv("LOOP_BLOCK_FAIL_MS")) if os.getenv("LOOP_BLOCK_FAIL_MS") else None
+
+loop_monitor = LoopMonitor(
+    interval=LOOP_MONITOR_INTERVAL,
+    threshold=LOOP_BLOCK_THRESHOLD_MS / 1000,
+    fail_after=LOOP_BLOCK_FAIL_MS / 1000 if LOOP_BLOCK_FAIL_MS is not None else None,
+    lag_histogram=metrics.histogram(
+        "event_loop_lag_seconds", "How late the event loop ran scheduled callbacks",
+        buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+    ),
+)
+app.add_middleware(LoopMonitorMiddleware, monitor=loop_monitor)
+metrics.gauge("event_loop_stalls", "Event loop stalls over the threshold since start", lambda: loop_monitor.stall_count)
+
+# Opt-in traffic recording for replay benchmarks: anonymized request shapes and
+# timings are appended to TRAFFIC_RECORD_PATH for a TRAFFIC_SAMPLE_RATE share of requests
+TRAFFIC_RECORD_PATH = os.getenv("TRAFFIC_RECORD_PATH") or None
+TRAFFIC_SAMPLE_RATE = float(os.getenv("TRAFFIC_SAMPLE_RATE", "1.0"))
+
+traffic_recorder = traffic.TrafficRecorder(TRAFFIC_RECORD_PATH, TRAFFIC_SAMPLE_RATE) if TRAFFIC_RECORD_PATH else None
+if traffic_recorder is not None:
+    app.add_middleware(traffic.TrafficRecorderMiddleware, recorder=traffic_recorder)
+
+# Outermost, so the first response is timed as the client sees it
+app.add_middleware(StartupTimingMiddleware, timer=startup_timer)
+
+def instrumented_tool(name: str):
+    """Decorator timing a tool function and tracing each call"""
+    def decorate(func):
+        return tool_latency.time(name)(tracer.wrap(f"tool.{name}")(func))
+    return decorate
+
+# WebSocket connection registry
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "256"))
+WS_OVERFLOW_POLICY = os.getenv("WS_OVERFLOW_POLICY", "disconnect")
+WS_MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", "10000"))
+WS_MAX_PER_IP = int(os.getenv("WS_MAX_PER_IP", "50"))
+WS_MAX_PER_SESSION = int(os.getenv("WS_MAX_PER_SESSION", "10"))
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "30"))
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "120"))
 
-manager = ConnectionManager()
+manager = ConnectionManager(
+    queue_size=WS_QUEUE_SIZE,
+    overflow_policy=WS_OVERFLOW_POLICY,
+    max_connections=WS_MAX_CONNECTIONS,
+    max_per_ip=WS_MAX_PER_IP,
+    max_per_session=WS_MAX_PER_SESSION,
+    heartbeat_interval=WS_HEARTBEAT_INTERVAL,
+    idle_timeout=WS_IDLE_TIMEOUT,
+)
+
+# Resumable generations: chunks kept per generation, seconds kept after it ends and
+# seconds a generation nobody is reading keeps running before it is cancelled
+GENERATION_BUFFER_SIZE = int(os.getenv("GENERATION_BUFFER_SIZE", "1024"))
+GENERATION_GRACE_SECONDS = float(os.getenv("GENERATION_GRACE_SECONDS", "60"))
+GENERATION_CANCEL_GRACE_SECONDS = float(os.getenv("GENERATION_CANCEL_GRACE_SECONDS", "5"))
+
+# Completion length requested upstream, also the basis of the upper bound on tokens saved by cancellation
+STREAM_MAX_TOKENS = 500
+
+generations = GenerationRegistry(
+    buffer_size=GENERATION_BUFFER_SIZE,
+    grace_period=GENERATION_GRACE_SECONDS,
+    cancel_grace=GENERATION_CANCEL_GRACE_SECONDS,
+)
 
 # Request/Response models
 class ChatMessageRequest(BaseModel):
@@ -72,20 +198,178 @@ class AIRequest(BaseModel):
 class ToolRequest(BaseModel):
     tool: str
     params: Dict[str, Any]
+    session_id: Optional[str] = None
 
 class MCPRequest(BaseModel):
     server_name: str
     tool_name: str
     params: Dict[str, Any] = {}
 
-# In-memory storage for chat messages
-chat_messages: List[Dict] = []
+# In-memory storage for chat messages, shared with other workers through the backplane
+BACKPLANE_URL = os.getenv("BACKPLANE_URL") or None
+
+message_store = MessageStore()
+chat_messages: List[Dict] = message_store.messages
+backplane = create_backplane(BACKPLANE_URL)
+
+metrics.gauge("websocket_connections", "Open WebSocket connections", lambda: len(manager.active_connections))
+metrics.counter_from(
+    "websocket_rejected_total", "WebSocket upgrades refused at admission by reason", lambda: manager.rejected, ("reason",)
+)
+metrics.counter_from("websocket_idle_reaped_total", "WebSocket connections closed for idling", lambda: manager.idle_reaped)
+metrics.counter_from("websocket_heartbeats_total", "Heartbeat pings queued", lambda: manager.heartbeats_sent)
+metrics.counter_from(
+    "websocket_heartbeat_failures_total", "Heartbeat pings that could not be queued", lambda: manager.heartbeat_failures
+)
+metrics.counter_from("websocket_messages_dropped_total", "Frames dropped for full queues", lambda: manager.messages_dropped)
+metrics.counter_from("websocket_slow_disconnects_total", "Connections closed as slow consumers", lambda: manager.slow_disconnects)
+metrics.counter_from("websocket_send_errors_total", "Connections dropped after a failed send", lambda: manager.send_errors)
+metrics.gauge("message_store_messages", "Chat messages held in memory", lambda: len(message_store))
+metrics.gauge("generations_active", "Generations still producing output", lambda: generations.stats()["active"])
+
+def message_frame(message: Dict) -> Dict[str, Any]:
+    """WebSocket frame announcing a stored message to a session's sockets"""
+    frame_type = "bot_response" if message["sender"] == "bot" else "message_sent"
+    return {"type": frame_type, "message": message}
+
+async def record_message(message: Dict, connection_id: Optional[str] = None):
+    """Store a message and deliver it to the session's other sockets on every worker"""
+    with tracer.span("store.record", message_id=message["id"]):
+        message_store.add(message)
+        await manager.send_to_session(message["session_id"], message_frame(message), exclude=connection_id)
+        try:
+            with tracer.span("backplane.publish"):
+                await backplane.save_message(message)
+                await backplane.publish({"type": "message", "message": message, "connection_id": connection_id})
+        except Exception as e:
+            logger.error(f"Failed to publish message {message['id']} to the backplane: {e}")
+
+async def handle_backplane_event(event: Dict[str, Any]):
+    """Apply a session event published by another worker"""
+    if event.get("type") == "message":
+        message = event["message"]
+        if message_store.add(message):
+            await manager.send_to_session(
+                message["session_id"], message_frame(message), exclude=event.get("connection_id")
+            )
 
 # API Keys
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "your-openai-api-key-here")
 WEATHER_API_KEY = os.getenv("WEATHER_API_KEY", "your-weather-api-key-here")
 OPENAI_MODEL = "gpt-3.5-turbo"
 
+# Upstream base URLs (override to point at local stand-ins, see stand_ins.py)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+OPENWEATHER_BASE_URL = os.getenv("OPENWEATHER_BASE_URL", "http://api.openweathermap.org/data/2.5").rstrip("/")
+WTTR_BASE_URL = os.getenv("WTTR_BASE_URL", "https://wttr.in").rstrip("/")
+DUCKDUCKGO_BASE_URL = os.getenv("DUCKDUCKGO_BASE_URL", "https://api.duckduckgo.com").rstrip("/")
+
+def upstream_session(upstream: str) -> aiohttp.ClientSession:
+    """Client session whose requests are timed and traced under an upstream's name"""
+    return aiohttp.ClientSession(trace_configs=[
+        metrics.upstream_trace(upstream, upstream_latency, upstream_responses),
+        tracer.client_trace(upstream),
+    ])
+
+# Search cache settings
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1024"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "300"))
+SEARCH_CACHE_NEGATIVE_TTL = float(os.getenv("SEARCH_CACHE_NEGATIVE_TTL", "60"))
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH") or None
+
+search_cache = SearchCache(
+    max_entries=SEARCH_CACHE_SIZE,
+    ttl=SEARCH_CACHE_TTL,
+    negative_ttl=SEARCH_CACHE_NEGATIVE_TTL,
+    persist_path=SEARCH_CACHE_PATH,
+)
+metrics.counter_from("search_cache_hits_total", "Searches answered from the cache", lambda: search_cache.hits)
+metrics.counter_from("search_cache_misses_total", "Searches fetched from upstream", lambda: search_cache.misses)
+metrics.counter_from(
+    "search_cache_coalesced_total", "Searches that waited for an identical fetch in flight", lambda: search_cache.coalesced
+)
+metrics.gauge("search_cache_hit_ratio", "Share of searches answered from the cache", lambda: search_cache.stats()["hit_ratio"])
+metrics.counter_from(
+    "search_cache_latency_saved_seconds_total", "Upstream latency avoided by cache hits", lambda: search_cache.latency_saved
+)
+metrics.gauge("search_cache_entries", "Searches held in the in-memory cache", lambda: search_cache.stats()["size"])
+
+# Rate limiting: token buckets per session and per client (an X-API-Key listed in the
+# comma-separated RATE_LIMIT_API_KEYS, or the address for any other caller; unlisted keys
+# are ignored so they cannot mint fresh buckets) refill RATE_LIMIT_*_RATE tokens a second
+# up to RATE_LIMIT_*_BURST; an LLM
+# turn, code execution and any other tool cost RATE_LIMIT_COST_* tokens. A rate of 0
+# disables the scope. Load shedding refuses new work while the smoothed event loop lag
+# passes LOAD_SHED_LOOP_LAG_MS or LOAD_SHED_MAX_GENERATIONS generations are in flight
+# (0 disables either). Refused work gets 429 with Retry-After
+RATE_LIMIT_SESSION_RATE = float(os.getenv("RATE_LIMIT_SESSION_RATE", "1"))
+RATE_LIMIT_SESSION_BURST = float(os.getenv("RATE_LIMIT_SESSION_BURST", "60"))
+RATE_LIMIT_CLIENT_RATE = float(os.getenv("RATE_LIMIT_CLIENT_RATE", "10"))
+RATE_LIMIT_CLIENT_BURST = float(os.getenv("RATE_LIMIT_CLIENT_BURST", "300"))
+RATE_LIMIT_COST_LLM = float(os.getenv("RATE_LIMIT_COST_LLM", "5"))
+RATE_LIMIT_COST_CODE = float(os.getenv("RATE_LIMIT_COST_CODE", "3"))
+RATE_LIMIT_COST_TOOL = float(os.getenv("RATE_LIMIT_COST_TOOL", "1"))
+RATE_LIMIT_API_KEYS = [key.strip() for key in os.getenv("RATE_LIMIT_API_KEYS", "").split(",") if key.strip()]
+LOAD_SHED_LOOP_LAG_MS = float(os.getenv("LOAD_SHED_LOOP_LAG_MS", "250"))
+LOAD_SHED_MAX_GENERATIONS = int(os.getenv("LOAD_SHED_MAX_GENERATIONS", "500"))
+
+rate_limiter = RateLimiter(
+    limits={
+        "session": Limit(RATE_LIMIT_SESSION_RATE, RATE_LIMIT_SESSION_BURST),
+        "client": Limit(RATE_LIMIT_CLIENT_RATE, RATE_LIMIT_CLIENT_BURST),
+    },
+    costs={"llm": RATE_LIMIT_COST_LLM, "code": RATE_LIMIT_COST_CODE, "tool": RATE_LIMIT_COST_TOOL},
+)
+load_shedder = LoadShedder(
+    loop_lag=lambda: loop_monitor.lag,
+    in_flight=generations.active,
+    max_loop_lag=LOAD_SHED_LOOP_LAG_MS / 1000,
+    max_in_flight=LOAD_SHED_MAX_GENERATIONS,
+)
+rejected_work = metrics.counter("rejected_work_total", "Work refused by rate limits or load shedding", ("kind", "reason"))
+
+def client_identity(api_key: Optional[str], address: Optional[str]) -> Optional[str]:
+    """The client a caller is charged as: its API key if listed in RATE_LIMIT_API_KEYS, else its address"""
+    if api_key:
+        for index, known in enumerate(RATE_LIMIT_API_KEYS):
+            if hmac.compare_digest(api_key.encode("utf-8"), known.encode("utf-8")):
+                return f"key:{index}"
+    return f"ip:{address}" if address else None
+
+def admit(kind: str, session_id: Optional[str], api_key: Optional[str], address: Optional[str]):
+    """Charge a unit of work to its session and client, or raise RateLimitedError"""
+    try:
+        load_shedder.check()
+        rate_limiter.acquire(kind, {"session": session_id, "client": client_identity(api_key, address)})
+    except RateLimitedError as e:
+        rejected_work.inc(kind, e.reason)
+        raise
+
+def admit_request(request: Request, kind: str, session_id: Optional[str] = None):
+    """admit() for an HTTP request, refusing it with 429 and Retry-After"""
+    try:
+        admit(kind, session_id, request.headers.get("x-api-key"), request.client.host if request.client else None)
+    except RateLimitedError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": e.retry_after_header})
+
+# Memory accounting: estimated bytes per subsystem at /debug/memory, plus tracemalloc
+# snapshots (MEMORY_TRACE_FRAMES frames per allocation, the last MEMORY_MAX_SNAPSHOTS kept)
+# whose allocation sites can be diffed; tracing starts with the first snapshot
+MEMORY_TRACE_FRAMES = int(os.getenv("MEMORY_TRACE_FRAMES", "10"))
+MEMORY_MAX_SNAPSHOTS = int(os.getenv("MEMORY_MAX_SNAPSHOTS", "8"))
+
+memory_accountant = MemoryAccountant()
+memory_accountant.register("message_store", message_store.memory_usage)
+memory_accountant.register("connection_registry", manager.memory_usage)
+memory_accountant.register("search_cache", search_cache.memory_usage)
+memory_accountant.register("in_flight_streams", generations.memory_usage)
+memory_accountant.register("trace_buffer", tracer.memory_usage)
+memory_accountant.register("rate_limit_buckets", rate_limiter.memory_usage)
+if traffic_recorder is not None:
+    memory_accountant.register("traffic_buffer", traffic_recorder.memory_usage)
+memory_snapshots = SnapshotStore(frames=MEMORY_TRACE_FRAMES, max_snapshots=MEMORY_MAX_SNAPSHOTS)
+metrics.gauge("process_resident_memory_bytes", "Resident set size of this worker", rss_bytes)
+
 # Tool definitions
 AVAILABLE_TOOLS = {
     "weather": "Get current weather for a location",
@@ -94,6 +378,30 @@ AVAILABLE_TOOLS = {
     "time": "Get current time and date"
 }
 
+# JSON schema for the arguments of each tool in AVAILABLE_TOOLS
+TOOL_PARAMETERS = {
+    "weather": {
+        "type": "object",
+        "properties": {"location": {"type": "string", "description": "City or place name"}},
+        "required": ["location"]
+    },
+    "search": {
+        "type": "object",
+        "properties": {"query": {"type": "string", "description": "Search query"}},
+        "required": ["query"]
+    },
+    "code_execute": {
+        "type": "object",
+        "properties": {"code": {"type": "string", "description": "Python source to run"}},
+        "required": ["code"]
+    },
+    "time": {"type": "object", "properties": {}}
+}
+
+# Routing mode: "regex" matches tool patterns locally, "functions" lets the
+# model pick tools through OpenAI function calling
+ROUTER_MODE = os.getenv("ROUTER_MODE", "regex")
+
 @app.get("/")
 def read_root():
     return {"message": "Oasiz Chatbot Backend is running!"}
@@ -104,86 +412,149 @@ def get_available_tools():
 
 @app.websocket("/ws/{session_id}")
 async def websocket_endpoint(websocket: WebSocket, session_id: str):
-    await manager.connect(websocket)
+    codec = negotiate(websocket.scope.get("subprotocols", []))
+    client_ip = websocket.client.host if websocket.client else "unknown"
+    connection = await manager.connect(websocket, session_id, codec, client_ip)
+    if connection is None:
+        return
     try:
         while True:
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
+            message_data = await receive_frame(websocket, codec)
+            manager.touch(connection)
+            
+            # Answer client heartbeats; pongs only need the activity update above
+            if message_data.get("type") == "ping":
+                await manager.send_personal_message({"type": "pong"}, connection)
             
-            # Handle incoming message
-            if message_data.get("type") == "message":
+            # Replay a generation this session lost track of, from the last offset seen
+            if message_data.get("type") == "resume":
+                await resume_generation(
+                    connection, str(message_data.get("generation_id", "")), int(message_data.get("offset", 0))
+                )
+            
+            # Handle incoming message; a draining worker only finishes the turns it has started
+            if message_data.get("type") == "message" and generations.draining:
+                await manager.send_personal_message(
+                    {"type": "error", "message": "Server is restarting; reconnect to continue"}, connection
+                )
+            elif message_data.get("type") == "message" and await admit_ws_turn(websocket, connection):
                 user_message = message_data.get("message", "")
                 
                 # Save user message
                 user_msg = {
-                    "id": len(chat_messages) + 1,
+                    "id": await backplane.next_id(),
                     "sender": "user",
                     "text": user_message,
                     "timestamp": datetime.utcnow().isoformat(),
                     "session_id": session_id
                 }
-                chat_messages.append(user_msg)
+                await record_message(user_msg, connection.id)
                 
-                # Send confirmation
+                # Get AI response; the generation keeps running if this socket drops,
+                # so a new one of the same session can resume it by its id
+                async def produce(text: str = user_message) -> AsyncGenerator[str, None]:
+                    yield await get_ai_response(text, session_id)
+                
+                generation = generations.start(session_id, produce())
+                
+                # Send confirmation with the generation id to resume from
                 await manager.send_personal_message(
-                    json.dumps({"type": "message_sent", "message": user_msg}),
-                    websocket
+                    {**codec.ack(user_msg), "generation_id": generation.id}, connection
                 )
-                
-                # Get AI response
                 try:
-                    ai_response = await get_ai_response(user_message, session_id)
+                    ai_response = await generation.wait()
+                    if generation.error:
+                        raise RuntimeError(generation.error)
                     
                     # Save bot response
                     bot_msg = {
-                        "id": len(chat_messages) + 1,
+                        "id": await backplane.next_id(),
                         "sender": "bot",
                         "text": ai_response,
                         "timestamp": datetime.utcnow().isoformat(),
                         "session_id": session_id
                     }
-                    chat_messages.append(bot_msg)
+                    await record_message(bot_msg, connection.id)
                     
                     # Send bot response
                     await manager.send_personal_message(
-                        json.dumps({"type": "bot_response", "message": bot_msg}),
-                        websocket
+                        {"type": "bot_response", "message": bot_msg, "generation_id": generation.id},
+                        connection
                     )
                 except Exception as e:
                     error_msg = {
                         "type": "error",
                         "message": f"Error getting AI response: {str(e)}"
                     }
-                    await manager.send_personal_message(json.dumps(error_msg), websocket)
+                    await manager.send_personal_message(error_msg, connection)
                     
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
+        pass
+    finally:
+        manager.disconnect(connection)
+
+async def admit_ws_turn(websocket: WebSocket, connection) -> bool:
+    """admit() an AI turn sent over a WebSocket, answering an error frame if it is refused"""
+    try:
+        admit("llm", connection.session_id, websocket.headers.get("x-api-key"), connection.client_ip)
+        return True
+    except RateLimitedError as e:
+        await manager.send_personal_message(
+            {"type": "error", "message": str(e), "retry_after": int(e.retry_after_header)}, connection
+        )
+        return False
+
+async def resume_generation(connection, generation_id: str, offset: int):
+    """Send a session's generation over a WebSocket from ``offset`` as chunk frames"""
+    generation = generations.resume(generation_id, connection.session_id)
+    if generation is None:
+        await manager.send_personal_message(
+            {"type": "error", "message": f"Unknown or expired generation: {generation_id}"}, connection
+        )
+        return
+    try:
+        async for chunk_offset, chunk in generation.follow(offset):
+            await manager.send_personal_message(
+                {"type": "chunk", "generation_id": generation_id, "offset": chunk_offset, "text": chunk},
+                connection
+            )
+    except ReplayGapError as e:
+        await manager.send_personal_message({"type": "error", "message": str(e)}, connection)
+        return
+    await manager.send_personal_message({"type": "generation_done", "generation_id": generation_id}, connection)
 
 @app.post("/chat/send", response_model=ChatMessageResponse)
 async def send_message(request: ChatMessageRequest):
     message = {
-        "id": len(chat_messages) + 1,
+        "id": await backplane.next_id(),
         "sender": request.sender,
         "text": request.text,
         "timestamp": datetime.utcnow().isoformat(),
         "session_id": request.session_id
     }
-    chat_messages.append(message)
+    await record_message(message)
     return message
 
 @app.get("/chat/history")
 async def get_history(session_id: str):
-    session_messages = [msg for msg in chat_messages if msg["session_id"] == session_id]
-    return session_messages
+    if not message_store.is_loaded(session_id):
+        with tracer.span("backplane.load_session"):
+            message_store.merge(session_id, await backplane.load_session(session_id))
+    # Messages are encoded once when stored; the response just joins their bytes
+    with tracer.span("store.history_json") as span:
+        body = message_store.history_json(session_id)
+        span.set("bytes", len(body))
+    return RawJSONResponse(body)
 
 # Tool Functions
+@instrumented_tool("weather")
 async def get_weather(location: str) -> str:
     """Get weather information for a location"""
     try:
         # Try OpenWeatherMap first
         if WEATHER_API_KEY and WEATHER_API_KEY != "your-weather-api-key-here":
-            async with aiohttp.ClientSession() as session:
-                url = f"http://api.openweathermap.org/data/2.5/weather"
+            async with upstream_session("openweathermap") as session:
+                url = f"{OPENWEATHER_BASE_URL}/weather"
                 params = {
                     "q": location,
                     "appid": WEATHER_API_KEY,
@@ -200,8 +571,8 @@ async def get_weather(location: str) -> str:
                         return f"Sorry, I couldn't get weather information for {location}"
         
         # Fallback: Use a free weather service (wttr.in)
-        async with aiohttp.ClientSession() as session:
-            url = f"https://wttr.in/{location}?format=3"
+        async with upstream_session("wttr") as session:
+            url = f"{WTTR_BASE_URL}/{location}?format=3"
             async with session.get(url) as response:
                 if response.status == 200:
                     weather_text = await response.text()
@@ -212,12 +583,12 @@ async def get_weather(location: str) -> str:
     except Exception as e:
         return f"Sorry, I'm having trouble getting weather data right now. Try asking me something else!"
 
-async def search_web(query: str) -> str:
-    """Search the web for information"""
+async def _fetch_search(query: str) -> Tuple[Dict[str, str], Optional[bool]]:
+    """Query DuckDuckGo and classify the result for the search cache"""
     try:
         # Using DuckDuckGo Instant Answer API (no API key required)
-        async with aiohttp.ClientSession() as session:
-            url = "https://api.duckduckgo.com/"
+        async with upstream_session("duckduckgo") as session:
+            url = f"{DUCKDUCKGO_BASE_URL}/"
             params = {
                 "q": query,
                 "format": "json",
@@ -226,20 +597,37 @@ async def search_web(query: str) -> str:
             }
             async with session.get(url, params=params) as response:
                 if response.status == 200:
-                    data = await response.json()
+                    # DuckDuckGo labels its JSON as application/x-javascript
+                    data = await response.json(content_type=None)
                     if data.get("Abstract"):
-                        return f"Search result for '{query}': {data['Abstract']}"
+                        return {"kind": "abstract", "text": data["Abstract"]}, False
                     elif data.get("Answer"):
-                        return f"Answer for '{query}': {data['Answer']}"
+                        return {"kind": "answer", "text": data["Answer"]}, False
                     else:
-                        return f"I found some results for '{query}' but couldn't get a specific answer."
+                        return {"kind": "empty", "text": ""}, True
                 else:
-                    return f"Sorry, I couldn't search for '{query}'"
+                    return {"kind": "unavailable", "text": ""}, None
     except Exception as e:
-        return f"Error searching: {str(e)}"
+        return {"kind": "error", "text": str(e)}, None
+
+@instrumented_tool("search")
+async def search_web(query: str) -> str:
+    """Search the web for information"""
+    result = await search_cache.get_or_fetch(query, _fetch_search)
+    if result["kind"] == "abstract":
+        return f"Search result for '{query}': {result['text']}"
+    elif result["kind"] == "answer":
+        return f"Answer for '{query}': {result['text']}"
+    elif result["kind"] == "empty":
+        return f"I found some results for '{query}' but couldn't get a specific answer."
+    elif result["kind"] == "unavailable":
+        return f"Sorry, I couldn't search for '{query}'"
+    else:
+        return f"Error searching: {result['text']}"
 
-def execute_code(code: str) -> str:
-    """Safely execute Python code"""
+@instrumented_tool("code_execute")
+async def execute_code(code: str) -> str:
+    """Safely execute Python code; cancelling the call kills the interpreter"""
     try:
         # Basic safety checks
         dangerous_imports = ['os', 'subprocess', 'sys', 'importlib', 'eval', 'exec']
@@ -247,37 +635,39 @@ def execute_code(code: str) -> str:
             if dangerous in code:
                 return f"Sorry, I can't execute code that uses '{dangerous}' for security reasons."
         
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
-            f.write(code)
-            temp_file = f.name
-        
+        # Execute with timeout; the code is piped to the interpreter instead of
+        # written to a temporary file, so nothing blocks the event loop on disk I/O
+        process = await asyncio.create_subprocess_exec(
+            'python', '-',
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
         try:
-            # Execute with timeout
-            result = subprocess.run(
-                ['python', temp_file],
-                capture_output=True,
-                text=True,
-                timeout=10
-            )
-            
-            if result.returncode == 0:
-                return f"Code executed successfully:\n{result.stdout}"
-            else:
-                return f"Code execution error:\n{result.stderr}"
-        finally:
-            # Clean up
-            os.unlink(temp_file)
-    except subprocess.TimeoutExpired:
+            stdout, stderr = await asyncio.wait_for(process.communicate(code.encode()), timeout=10)
+        except BaseException:
+            # Timed out or cancelled because the client went away
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+
+        if process.returncode == 0:
+            return f"Code executed successfully:\n{stdout.decode()}"
+        else:
+            return f"Code execution error:\n{stderr.decode()}"
+    except asyncio.TimeoutError:
         return "Code execution timed out (max 10 seconds)"
     except Exception as e:
         return f"Error executing code: {str(e)}"
 
+@instrumented_tool("time")
 def get_current_time() -> str:
     """Get current time and date"""
     now = datetime.now()
     return f"Current time: {now.strftime('%Y-%m-%d %H:%M:%S')}"
 
+@instrumented_tool("joke")
 async def get_joke() -> str:
     """Get a random joke"""
     jokes = [
@@ -294,6 +684,7 @@ async def get_joke() -> str:
     ]
     return random.choice(jokes)
 
+@instrumented_tool("quote")
 async def get_quote() -> str:
     """Get an inspirational quote"""
     quotes = [
@@ -310,6 +701,7 @@ async def get_quote() -> str:
     ]
     return random.choice(quotes)
 
+@instrumented_tool("play")
 async def play_game(game_type: str) -> str:
     """Play a simple game"""
     if game_type.lower() in ["rps", "rock", "paper", "scissors"]:
@@ -330,8 +722,9 @@ async def play_game(game_type: str) -> str:
         return "🎮 I can play Rock, Paper, Scissors, Number Guessing, or Hangman! Just ask me to play one of these games!"
 
 @app.post("/tools/execute")
-async def execute_tool(request: ToolRequest):
+async def execute_tool(request: ToolRequest, http_request: Request):
     """Execute a specific tool"""
+    admit_request(http_request, "code" if request.tool == "code_execute" else "tool", request.session_id)
     try:
         tool = request.tool
         params = request.params
@@ -344,7 +737,7 @@ async def execute_tool(request: ToolRequest):
             result = await search_web(query)
         elif tool == "code_execute":
             code = params.get("code", "")
-            result = execute_code(code)
+            result = await execute_code(code)
         elif tool == "time":
             result = get_current_time()
         elif tool == "joke":
@@ -361,9 +754,167 @@ async def execute_tool(request: ToolRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Function-calling router
+FUNCTION_CALLING_SYSTEM_PROMPT = """You are Oasiz, a helpful and friendly AI assistant. Call the provided tools when they help answer the user, calling several at once when they are independent. Be conversational, helpful, and engaging. Use emojis occasionally to make responses more friendly."""
+
+# Cheap, argument-free intents that are answered without a model round trip.
+# Anchored so they only fire when the whole message is the intent.
+FAST_PATH_PATTERNS = [
+    (re.compile(r"^\W*(what(\s+is|'s)\s+the\s+|what\s+)?(current\s+)?(time|date)(\s+is\s+it)?(\s+now|\s+today)?\W*$", re.IGNORECASE), "time"),
+    (re.compile(r"^\W*(tell\s+me\s+a\s+|another\s+)?joke\W*$", re.IGNORECASE), "joke"),
+    (re.compile(r"^\W*(give\s+me\s+an?\s+|another\s+)?(inspirational\s+|motivational\s+)?(quote|inspiration|motivation)\W*$", re.IGNORECASE), "quote"),
+]
+
+def get_tool_schemas() -> List[Dict[str, Any]]:
+    """Declare the tools in AVAILABLE_TOOLS as OpenAI function schemas"""
+    return [
+        {
+            "type": "function",
+            "function": {
+                "name": name,
+                "description": description,
+                "parameters": TOOL_PARAMETERS.get(name, {"type": "object", "properties": {}})
+            }
+        }
+        for name, description in AVAILABLE_TOOLS.items()
+    ]
+
+async def run_tool(name: str, arguments: Dict[str, Any]) -> str:
+    """Run a registered tool by name with model-supplied arguments"""
+    try:
+        if name == "weather":
+            return await get_weather(arguments.get("location", "New York"))
+        elif name == "search":
+            return await search_web(arguments.get("query", ""))
+        elif name == "code_execute":
+            return await execute_code(arguments.get("code", ""))
+        elif name == "time":
+            return get_current_time()
+        elif name == "joke":
+            return await get_joke()
+        elif name == "quote":
+            return await get_quote()
+        else:
+            return f"Unknown tool: {name}"
+    except Exception as e:
+        return f"Error running tool {name}: {str(e)}"
+
+async def match_fast_path(message: str) -> Optional[str]:
+    """Answer cheap intents locally, or return None to defer to the model"""
+    for pattern, tool in FAST_PATH_PATTERNS:
+        if pattern.match(message):
+            return await run_tool(tool, {})
+    return None
+
+async def _stream_completion(session: aiohttp.ClientSession, payload: Dict[str, Any]) -> AsyncGenerator[Dict[str, Any], None]:
+    """Yield the delta of each chunk of a streamed chat completion"""
+    timer = TokenStreamTimer(openai_first_token, openai_token_rate)
+    with tracer.span("openai.stream", kind="client", tools=bool(payload.get("tools"))) as span:
+        async with session.post(
+            f"{OPENAI_BASE_URL}/chat/completions",
+            headers={
+                "Authorization": f"Bearer {OPENAI_API_KEY}",
+                "Content-Type": "application/json"
+            },
+            json=dict(payload, stream=True)
+        ) as response:
+            span.set("http.status_code", response.status)
+            if response.status != 200:
+                error_text = await response.text()
+                raise RuntimeError(error_text)
+            async for line in response.content:
+                line = line.decode('utf-8').strip()
+                if not line.startswith('data: '):
+                    continue
+                data = line[6:]
+                if data == '[DONE]':
+                    break
+                try:
+                    json_data = json.loads(data)
+                except json.JSONDecodeError:
+                    continue
+                if json_data.get('choices'):
+                    delta = json_data['choices'][0].get('delta', {})
+                    if delta.get('content'):
+                        timer.token()
+                    yield delta
+            timer.finish()
+            span.set("tokens", timer.tokens)
+
+async def function_calling_turn(message: str) -> AsyncGenerator[str, None]:
+    """Stream one chat turn where the model may call tools in parallel.
+
+    Content is forwarded as it arrives. If the model asks for tools, they run
+    concurrently and their results are fed back for a streamed final answer.
+    """
+    messages = [
+        {"role": "system", "content": FUNCTION_CALLING_SYSTEM_PROMPT},
+        {"role": "user", "content": message}
+    ]
+    async with upstream_session("openai") as session:
+        tool_calls: Dict[int, Dict[str, Any]] = {}
+        async for delta in _stream_completion(session, {
+            "model": OPENAI_MODEL,
+            "messages": messages,
+            "tools": get_tool_schemas(),
+            "tool_choice": "auto",
+            "max_tokens": STREAM_MAX_TOKENS,
+            "temperature": 0.7
+        }):
+            if delta.get("content"):
+                yield delta["content"]
+            for call in delta.get("tool_calls") or []:
+                # Tool call fragments arrive spread over several chunks
+                entry = tool_calls.setdefault(call.get("index", 0), {
+                    "id": "", "type": "function", "function": {"name": "", "arguments": ""}
+                })
+                entry["id"] = call.get("id") or entry["id"]
+                function = call.get("function") or {}
+                entry["function"]["name"] += function.get("name") or ""
+                entry["function"]["arguments"] += function.get("arguments") or ""
+
+        if not tool_calls:
+            return
+
+        calls = [tool_calls[index] for index in sorted(tool_calls)]
+
+        async def run_call(call: Dict[str, Any]) -> str:
+            try:
+                arguments = json.loads(call["function"]["arguments"] or "{}")
+            except json.JSONDecodeError:
+                arguments = {}
+            return await run_tool(call["function"]["name"], arguments)
+
+        results = await asyncio.gather(*[run_call(call) for call in calls])
+
+        messages.append({"role": "assistant", "content": None, "tool_calls": calls})
+        for call, result in zip(calls, results):
+            messages.append({"role": "tool", "tool_call_id": call["id"], "content": result})
+
+        async for delta in _stream_completion(session, {
+            "model": OPENAI_MODEL,
+            "messages": messages,
+            "max_tokens": STREAM_MAX_TOKENS,
+            "temperature": 0.7
+        }):
+            if delta.get("content"):
+                yield delta["content"]
+
+def use_function_router() -> bool:
+    """Whether turns should be routed through OpenAI function calling"""
+    return ROUTER_MODE == "functions" and bool(OPENAI_API_KEY) and OPENAI_API_KEY != "your-openai-api-key-here"
+
+@tracer.wrap("ai.response")
 async def get_ai_response(message: str, session_id: str = None) -> str:
     """Get AI response with tool integration"""
     try:
+        if use_function_router():
+            fast_response = await match_fast_path(message)
+            if fast_response is not None:
+                return fast_response
+            tracer.current().set("route", "functions")
+            return "".join([chunk async for chunk in function_calling_turn(message)])
+
         # Check for MCP patterns first
         mcp_patterns = {
             r'\b(file|read|write|list)\s+(.+?)\b': ("filesystem", "file_read"),
@@ -393,6 +944,7 @@ async def get_ai_response(message: str, session_id: str = None) -> str:
         for pattern, tool_func in tool_patterns.items():
             match = re.search(pattern, message, re.IGNORECASE)
             if match:
+                tracer.current().set("route", tool_func.__name__)
                 if tool_func == get_weather:
                     location = match.group(1) if match.groups() else "New York"
                     return await get_weather(location)
@@ -404,7 +956,7 @@ async def get_ai_response(message: str, session_id: str = None) -> str:
                     code_match = re.search(r'```python\s*(.*?)\s*```', message, re.DOTALL)
                     if code_match:
                         code = code_match.group(1)
-                        return execute_code(code)
+                        return await execute_code(code)
                     else:
                         return "Please provide Python code in ```python``` blocks for execution."
                 elif tool_func == get_current_time:
@@ -418,12 +970,13 @@ async def get_ai_response(message: str, session_id: str = None) -> str:
                     return await play_game(game_type)
 
         # If no tool patterns match, use OpenAI API
+        tracer.current().set("route", "openai")
         if not OPENAI_API_KEY or OPENAI_API_KEY == "your-openai-api-key-here":
             return "I'm sorry, but I don't have access to AI capabilities right now. However, I can help you with weather, search, jokes, quotes, games, MCP operations, and more! Try asking about files, git, HTTP requests, or database queries."
 
-        async with aiohttp.ClientSession() as session:
+        async with upstream_session("openai") as session:
             async with session.post(
-                "https://api.openai.com/v1/chat/completions",
+                f"{OPENAI_BASE_URL}/chat/completions",
                 headers={
                     "Authorization": f"Bearer {OPENAI_API_KEY}",
                     "Content-Type": "application/json"
@@ -440,7 +993,7 @@ async def get_ai_response(message: str, session_id: str = None) -> str:
                             "content": message
                         }
                     ],
-                    "max_tokens": 500,
+                    "max_tokens": STREAM_MAX_TOKENS,
                     "temperature": 0.7
                 }
             ) as response:
@@ -455,17 +1008,37 @@ async def get_ai_response(message: str, session_id: str = None) -> str:
         return f"Sorry, I encountered an error: {str(e)}"
 
 @app.post("/ai/chat")
-async def chat_with_ai(request: AIRequest):
+async def chat_with_ai(request: AIRequest, http_request: Request):
     """Get AI response for a message"""
+    if generations.draining:
+        raise HTTPException(status_code=503, detail="Server is restarting", headers={"Retry-After": "1"})
+    admit_request(http_request, "llm", request.session_id)
     try:
         ai_response = await get_ai_response(request.message, request.session_id)
         return {"response": ai_response}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def sse_response(generation: Generation, offset: int = 0) -> StreamingResponse:
+    """Stream a generation as server-sent events whose ids are ``<generation>:<offset>``"""
+    async def events() -> AsyncGenerator[bytes, None]:
+        try:
+            async for chunk_offset, chunk in generation.follow(offset):
+                yield sse_event(chunk, f"{generation.id}:{chunk_offset}")
+        except ReplayGapError as e:
+            # The reader fell behind the ring buffer; a resume will answer 410
+            logger.warning(f"Ending stream of generation {generation.id}: {e}")
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers={"X-Generation-Id": generation.id}
+    )
+
 @app.post("/ai/stream")
-async def stream_ai_response(request: AIRequest):
+async def stream_ai_response(request: AIRequest, http_request: Request):
     """Stream AI response in real-time"""
+    if generations.draining:
+        raise HTTPException(status_code=503, detail="Server is restarting", headers={"Retry-After": "1"})
+    admit_request(http_request, "llm", request.session_id)
     try:
         if not OPENAI_API_KEY or OPENAI_API_KEY == "your-openai-api-key-here":
             return StreamingResponse(
@@ -473,6 +1046,28 @@ async def stream_ai_response(request: AIRequest):
                 media_type="text/plain"
             )
 
+        async def generate_with_functions() -> AsyncGenerator[str, None]:
+            try:
+                fast_response = await match_fast_path(request.message)
+                if fast_response is not None:
+                    yield fast_response
+                    return
+                emitted = 0
+                try:
+                    async for content in function_calling_turn(request.message):
+                        emitted += 1
+                        yield content
+                except asyncio.CancelledError:
+                    generations.count_saved_tokens(STREAM_MAX_TOKENS - emitted)
+                    raise
+                yield "[DONE]"
+            except Exception as e:
+                yield f"Sorry, I encountered an error: {str(e)}"
+
+        if use_function_router():
+            stream = tracer.stream("ai.stream", generate_with_functions(), route="functions")
+            return sse_response(generations.start(request.session_id, stream))
+
         async def generate() -> AsyncGenerator[str, None]:
             try:
                 # Check for tool usage first
@@ -493,44 +1088,45 @@ async def stream_ai_response(request: AIRequest):
                         if tool_func == get_weather:
                             location = match.group(1) if match.groups() else "New York"
                             weather_info = await get_weather(location)
-                            yield f"data: {weather_info}\n\n"
-                            yield f"data: Is there anything else you'd like to know about the weather?\n\n"
+                            yield weather_info
+                            yield "Is there anything else you'd like to know about the weather?"
                             return
                         elif tool_func == search_web:
                             query = match.group(1) if match.groups() else request.message
                             search_result = await search_web(query)
-                            yield f"data: {search_result}\n\n"
+                            yield search_result
                             return
                         elif tool_func == execute_code:
                             # Extract code from message (basic implementation)
                             code_match = re.search(r'```python\s*(.*?)\s*```', request.message, re.DOTALL)
                             if code_match:
                                 code = code_match.group(1)
-                                result = execute_code(code)
-                                yield f"data: {result}\n\n"
+                                result = await execute_code(code)
+                                yield result
                                 return
                         elif tool_func == get_current_time:
                             result = get_current_time()
-                            yield f"data: {result}\n\n"
+                            yield result
                             return
                         elif tool_func == get_joke:
                             result = await get_joke()
-                            yield f"data: {result}\n\n"
+                            yield result
                             return
                         elif tool_func == get_quote:
                             result = await get_quote()
-                            yield f"data: {result}\n\n"
+                            yield result
                             return
                         elif tool_func == play_game:
                             game_type = match.group(1) if match.groups() else "rps"
                             result = await play_game(game_type)
-                            yield f"data: {result}\n\n"
+                            yield result
                             return
 
                 # If no tool patterns match, use OpenAI API with streaming
-                async with aiohttp.ClientSession() as session:
+                timer = TokenStreamTimer(openai_first_token, openai_token_rate)
+                async with upstream_session("openai") as session:
                     async with session.post(
-                        "https://api.openai.com/v1/chat/completions",
+                        f"{OPENAI_BASE_URL}/chat/completions",
                         headers={
                             "Authorization": f"Bearer {OPENAI_API_KEY}",
                             "Content-Type": "application/json"
@@ -548,37 +1144,73 @@ async def stream_ai_response(request: AIRequest):
                                 }
                             ],
                             "stream": True,
-                            "max_tokens": 500,
+                            "max_tokens": STREAM_MAX_TOKENS,
                             "temperature": 0.7
                         }
                     ) as response:
                         if response.status == 200:
-                            async for line in response.content:
-                                line = line.decode('utf-8').strip()
-                                if line.startswith('data: '):
-                                    data = line[6:]  # Remove 'data: ' prefix
-                                    if data == '[DONE]':
-                                        yield f"data: [DONE]\n\n"
-                                        break
-                                    try:
-                                        json_data = json.loads(data)
-                                        if 'choices' in json_data and len(json_data['choices']) > 0:
-                                            delta = json_data['choices'][0].get('delta', {})
-                                            if 'content' in delta:
-                                                content = delta['content']
-                                                yield f"data: {content}\n\n"
-                                    except json.JSONDecodeError:
-                                        continue
+                            emitted = 0
+                            try:
+                                async for line in response.content:
+                                    line = line.decode('utf-8').strip()
+                                    if line.startswith('data: '):
+                                        data = line[6:]  # Remove 'data: ' prefix
+                                        if data == '[DONE]':
+                                            yield "[DONE]"
+                                            break
+                                        try:
+                                            json_data = json.loads(data)
+                                            if 'choices' in json_data and len(json_data['choices']) > 0:
+                                                delta = json_data['choices'][0].get('delta', {})
+                                                if 'content' in delta:
+                                                    content = delta['content']
+                                                    emitted += 1
+                                                    timer.token()
+                                                    yield content
+                                        except json.JSONDecodeError:
+                                            continue
+                            except asyncio.CancelledError:
+                                # The client went away: leaving the block closes the upstream request
+                                generations.count_saved_tokens(STREAM_MAX_TOKENS - emitted)
+                                raise
+                            finally:
+                                timer.finish()
                         else:
                             error_text = await response.text()
-                            yield f"data: Sorry, I encountered an error: {error_text}\n\n"
+                            yield f"Sorry, I encountered an error: {error_text}"
 
             except Exception as e:
-                yield f"data: Sorry, I encountered an error: {str(e)}\n\n"
+                yield f"Sorry, I encountered an error: {str(e)}"
 
-        return StreamingResponse(generate(), media_type="text/event-stream")
+        return sse_response(generations.start(request.session_id, tracer.stream("ai.stream", generate())))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) 
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/ai/stream/{generation_id}")
+async def resume_ai_stream(
+    generation_id: str,
+    session_id: Optional[str] = None,
+    offset: Optional[int] = None,
+    last_event_id: Optional[str] = Header(None),
+    x_session_id: Optional[str] = Header(None),
+):
+    """Resume a generation of the caller's session (``session_id`` or ``X-Session-Id``)
+    after the last event seen (``Last-Event-ID``) or from ``offset``"""
+    session_id = session_id or x_session_id
+    if not session_id:
+        raise HTTPException(status_code=400, detail="session_id is required to resume a generation")
+    if offset is None:
+        offset = 0
+        if last_event_id:
+            event_generation, _, event_offset = last_event_id.rpartition(":")
+            if event_generation == generation_id and event_offset.isdigit():
+                offset = int(event_offset) + 1
+    generation = generations.resume(generation_id, session_id)
+    if generation is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired generation")
+    if generation.chunks and offset < generation.chunks[0][0]:
+        raise HTTPException(status_code=410, detail="Offset is no longer buffered")
+    return sse_response(generation, offset)
 
 # # @app.get("/mcp/servers")
 async def get_mcp_servers():
@@ -616,11 +1248,122 @@ async def get_mcp_capabilities(server_name: str):
     capabilities = {"error": "MCP disabled"}
     return {"server": server_name, "capabilities": capabilities} 
 
+async def drain(timeout: float) -> int:
+    """Refuse new AI turns and let running generations finish; returns how many are still running"""
+    logger.info(f"Draining: waiting up to {timeout:g}s for {generations.stats()['active']} generations")
+    remaining = await generations.drain(timeout)
+    if remaining:
+        logger.warning(f"Drain deadline passed with {remaining} generations still running")
+    return remaining
+
+def after_fork():
+    """Give a worker forked from a preloading parent (serve.py) its own per-process state"""
+    random.seed()
+    backplane.worker_id = make_worker_id()
+    search_cache.reopen()
+
+@app.get("/stats")
+async def get_stats():
+    """Runtime statistics for caches and other subsystems"""
+    return {
+        "search_cache": search_cache.stats(),
+        "websockets": manager.stats(),
+        "backplane": backplane.stats(),
+        "message_store": {"messages": len(message_store)},
+        "generations": generations.stats(),
+        "event_loop": loop_monitor.stats(),
+        "traffic_recorder": traffic_recorder.stats() if traffic_recorder is not None else None,
+        "startup": startup_timer.stats(),
+        "rate_limiter": rate_limiter.stats(),
+        "load_shedder": load_shedder.stats(),
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """Request, tool and upstream metrics in the Prometheus text format"""
+    return Response(metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+def require_debug_token(token: Optional[str]):
+    """Refuse debug requests unless DEBUG_TOKEN is configured and presented"""
+    if DEBUG_TOKEN is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not token or not hmac.compare_digest(token, DEBUG_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid debug token")
+
+@app.get("/debug/profile")
+async def debug_profile(seconds: float = 5.0, all_threads: bool = False, x_debug_token: Optional[str] = Header(None)):
+    """Sample the live process for ``seconds`` and return collapsed stacks for a flame graph"""
+    require_debug_token(x_debug_token)
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be in (0, {PROFILE_MAX_SECONDS:g}]")
+    # By default only the event loop thread, which is the one serving requests
+    thread_id = None if all_threads else threading.get_ident()
+    try:
+        stacks = await asyncio.to_thread(get_profiler().collapsed, seconds, thread_id)
+    except profiling.ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(stacks)
+
+@app.get("/debug/traces")
+async def debug_traces(trace_id: Optional[str] = None, limit: int = 100, x_debug_token: Optional[str] = Header(None)):
+    """Recently finished spans, or all buffered spans of one trace"""
+    require_debug_token(x_debug_token)
+    spans = tracer.trace(trace_id) if trace_id else tracer.recent_spans(limit)
+    return {"spans": spans, "tracer": tracer.stats()}
+
+@app.get("/debug/memory")
+async def debug_memory(x_debug_token: Optional[str] = Header(None)):
+    """Estimated bytes held by each subsystem next to the process RSS"""
+    require_debug_token(x_debug_token)
+    return {**memory_accountant.report(), "snapshots": memory_snapshots.stats()}
+
+@app.get("/debug/memory/snapshots")
+async def list_memory_snapshots(x_debug_token: Optional[str] = Header(None)):
+    require_debug_token(x_debug_token)
+    return {**memory_snapshots.stats(), "snapshots": memory_snapshots.list()}
+
+@app.post("/debug/memory/snapshots")
+async def take_memory_snapshot(label: Optional[str] = None, x_debug_token: Optional[str] = Header(None)):
+    """Take a tracemalloc snapshot, starting tracing if it is not running"""
+    require_debug_token(x_debug_token)
+    return await asyncio.to_thread(memory_snapshots.take, label)
+
+@app.delete("/debug/memory/snapshots")
+async def clear_memory_snapshots(x_debug_token: Optional[str] = Header(None)):
+    """Drop the snapshots and stop tracing allocations"""
+    require_debug_token(x_debug_token)
+    memory_snapshots.clear()
+    return memory_snapshots.stats()
+
+@app.get("/debug/memory/diff")
+async def debug_memory_diff(
+    first: int,
+    second: Optional[int] = None,
+    group_by: str = "lineno",
+    limit: int = 20,
+    x_debug_token: Optional[str] = Header(None),
+):
+    """Allocation sites that grew or shrank most between two snapshots; without ``second``, up to now"""
+    require_debug_token(x_debug_token)
+    try:
+        memory_snapshots.get(first)
+        if second is None:
+            second = (await asyncio.to_thread(memory_snapshots.take, f"diff against {first}"))["id"]
+        sites = await asyncio.to_thread(memory_snapshots.diff, first, second, group_by, limit)
+    except SnapshotNotFoundError as e:
+        raise HTTPException(status_code=404, detail=f"Unknown snapshot {e.args[0]}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"first": first, "second": second, "group_by": group_by, "sites": sites}
+
 @app.get("/health")
-async def health_check():
+async def health_check(response: Response):
     """Health check endpoint for Docker and monitoring"""
+    if generations.draining:
+        # Fail the check so load balancers stop routing to a worker that is shutting down
+        response.status_code = 503
     return {
-        "status": "healthy",
+        "status": "draining" if generations.draining else "healthy",
         "timestamp": datetime.now().isoformat(),
         "version": "1.0.0",
         "services": {
@@ -632,7 +1375,7 @@ async def health_check():
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    uvicorn.run(app, host="0.0.0.0", port=port, ws_per_message_deflate=True)
 # Railway deployment test - Sat Jul 19 12:47:15 EDT 2025
 # Force redeploy - Sun Jul 20 08:15:38 EDT 2025
 
@@ -645,3 +1388,5 @@ async def debug_env():
         "weather_key_set": bool(WEATHER_API_KEY and WEATHER_API_KEY != "your-weather-api-key-here")
     }
 # Force restart - Sun Jul 20 08:21:31 EDT 2025
+
+startup_timer.mark("app_imported")
@@ -0,0 +1,487 @@
+"""
+MCP Client Sessions and Pool
+
+This module speaks JSON-RPC 2.0 to Model Context Protocol servers over two
+transports:
+
+- StdioTransport: a server subprocess exchanging newline-delimited JSON
+- HTTPTransport: the streamable HTTP transport, where each POST is answered
+  with a JSON body or a server-sent event stream
+
+A session performs the ``initialize`` handshake once and then multiplexes
+requests by id, so several calls can be in flight on one session. Servers
+speaking a protocol version that allows JSON-RPC batches receive multiple
+tool calls as a single batch. MCPPool keeps warm sessions per server up to a size limit,
+evicts sessions idle for longer than the idle timeout (by ``last_used``),
+pings the rest in the background and reconnects failed servers with
+exponential backoff.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+PROTOCOL_VERSION = "2025-03-26"
+CLIENT_INFO = {"name": "oasiz-chatbot", "version": "1.0.0"}
+# JSON-RPC batching was part of this revision only; later ones removed it
+BATCH_PROTOCOL_VERSIONS = {"2025-03-26"}
+
+ToolCall = Tuple[str, Dict[str, Any]]
+
+MessageHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+class MCPError(Exception):
+    """An MCP server could not be reached or answered with an error"""
+
+class Transport:
+    """Interface shared by MCP transports"""
+
+    async def start(self, on_message: MessageHandler):
+        """Open the transport and deliver every inbound message to ``on_message``"""
+        raise NotImplementedError
+
+    async def send(self, message: Any):
+        """Send one JSON-RPC message or batch"""
+        raise NotImplementedError
+
+    async def close(self):
+        raise NotImplementedError
+
+    @property
+    def alive(self) -> bool:
+        return True
+
+class StdioTransport(Transport):
+    """JSON-RPC over the stdin and stdout of a server subprocess"""
+
+    def __init__(self, command: List[str], env: Optional[Dict[str, str]] = None, cwd: Optional[str] = None):
+        self.command = command
+        self.env = env
+        self.cwd = cwd
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self._reader: Optional[asyncio.Task] = None
+
+    async def start(self, on_message: MessageHandler):
+        self.process = await asyncio.create_subprocess_exec(
+            *self.command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            env=self.env,
+            cwd=self.cwd,
+            # Tool results can be far larger than the default 64 KiB line limit
+            limit=16 * 1024 * 1024,
+        )
+        self._reader = asyncio.create_task(self._read(on_message))
+
+    async def _read(self, on_message: MessageHandler):
+        while True:
+            line = await self.process.stdout.readline()
+            if not line:
+                break
+            try:
+                payload = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Ignoring non-JSON output from {self.command[0]}: {line[:200]!r}")
+                continue
+            for message in payload if isinstance(payload, list) else [payload]:
+                await on_message(message)
+
+    async def send(self, message: Any):
+        if not self.alive:
+            raise MCPError(f"MCP server process {self.command[0]} has exited")
+        self.process.stdin.write(json.dumps(message).encode("utf-8") + b"\n")
+        await self.process.stdin.drain()
+
+    @property
+    def alive(self) -> bool:
+        return (
+            self.process is not None and self.process.returncode is None
+            and self._reader is not None and not self._reader.done()
+        )
+
+    async def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+        if self.process is not None and self.process.returncode is None:
+            self.process.stdin.close()
+            try:
+                await asyncio.wait_for(self.process.wait(), timeout=2)
+            except asyncio.TimeoutError:
+                self.process.kill()
+                await self.process.wait()
+
+class HTTPTransport(Transport):
+    """Streamable HTTP transport over one keep-alive client session"""
+
+    def __init__(self, url: str, headers: Optional[Dict[str, str]] = None):
+        self.url = url
+        self.headers = dict(headers or {})
+        self.session_id: Optional[str] = None
+        self._http: Optional[aiohttp.ClientSession] = None
+        self._on_message: Optional[MessageHandler] = None
+
+    async def start(self, on_message: MessageHandler):
+        self._on_message = on_message
+        self._http = aiohttp.ClientSession(headers=self.headers)
+
+    async def send(self, message: Any):
+        headers = {"Accept": "application/json, text/event-stream"}
+        if self.session_id:
+            headers["Mcp-Session-Id"] = self.session_id
+        try:
+            async with self._http.post(self.url, json=message, headers=headers) as response:
+                if response.status == 202:
+                    return
+                if response.status >= 400:
+                    raise MCPError(f"MCP server {self.url} answered HTTP {response.status}")
+                self.session_id = response.headers.get("Mcp-Session-Id", self.session_id)
+                if response.content_type == "text/event-stream":
+                    await self._read_events(response)
+                else:
+                    await self._deliver(await response.json(content_type=None))
+        except aiohttp.ClientError as e:
+            raise MCPError(f"MCP server {self.url} unreachable: {e}") from e
+
+    async def _read_events(self, response: aiohttp.ClientResponse):
+        data: List[str] = []
+        async for raw in response.content:
+            line = raw.decode("utf-8").rstrip("\r\n")
+            if line.startswith("data:"):
+                data.append(line[5:].lstrip())
+            elif not line and data:
+                await self._deliver(json.loads("\n".join(data)))
+                data = []
+        if data:
+            await self._deliver(json.loads("\n".join(data)))
+
+    async def _deliver(self, payload: Any):
+        for message in payload if isinstance(payload, list) else [payload]:
+            await self._on_message(message)
+
+    @property
+    def alive(self) -> bool:
+        return self._http is not None and not self._http.closed
+
+    async def close(self):
+        if self._http is not None:
+            await self._http.close()
+
+class MCPSession:
+    """An initialized JSON-RPC session with one MCP server"""
+
+    def __init__(self, transport: Transport, timeout: float = 30.0):
+        self.transport = transport
+        self.timeout = timeout
+        self.server_info: Dict[str, Any] = {}
+        self.capabilities: Dict[str, Any] = {}
+        self.protocol_version = ""
+        self.last_used = time.monotonic()
+        self.on_notification: Optional[MessageHandler] = None
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, asyncio.Future] = {}
+
+    @property
+    def alive(self) -> bool:
+        return self.transport.alive
+
+    async def open(self):
+        """Start the transport and perform the initialize handshake"""
+        await self.transport.start(self._dispatch)
+        result = await self.request("initialize", {
+            "protocolVersion": PROTOCOL_VERSION,
+            "capabilities": {},
+            "clientInfo": CLIENT_INFO,
+        })
+        self.server_info = result.get("serverInfo", {})
+        self.protocol_version = result.get("protocolVersion", "")
+        self.capabilities = result.get("capabilities", {})
+        await self.notify("notifications/initialized")
+
+    async def _dispatch(self, message: Dict[str, Any]):
+        if "id" in message and ("result" in message or "error" in message):
+            future = self._pending.pop(message["id"], None)
+            if future is not None and not future.done():
+                future.set_result(message)
+        elif "id" in message:
+            # Requests from the server: answer pings, refuse everything else
+            if message.get("method") == "ping":
+                await self.transport.send({"jsonrpc": "2.0", "id": message["id"], "result": {}})
+            else:
+                await self.transport.send({
+                    "jsonrpc": "2.0", "id": message["id"],
+                    "error": {"code": -32601, "message": f"Method not found: {message.get('method')}"},
+                })
+        elif self.on_notification is not None:
+            await self.on_notification(message)
+
+    @property
+    def supports_batch(self) -> bool:
+        return self.protocol_version in BATCH_PROTOCOL_VERSIONS
+
+    def _prepare(self, method: str, params: Optional[Dict[str, Any]]) -> Tuple[int, asyncio.Future, Dict[str, Any]]:
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        self.last_used = time.monotonic()
+        message = {"jsonrpc": "2.0", "id": request_id, "method": method}
+        if params is not None:
+            message["params"] = params
+        return request_id, future, message
+
+    async def request(self, method: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Send a request and wait for its result"""
+        request_id, future, message = self._prepare(method, params)
+        try:
+            await self.transport.send(message)
+            response = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise MCPError(f"MCP request {method} timed out after {self.timeout}s")
+        finally:
+            self._pending.pop(request_id, None)
+        if "error" in response:
+            raise MCPError(response["error"].get("message", "Unknown MCP error"))
+        return response.get("result", {})
+
+    async def request_batch(self, requests: List[Tuple[str, Optional[Dict[str, Any]]]]) -> List[Dict[str, Any]]:
+        """Send requests as one JSON-RPC batch and return the raw responses in order"""
+        prepared = [self._prepare(method, params) for method, params in requests]
+        try:
+            await self.transport.send([message for _, _, message in prepared])
+            return await asyncio.wait_for(asyncio.gather(*[future for _, future, _ in prepared]), self.timeout)
+        except asyncio.TimeoutError:
+            raise MCPError(f"MCP batch of {len(requests)} requests timed out after {self.timeout}s")
+        finally:
+            for request_id, _, _ in prepared:
+                self._pending.pop(request_id, None)
+
+    async def notify(self, method: str, params: Optional[Dict[str, Any]] = None):
+        message = {"jsonrpc": "2.0", "method": method}
+        if params is not None:
+            message["params"] = params
+        await self.transport.send(message)
+
+    async def ping(self):
+        await self.request("ping")
+
+    async def list_tools(self) -> List[Dict[str, Any]]:
+        return (await self.request("tools/list")).get("tools", [])
+
+    async def execute(self, tool_name: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Call a tool and convert its result to the MCPManager result format"""
+        result = await self.request("tools/call", {"name": tool_name, "arguments": params})
+        return self._tool_result(tool_name, result)
+
+    async def execute_many(self, calls: List[ToolCall]) -> List[Dict[str, Any]]:
+        """Run tool calls together: one batch if the server takes batches, else pipelined"""
+        if len(calls) > 1 and self.supports_batch:
+            responses = await self.request_batch(
+                [("tools/call", {"name": tool_name, "arguments": params}) for tool_name, params in calls]
+            )
+            return [
+                {"error": response["error"].get("message", "Unknown MCP error")} if "error" in response
+                else self._tool_result(tool_name, response.get("result", {}))
+                for (tool_name, _), response in zip(calls, responses)
+            ]
+        outcomes = await asyncio.gather(
+            *[self.execute(tool_name, params) for tool_name, params in calls], return_exceptions=True
+        )
+        return [{"error": str(o)} if isinstance(o, Exception) else o for o in outcomes]
+
+    @staticmethod
+    def _tool_result(tool_name: str, result: Dict[str, Any]) -> Dict[str, Any]:
+        text = "\n".join(item.get("text", "") for item in result.get("content", []) if item.get("type") == "text")
+        if result.get("isError"):
+            return {"error": text or f"Tool {tool_name} failed"}
+        outcome = {"success": True, "data": text, "content": result.get("content", [])}
+        if "structuredContent" in result:
+            outcome["structured"] = result["structuredContent"]
+        return outcome
+
+    async def close(self):
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(MCPError("MCP session closed"))
+        self._pending.clear()
+        await self.transport.close()
+
+SessionFactory = Callable[[str], Awaitable[Any]]
+
+class MCPPool:
+    """Warm MCP sessions keyed by server name"""
+
+    def __init__(
+        self,
+        factory: SessionFactory,
+        max_sessions: int = 8,
+        idle_timeout: float = 300.0,
+        health_interval: float = 30.0,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+    ):
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.health_interval = health_interval
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.sessions: Dict[str, Any] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._failures: Dict[str, int] = {}
+        self._retry_at: Dict[str, float] = {}
+        self._reconnects: Dict[str, asyncio.Task] = {}
+        self._maintenance: Optional[asyncio.Task] = None
+        self.connects = 0
+        self.reuses = 0
+        self.evictions = 0
+        self.health_failures = 0
+
+    def _backoff(self, server_name: str) -> float:
+        failures = self._failures.get(server_name, 0)
+        return min(self.backoff_max, self.backoff_base * 2 ** max(0, failures - 1))
+
+    async def acquire(self, server_name: str) -> Any:
+        """Return a warm session for a server, connecting if needed"""
+        self.start()
+        session = self.sessions.get(server_name)
+        if session is not None and session.alive:
+            self.reuses += 1
+            session.last_used = time.monotonic()
+            return session
+        async with self._locks.setdefault(server_name, asyncio.Lock()):
+            session = self.sessions.get(server_name)
+            if session is not None and session.alive:
+                self.reuses += 1
+                session.last_used = time.monotonic()
+                return session
+            if session is not None:
+                await self.release(server_name)
+            wait = self._retry_at.get(server_name, 0) - time.monotonic()
+            if wait > 0:
+                raise MCPError(f"MCP server {server_name} is backing off, retry in {wait:.1f}s")
+            return await self._connect(server_name)
+
+    async def _connect(self, server_name: str) -> Any:
+        try:
+            session = await self.factory(server_name)
+        except Exception as e:
+            self._failures[server_name] = self._failures.get(server_name, 0) + 1
+            self._retry_at[server_name] = time.monotonic() + self._backoff(server_name)
+            logger.error(f"Failed to connect to MCP server {server_name}: {e}")
+            raise MCPError(f"Could not connect to MCP server {server_name}: {e}") from e
+        self._failures.pop(server_name, None)
+        self._retry_at.pop(server_name, None)
+        if len(self.sessions) >= self.max_sessions:
+            await self._evict_lru()
+        self.sessions[server_name] = session
+        self.connects += 1
+        logger.info(f"Connected to MCP server: {server_name}")
+        return session
+
+    async def _evict_lru(self):
+        server_name = min(self.sessions, key=lambda name: self.sessions[name].last_used)
+        logger.info(f"Evicting least recently used MCP session: {server_name}")
+        self.evictions += 1
+        await self.release(server_name)
+
+    async def release(self, server_name: str) -> bool:
+        """Close and forget a server's session"""
+        session = self.sessions.pop(server_name, None)
+        if session is None:
+            return False
+        try:
+            await session.close()
+        except Exception as e:
+            logger.debug(f"Error closing MCP session {server_name}: {e}")
+        return True
+
+    async def evict_idle(self) -> int:
+        """Close sessions unused for longer than the idle timeout"""
+        now = time.monotonic()
+        idle = [name for name, s in self.sessions.items() if now - s.last_used > self.idle_timeout]
+        for server_name in idle:
+            logger.info(f"Evicting idle MCP session: {server_name}")
+            await self.release(server_name)
+        self.evictions += len(idle)
+        return len(idle)
+
+    async def check_health(self) -> int:
+        """Ping warm sessions and reconnect the ones that fail"""
+        failed = 0
+        for server_name, session in list(self.sessions.items()):
+            try:
+                if not session.alive:
+                    raise MCPError("transport closed")
+                last_used = session.last_used
+                await session.ping()
+                # A health check is not a use
+                session.last_used = last_used
+            except Exception as e:
+                failed += 1
+                self.health_failures += 1
+                logger.warning(f"MCP server {server_name} failed its health check: {e}")
+                await self.release(server_name)
+                self._schedule_reconnect(server_name)
+        return failed
+
+    def _schedule_reconnect(self, server_name: str):
+        if server_name not in self._reconnects:
+            self._reconnects[server_name] = asyncio.create_task(self._reconnect(server_name))
+
+    async def _reconnect(self, server_name: str):
+        try:
+            while server_name not in self.sessions:
+                await asyncio.sleep(self._backoff(server_name))
+                self._retry_at.pop(server_name, None)
+                try:
+                    await self.acquire(server_name)
+                except MCPError:
+                    continue
+        finally:
+            self._reconnects.pop(server_name, None)
+
+    async def _maintain(self):
+        interval = min(self.health_interval or self.idle_timeout, self.idle_timeout or self.health_interval)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if self.idle_timeout:
+                    await self.evict_idle()
+                if self.health_interval:
+                    await self.check_health()
+            except Exception as e:
+                logger.error(f"MCP pool maintenance failed: {e}")
+
+    def start(self):
+        """Start idle eviction and health checks"""
+        if (self.idle_timeout or self.health_interval) and (self._maintenance is None or self._maintenance.done()):
+            self._maintenance = asyncio.create_task(self._maintain())
+
+    async def stop(self):
+        tasks = list(self._reconnects.values())
+        if self._maintenance is not None:
+            tasks.append(self._maintenance)
+            self._maintenance = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for server_name in list(self.sessions):
+            await self.release(server_name)
+
+    def stats(self) -> Dict[str, Any]:
+        """Get pool statistics"""
+        return {
+            "sessions": len(self.sessions),
+            "max_sessions": self.max_sessions,
+            "connects": self.connects,
+            "reuses": self.reuses,
+            "evictions": self.evictions,
+            "health_failures": self.health_failures,
+            "reconnecting": sorted(self._reconnects),
+        }
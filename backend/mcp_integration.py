@@ -3,17 +3,35 @@ MCP (Model Context Protocol) Integration Module
 
 This module provides integration with MCP servers for enhanced context management
 and tool calling capabilities as required by the assignment.
+
+Servers with an ``http(s)://`` URL or a ``command`` are reached through real
+MCP sessions from mcp_client, kept warm in a pool. Servers with an ``mcp://``
+URL are simulated in-process, unless a reference root is configured: then the
+filesystem and git entries are served by the local servers in mcp_servers.
+
+Servers come from a JSON config file (``MCP_SERVERS_CONFIG``) or the built-in
+defaults and are only connected on first use. Each server's ``tools/list`` is
+cached for a TTL and dropped when the server announces a tool list change;
+a tool-to-server index built from those lists routes calls without probing.
 """
 
 import asyncio
 import json
 import logging
-from typing import Dict, List, Optional, Any
+import os
+import re
+import sys
+import time
+from typing import Dict, List, Optional, Any, Tuple
 from dataclasses import dataclass
-import aiohttp
+
+from http_fetch import HTTPFetcher
+from mcp_client import HTTPTransport, MCPError, MCPPool, MCPSession, StdioTransport, ToolCall
 
 logger = logging.getLogger(__name__)
 
+REFERENCE_SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mcp_servers.py")
+
 @dataclass
 class MCPServer:
     """Represents an MCP server configuration"""
@@ -21,47 +39,197 @@ class MCPServer:
     url: str
     capabilities: List[str]
     description: str
+    command: Optional[List[str]] = None
+
+# Built-in servers, in the same shape as an MCP_SERVERS_CONFIG file
+DEFAULT_SERVER_CONFIG = {
+    "mcpServers": {
+        "filesystem": {
+            "url": "mcp://localhost:3001",
+            "capabilities": ["file_read", "file_write", "file_list"],
+            "description": "File system operations"
+        },
+        "git": {
+            "url": "mcp://localhost:3002",
+            "capabilities": ["git_status", "git_commit", "git_push"],
+            "description": "Git repository management"
+        },
+        "http": {
+            "url": "mcp://localhost:3003",
+            "capabilities": ["http_get", "http_post", "http_put"],
+            "description": "HTTP request handling"
+        },
+        "database": {
+            "url": "mcp://localhost:3004",
+            "capabilities": ["db_query", "db_insert", "db_update"],
+            "description": "Database operations"
+        }
+    }
+}
+
+def load_server_config(path: Optional[str] = None) -> List[MCPServer]:
+    """Server definitions from a JSON config file, or the built-in defaults.
+
+    Entries take a ``url`` or a ``command`` (a list, or a string plus ``args``),
+    and optionally ``capabilities`` and ``description``.
+    """
+    config = DEFAULT_SERVER_CONFIG
+    if path:
+        with open(path) as f:
+            config = json.load(f)
+    servers = []
+    for name, entry in config.get("mcpServers", {}).items():
+        command = entry.get("command")
+        if isinstance(command, str):
+            command = [command] + list(entry.get("args", []))
+        servers.append(MCPServer(
+            name=name,
+            url=entry.get("url", f"stdio://{name}"),
+            capabilities=list(entry.get("capabilities", [])),
+            description=entry.get("description", ""),
+            command=command,
+        ))
+    return servers
+
+class SimulatedSession:
+    """Stand-in session for ``mcp://`` servers, answered in-process"""
+
+    def __init__(self, manager: "MCPManager", server_name: str):
+        self.manager = manager
+        self.server_name = server_name
+        self.last_used = time.monotonic()
+        self.alive = True
+
+    async def ping(self):
+        pass
+
+    async def list_tools(self) -> List[Dict[str, Any]]:
+        server = self.manager.servers[self.server_name]
+        return [{"name": tool, "description": server.description} for tool in server.capabilities]
+
+    async def execute(self, tool_name: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        if tool_name.startswith("file_"):
+            return await self.manager._execute_filesystem_tool(tool_name, params)
+        elif tool_name.startswith("git_"):
+            return await self.manager._execute_git_tool(tool_name, params)
+        elif tool_name.startswith("http_"):
+            return await self.manager._execute_http_tool(tool_name, params)
+        elif tool_name.startswith("db_"):
+            return await self.manager._execute_database_tool(tool_name, params)
+        else:
+            return {"error": f"Unknown tool: {tool_name}"}
+
+    async def execute_many(self, calls: List[ToolCall]) -> List[Dict[str, Any]]:
+        return list(await asyncio.gather(*[self.execute(tool_name, params) for tool_name, params in calls]))
+
+    async def close(self):
+        self.alive = False
 
 class MCPManager:
     """Manages MCP server connections and tool execution"""
     
-    def __init__(self):
+    def __init__(
+        self,
+        max_sessions: int = 8,
+        idle_timeout: float = 300.0,
+        health_interval: float = 30.0,
+        http_max_bytes: int = 65536,
+        http_cache_entries: int = 128,
+        reference_root: Optional[str] = None,
+        config_path: Optional[str] = None,
+        tools_ttl: float = 300.0,
+    ):
         self.servers: Dict[str, MCPServer] = {}
-        self.active_connections: Dict[str, Any] = {}
-        self._initialize_default_servers()
+        self.reference_root = reference_root
+        self.tools_ttl = tools_ttl
+        # Cached tools/list results by server: (fetched at, tools)
+        self._tools: Dict[str, Tuple[float, List[Dict[str, Any]]]] = {}
+        self.capability_index: Dict[str, str] = {}
+        self.tool_list_fetches = 0
+        self.fetcher = HTTPFetcher(max_bytes=http_max_bytes, cache_entries=http_cache_entries)
+        self.pool = MCPPool(
+            self._open_session,
+            max_sessions=max_sessions,
+            idle_timeout=idle_timeout,
+            health_interval=health_interval,
+        )
+        self._load_servers(config_path)
+
+    @property
+    def active_connections(self) -> Dict[str, Any]:
+        """Warm sessions by server name"""
+        return {
+            name: {"connected": session.alive, "server": self.servers.get(name), "last_used": session.last_used}
+            for name, session in self.pool.sessions.items()
+        }
+
+    async def _open_session(self, server_name: str):
+        """Open a session with a server; the pool decides when"""
+        server = self.servers[server_name]
+        if server.command:
+            session = MCPSession(StdioTransport(server.command))
+        elif server.url.startswith(("http://", "https://")):
+            session = MCPSession(HTTPTransport(server.url))
+        else:
+            # Simulate connection for mcp:// servers
+            return SimulatedSession(self, server_name)
+
+        async def on_notification(message: Dict[str, Any]):
+            await self._on_notification(server_name, message)
+
+        session.on_notification = on_notification
+        try:
+            await session.open()
+        except BaseException:
+            await session.close()
+            raise
+        return session
     
-    def _initialize_default_servers(self):
-        """Initialize default MCP servers"""
-        default_servers = [
-            MCPServer(
-                name="filesystem",
-                url="mcp://localhost:3001",
-                capabilities=["file_read", "file_write", "file_list"],
-                description="File system operations"
-            ),
-            MCPServer(
-                name="git",
-                url="mcp://localhost:3002", 
-                capabilities=["git_status", "git_commit", "git_push"],
-                description="Git repository management"
-            ),
-            MCPServer(
-                name="http",
-                url="mcp://localhost:3003",
-                capabilities=["http_get", "http_post", "http_put"],
-                description="HTTP request handling"
-            ),
-            MCPServer(
-                name="database",
-                url="mcp://localhost:3004",
-                capabilities=["db_query", "db_insert", "db_update"],
-                description="Database operations"
-            )
-        ]
-        
-        for server in default_servers:
+    def _load_servers(self, config_path: Optional[str] = None):
+        """Register servers from config without connecting to any of them"""
+        for server in load_server_config(config_path):
+            if self.reference_root and server.name in ("filesystem", "git") and server.url.startswith("mcp://"):
+                # Served by the local reference implementation over stdio
+                server.command = [sys.executable, REFERENCE_SERVER_SCRIPT, server.name, "--root", self.reference_root]
             self.servers[server.name] = server
-    
+        self._reindex()
+
+    def _reindex(self):
+        """Rebuild the tool-to-server index; the first server in config order wins"""
+        index: Dict[str, str] = {}
+        for name, server in self.servers.items():
+            tools = self._tools.get(name)
+            names = [tool["name"] for tool in tools[1]] if tools else server.capabilities
+            for tool_name in names:
+                index.setdefault(tool_name, name)
+        self.capability_index = index
+
+    def server_for(self, tool_name: str) -> Optional[str]:
+        """Server providing a tool, from the index"""
+        return self.capability_index.get(tool_name)
+
+    async def list_tools(self, server_name: str, refresh: bool = False) -> List[Dict[str, Any]]:
+        """A server's tools/list, cached for the TTL"""
+        cached = self._tools.get(server_name)
+        if cached is not None and not refresh and time.monotonic() - cached[0] < self.tools_ttl:
+            return cached[1]
+        session = await self.pool.acquire(server_name)
+        tools = await session.list_tools()
+        self.tool_list_fetches += 1
+        self._tools[server_name] = (time.monotonic(), tools)
+        self._reindex()
+        return tools
+
+    def invalidate_tools(self, server_name: str):
+        """Forget a server's cached tool list"""
+        if self._tools.pop(server_name, None) is not None:
+            self._reindex()
+
+    async def _on_notification(self, server_name: str, message: Dict[str, Any]):
+        if message.get("method") == "notifications/tools/list_changed":
+            logger.info(f"MCP server {server_name} changed its tools")
+            self.invalidate_tools(server_name)
+
     async def connect_to_server(self, server_name: str) -> bool:
         """Connect to an MCP server"""
         try:
@@ -69,16 +237,7 @@ class MCPManager:
                 logger.error(f"Unknown MCP server: {server_name}")
                 return False
             
-            server = self.servers[server_name]
-            
-            # Simulate connection (in real implementation, this would use actual MCP protocol)
-            self.active_connections[server_name] = {
-                "connected": True,
-                "server": server,
-                "last_used": asyncio.get_event_loop().time()
-            }
-            
-            logger.info(f"Connected to MCP server: {server_name}")
+            await self.pool.acquire(server_name)
             return True
             
         except Exception as e:
@@ -88,34 +247,47 @@ class MCPManager:
     async def execute_tool(self, server_name: str, tool_name: str, params: Dict[str, Any]) -> Dict[str, Any]:
         """Execute a tool on an MCP server"""
         try:
-            if server_name not in self.active_connections:
-                await self.connect_to_server(server_name)
-            
-            if server_name not in self.active_connections:
-                return {"error": f"Could not connect to MCP server: {server_name}"}
-            
-            # Simulate tool execution (in real implementation, this would use actual MCP protocol)
-            server = self.servers[server_name]
+            if server_name not in self.servers:
+                return {"error": f"Unknown server: {server_name}"}
             
-            # Update last used time
-            self.active_connections[server_name]["last_used"] = asyncio.get_event_loop().time()
+            # Reuse the warm session; the pool only connects on a miss
+            try:
+                session = await self.pool.acquire(server_name)
+            except MCPError as e:
+                return {"error": f"Could not connect to MCP server: {server_name} ({e})"}
             
-            # Simulate different tool responses based on server and tool
-            if server_name == "filesystem":
-                return await self._execute_filesystem_tool(tool_name, params)
-            elif server_name == "git":
-                return await self._execute_git_tool(tool_name, params)
-            elif server_name == "http":
-                return await self._execute_http_tool(tool_name, params)
-            elif server_name == "database":
-                return await self._execute_database_tool(tool_name, params)
-            else:
-                return {"error": f"Unknown server: {server_name}"}
+            return await session.execute(tool_name, params)
                 
         except Exception as e:
             logger.error(f"Error executing MCP tool {tool_name} on {server_name}: {e}")
             return {"error": str(e)}
     
+    async def execute_many(self, calls: List[Tuple[str, str, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """Execute ``(server_name, tool_name, params)`` calls, returning results in order.
+
+        Calls to different servers run concurrently; calls to the same server
+        share one session and go out together as a batch or pipelined.
+        """
+        groups: Dict[str, List[int]] = {}
+        for index, (server_name, _, _) in enumerate(calls):
+            groups.setdefault(server_name, []).append(index)
+        results: List[Dict[str, Any]] = [{} for _ in calls]
+
+        async def run_group(server_name: str, indexes: List[int]):
+            try:
+                if server_name not in self.servers:
+                    raise MCPError(f"Unknown server: {server_name}")
+                session = await self.pool.acquire(server_name)
+                outcomes = await session.execute_many([(calls[i][1], calls[i][2]) for i in indexes])
+            except Exception as e:
+                logger.error(f"Error executing {len(indexes)} MCP tools on {server_name}: {e}")
+                outcomes = [{"error": str(e)}] * len(indexes)
+            for index, outcome in zip(indexes, outcomes):
+                results[index] = outcome
+
+        await asyncio.gather(*[run_group(name, indexes) for name, indexes in groups.items()])
+        return results
+
     async def _execute_filesystem_tool(self, tool_name: str, params: Dict[str, Any]) -> Dict[str, Any]:
         """Execute filesystem-related tools"""
         if tool_name == "file_read":
@@ -159,18 +331,21 @@ class MCPManager:
         url = params.get("url", "")
         
         if tool_name == "http_get":
-            async with aiohttp.ClientSession() as session:
-                try:
-                    async with session.get(url) as response:
-                        content = await response.text()
-                        return {
-                            "success": True,
-                            "data": f"HTTP GET response from {url}",
-                            "status": response.status,
-                            "content": content[:500] + "..." if len(content) > 500 else content
-                        }
-                except Exception as e:
-                    return {"error": f"HTTP GET failed: {e}"}
+            try:
+                # Streamed and capped at the fetcher's byte limit, revalidated when cached
+                result = await self.fetcher.fetch(url)
+                content = result.text
+                return {
+                    "success": True,
+                    "data": f"HTTP GET response from {url}",
+                    "status": result.status,
+                    "content": content[:500] + "..." if len(content) > 500 or result.truncated else content,
+                    "bytes_read": result.bytes_read,
+                    "truncated": result.truncated,
+                    "cached": result.from_cache
+                }
+            except Exception as e:
+                return {"error": f"HTTP GET failed: {e}"}
         else:
             return {"error": f"Unknown HTTP tool: {tool_name}"}
     
@@ -200,7 +375,9 @@ class MCPManager:
         ]
     
     def get_server_capabilities(self, server_name: str) -> List[str]:
-        """Get capabilities of a specific MCP server"""
+        """Get capabilities of a specific MCP server, as last listed by the server"""
+        if server_name in self._tools:
+            return [tool["name"] for tool in self._tools[server_name][1]]
         if server_name in self.servers:
             return self.servers[server_name].capabilities
         return []
@@ -208,8 +385,7 @@ class MCPManager:
     async def disconnect_from_server(self, server_name: str) -> bool:
         """Disconnect from an MCP server"""
         try:
-            if server_name in self.active_connections:
-                del self.active_connections[server_name]
+            if await self.pool.release(server_name):
                 logger.info(f"Disconnected from MCP server: {server_name}")
                 return True
             return False
@@ -217,45 +393,73 @@ class MCPManager:
             logger.error(f"Error disconnecting from MCP server {server_name}: {e}")
             return False
 
-# Global MCP manager instance
-mcp_manager = MCPManager()
+    def stats(self) -> Dict[str, Any]:
+        """Get MCP session pool and HTTP fetch statistics"""
+        return dict(
+            self.pool.stats(),
+            http=self.fetcher.stats(),
+            indexed_tools=len(self.capability_index),
+            tool_list_fetches=self.tool_list_fetches,
+        )
+
+# Global MCP manager instance; pool size, idle timeout and health interval in seconds
+mcp_manager = MCPManager(
+    max_sessions=int(os.getenv("MCP_POOL_SIZE", "8")),
+    idle_timeout=float(os.getenv("MCP_IDLE_TIMEOUT", "300")),
+    health_interval=float(os.getenv("MCP_HEALTH_INTERVAL", "30")),
+    http_max_bytes=int(os.getenv("MCP_HTTP_MAX_BYTES", "65536")),
+    http_cache_entries=int(os.getenv("MCP_HTTP_CACHE_SIZE", "128")),
+    reference_root=os.getenv("MCP_REFERENCE_ROOT") or None,
+    config_path=os.getenv("MCP_SERVERS_CONFIG") or None,
+    tools_ttl=float(os.getenv("MCP_TOOLS_TTL", "300")),
+)
+
+# Message patterns routed to MCP tools, compiled once
+MCP_PATTERNS = [
+    (re.compile(r'\b(file|read|write|list)\s+(.+?)\b', re.IGNORECASE), "file_read"),
+    (re.compile(r'\bgit\s+(status|commit|push)\b', re.IGNORECASE), "git_status"),
+    (re.compile(r'\bhttp\s+(get|post)\s+(https?://\S+)', re.IGNORECASE), "http_get"),
+    (re.compile(r'\b(database|db|query)\s+(.+?)\b', re.IGNORECASE), "db_query"),
+]
 
 async def get_mcp_response(message: str) -> str:
     """Get response using MCP servers"""
     try:
-        # Check if message contains MCP-related requests
-        mcp_patterns = {
-            r'\b(file|read|write|list)\s+(.+?)\b': ("filesystem", "file_read"),
-            r'\bgit\s+(status|commit|push)\b': ("git", "git_status"),
-            r'\bhttp\s+(get|post)\s+(https?://\S+)': ("http", "http_get"),
-            r'\b(database|db|query)\s+(.+?)\b': ("database", "db_query")
-        }
-        
-        for pattern, (server_name, tool_name) in mcp_patterns.items():
-            import re
-            match = re.search(pattern, message, re.IGNORECASE)
+        # Collect every MCP request in the message, then run them together
+        calls = []
+        for pattern, tool_name in MCP_PATTERNS:
+            match = pattern.search(message)
             if match:
+                # Route by the capability index; no server is contacted to find the tool
+                server_name = mcp_manager.server_for(tool_name)
+                if server_name is None:
+                    continue
                 # Extract parameters based on the pattern
                 params = {}
-                if server_name == "filesystem":
+                if tool_name == "file_read":
                     params["path"] = match.group(2)
-                elif server_name == "git":
+                elif tool_name == "git_status":
                     params["action"] = match.group(1)
-                elif server_name == "http":
+                elif tool_name == "http_get":
                     params["url"] = match.group(2)
-                elif server_name == "database":
+                elif tool_name == "db_query":
                     params["query"] = match.group(2)
-                
-                # Execute the MCP tool
-                result = await mcp_manager.execute_tool(server_name, tool_name, params)
-                
-                if "error" in result:
-                    return f"❌ MCP Error: {result['error']}"
-                else:
-                    return f"✅ MCP {server_name} result: {result.get('data', 'Operation completed')}"
+                calls.append((server_name, tool_name, params))
         
-        return "I can help you with MCP operations! Try asking about files, git, HTTP requests, or database queries."
+        if not calls:
+            return "I can help you with MCP operations! Try asking about files, git, HTTP requests, or database queries."
+        
+        # Execute the MCP tools
+        results = await mcp_manager.execute_many(calls)
+        
+        lines = []
+        for (server_name, _, _), result in zip(calls, results):
+            if "error" in result:
+                lines.append(f"❌ MCP Error: {result['error']}")
+            else:
+                lines.append(f"✅ MCP {server_name} result: {result.get('data', 'Operation completed')}")
+        return "\n".join(lines)
         
     except Exception as e:
         logger.error(f"Error in MCP response: {e}")
-        return f"❌ MCP Error: {str(e)}" 
\ No newline at end of file
+        return f"❌ MCP Error: {str(e)}"
@@ -0,0 +1,352 @@
+"""
+Reference MCP Servers
+
+This module provides local Model Context Protocol servers for the
+``filesystem`` and ``git`` entries of MCPManager, so the MCP path can be
+exercised and load-tested against real data instead of canned responses.
+
+- FilesystemServer: ``file_read`` serves byte ranges through a memory map and
+  ``file_list`` pages through a directory in name order. The cursor is the
+  last name returned, and the sorted names are scanned once and cached until
+  the directory changes, so each further page costs a stat and a bisect.
+  The trade-off is the first page: a cache miss reads and sorts every name,
+  O(n log n) time and O(n) memory, and up to ``max_listings`` directories'
+  names are held at once
+- GitServer: ``git_status`` runs ``git status`` once per change of the index
+  file and answers everything else from a cache keyed on its mtime
+
+Both serve JSON-RPC over stdio (the default) or streamable HTTP:
+
+    python mcp_servers.py filesystem --root /srv/data
+    python mcp_servers.py git --root /srv/repo --port 3002
+"""
+
+import argparse
+import asyncio
+import bisect
+import functools
+import json
+import logging
+import mmap
+import os
+import stat
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_PROTOCOL_VERSIONS = ["2025-03-26", "2024-11-05"]
+
+ToolHandler = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+class ToolError(Exception):
+    """A tool call failed in a way the caller should see"""
+
+class ReferenceServer:
+    """JSON-RPC dispatch shared by the reference servers"""
+
+    name = "reference"
+
+    def __init__(self, root: str):
+        self.root = os.path.realpath(root)
+        self.tools: Dict[str, Tuple[Dict[str, Any], ToolHandler]] = {}
+
+    def tool(self, name: str, description: str, properties: Dict[str, Any], handler: ToolHandler):
+        schema = {"type": "object", "properties": properties}
+        self.tools[name] = ({"name": name, "description": description, "inputSchema": schema}, handler)
+
+    def resolve(self, path: str) -> str:
+        """Absolute path of ``path`` inside the root, refusing anything outside it"""
+        resolved = os.path.realpath(os.path.join(self.root, path or "."))
+        if resolved != self.root and not resolved.startswith(self.root + os.sep):
+            raise ToolError(f"Path escapes the server root: {path}")
+        return resolved
+
+    async def handle(self, payload: Any) -> Any:
+        """Answer one message or batch; returns None when nothing is owed"""
+        if isinstance(payload, list):
+            replies = await asyncio.gather(*[self._handle_one(message) for message in payload])
+            return [reply for reply in replies if reply is not None] or None
+        return await self._handle_one(payload)
+
+    async def _handle_one(self, message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if "id" not in message:
+            return None
+        try:
+            result = await self._call(message.get("method", ""), message.get("params") or {})
+        except KeyError as e:
+            return {"jsonrpc": "2.0", "id": message["id"], "error": {"code": -32601, "message": str(e)}}
+        return {"jsonrpc": "2.0", "id": message["id"], "result": result}
+
+    async def _call(self, method: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        if method == "initialize":
+            requested = params.get("protocolVersion")
+            version = requested if requested in SUPPORTED_PROTOCOL_VERSIONS else SUPPORTED_PROTOCOL_VERSIONS[0]
+            return {
+                "protocolVersion": version,
+                "capabilities": {"tools": {"listChanged": False}},
+                "serverInfo": {"name": self.name, "version": "1.0.0"},
+            }
+        if method == "ping":
+            return {}
+        if method == "tools/list":
+            return {"tools": [spec for spec, _ in self.tools.values()]}
+        if method == "tools/call":
+            if params.get("name") not in self.tools:
+                return {"content": [{"type": "text", "text": f"Unknown tool: {params.get('name')}"}], "isError": True}
+            _, handler = self.tools[params["name"]]
+            try:
+                return await handler(params.get("arguments") or {})
+            except (ToolError, OSError) as e:
+                return {"content": [{"type": "text", "text": str(e)}], "isError": True}
+        raise KeyError(f"Method not found: {method}")
+
+    async def serve_stdio(self):
+        """Serve newline-delimited JSON-RPC on stdin and stdout"""
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=16 * 1024 * 1024)
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        write_lock = asyncio.Lock()
+        pending = set()
+
+        async def respond(payload: Any):
+            reply = await self.handle(payload)
+            if reply is not None:
+                async with write_lock:
+                    sys.stdout.buffer.write(json.dumps(reply).encode("utf-8") + b"\n")
+                    sys.stdout.buffer.flush()
+
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                payload = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            # Requests are answered concurrently so clients can pipeline them
+            task = asyncio.create_task(respond(payload))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        await asyncio.gather(*pending)
+
+    def http_app(self) -> web.Application:
+        """Streamable HTTP endpoint at ``/mcp`` answering with JSON bodies"""
+        async def endpoint(request: web.Request) -> web.Response:
+            reply = await self.handle(await request.json())
+            if reply is None:
+                return web.Response(status=202)
+            return web.json_response(reply)
+
+        app = web.Application()
+        app.router.add_post("/mcp", endpoint)
+        return app
+
+def integer_argument(arguments: Dict[str, Any], name: str, default: int) -> int:
+    """An integer tool argument, raising ToolError for anything else"""
+    value = arguments.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ToolError(f"Argument {name} must be an integer")
+    try:
+        return int(value)
+    except ValueError:
+        raise ToolError(f"Argument {name} must be an integer") from None
+
+def string_argument(arguments: Dict[str, Any], name: str, default: str) -> str:
+    """A string tool argument, raising ToolError for anything else"""
+    value = arguments.get(name)
+    if value is None:
+        return default
+    if not isinstance(value, str):
+        raise ToolError(f"Argument {name} must be a string")
+    return value
+
+def text_result(text: str, structured: Dict[str, Any]) -> Dict[str, Any]:
+    return {"content": [{"type": "text", "text": text}], "structuredContent": structured}
+
+class FilesystemServer(ReferenceServer):
+    """Ranged file reads and paginated directory listings under a root"""
+
+    name = "filesystem"
+
+    def __init__(self, root: str, max_read: int = 1024 * 1024, page_size: int = 100, max_listings: int = 8):
+        super().__init__(root)
+        self.max_read = max_read
+        self.page_size = page_size
+        # path -> (directory mtime, sorted entry names) of recently listed directories; each holds
+        # every name of its directory, so max_listings bounds memory to that many full listings
+        self.max_listings = max_listings
+        self._listings: "OrderedDict[str, Tuple[int, List[str]]]" = OrderedDict()
+        self.tool("file_read", "Read a byte range of a file", {
+            "path": {"type": "string"},
+            "offset": {"type": "integer", "minimum": 0},
+            "length": {"type": "integer", "minimum": 0},
+        }, self.file_read)
+        self.tool("file_list", "List a directory one page at a time, in name order", {
+            "path": {"type": "string"},
+            "cursor": {"type": "string"},
+            "limit": {"type": "integer", "minimum": 1},
+        }, self.file_list)
+
+    def _read_range(self, path: str, offset: int, length: int) -> Tuple[bytes, int]:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0 or offset >= size:
+                return b"", size
+            # Only the touched pages are faulted in, however large the file
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[offset:offset + length], size
+
+    async def file_read(self, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        relative = string_argument(arguments, "path", "")
+        path = self.resolve(relative)
+        offset = max(0, integer_argument(arguments, "offset", 0))
+        length = min(self.max_read, max(0, integer_argument(arguments, "length", self.max_read)))
+        data, size = await asyncio.to_thread(self._read_range, path, offset, length)
+        end = offset + len(data)
+        return text_result(data.decode("utf-8", errors="replace"), {
+            "path": relative, "offset": offset, "length": len(data), "size": size,
+            "next_offset": end if end < size else None,
+        })
+
+    def _sorted_names(self, path: str) -> List[str]:
+        mtime = os.stat(path).st_mtime_ns
+        cached = self._listings.get(path)
+        if cached is not None and cached[0] == mtime:
+            self._listings.move_to_end(path)
+            return cached[1]
+        with os.scandir(path) as iterator:
+            names = sorted(entry.name for entry in iterator)
+        self._listings[path] = (mtime, names)
+        while len(self._listings) > self.max_listings:
+            self._listings.popitem(last=False)
+        return names
+
+    def _list_page(self, path: str, after: str, limit: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        names = self._sorted_names(path)
+        # Names after the cursor, so entries added or removed since keep their place
+        start = bisect.bisect_right(names, after) if after else 0
+        page = names[start:start + limit]
+        entries = []
+        for name in page:
+            try:
+                info = os.lstat(os.path.join(path, name))
+            except FileNotFoundError:
+                continue
+            is_dir = stat.S_ISDIR(info.st_mode)
+            entries.append({
+                "name": name + ("/" if is_dir else ""),
+                "type": "directory" if is_dir else "file",
+                "size": None if is_dir else info.st_size,
+            })
+        return entries, page[-1] if start + limit < len(names) else None
+
+    async def file_list(self, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        relative = string_argument(arguments, "path", ".")
+        path = self.resolve(relative)
+        limit = min(self.page_size, max(1, integer_argument(arguments, "limit", self.page_size)))
+        cursor = string_argument(arguments, "cursor", "")
+        entries, next_cursor = await asyncio.to_thread(self._list_page, path, cursor, limit)
+        return text_result("\n".join(entry["name"] for entry in entries), {
+            "path": relative, "files": entries, "next_cursor": next_cursor,
+        })
+
+class GitServer(ReferenceServer):
+    """``git status`` cached until the repository index changes"""
+
+    name = "git"
+
+    def __init__(self, root: str, max_age: float = 2.0):
+        super().__init__(root)
+        # Worktree edits do not touch the index, so cached status also expires
+        self.max_age = max_age
+        self._git_dir: Optional[str] = None
+        self._cache: Optional[Tuple[Tuple[int, int], float, Dict[str, Any]]] = None
+        self._refresh: Optional[asyncio.Future] = None
+        self.runs = 0
+        self.tool("git_status", "Branch and changed files of the repository", {}, self.git_status)
+
+    async def _git(self, *args: str) -> str:
+        process = await asyncio.create_subprocess_exec(
+            "git", "-C", self.root, *args,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        )
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise ToolError(stderr.decode("utf-8", errors="replace").strip() or f"git {args[0]} failed")
+        return stdout.decode("utf-8", errors="replace")
+
+    async def _index_key(self) -> Tuple[int, int]:
+        if self._git_dir is None:
+            self._git_dir = os.path.join(self.root, (await self._git("rev-parse", "--git-dir")).strip())
+        keys = []
+        for name in ("index", "HEAD"):
+            try:
+                keys.append(os.stat(os.path.join(self._git_dir, name)).st_mtime_ns)
+            except FileNotFoundError:
+                keys.append(0)
+        return keys[0], keys[1]
+
+    async def _status(self) -> Dict[str, Any]:
+        self.runs += 1
+        # Without optional locks git does not rewrite the index, which would move the cache key
+        output = await self._git("--no-optional-locks", "status", "--porcelain=v1", "--branch", "-z")
+        records = output.split("\0")
+        branch = records[0][3:] if records and records[0].startswith("## ") else ""
+        changes = []
+        iterator = iter(records[1:])
+        for record in iterator:
+            if not record:
+                continue
+            code, path = record[:2], record[3:]
+            change = {"status": code.strip() or code, "path": path}
+            if "R" in code or "C" in code:
+                change["from"] = next(iterator, "")
+            changes.append(change)
+        return {"branch": branch.split("...")[0], "status": "clean" if not changes else "dirty", "changes": changes}
+
+    def _refreshed(self, key: Tuple[int, int], started: float, refresh: asyncio.Future):
+        self._refresh = None
+        # Reading the exception also marks it retrieved when every caller has gone
+        if not refresh.cancelled() and refresh.exception() is None:
+            self._cache = (key, started, refresh.result())
+
+    async def git_status(self, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        key = await self._index_key()
+        now = time.monotonic()
+        if self._cache is not None and self._cache[0] == key and now - self._cache[1] < self.max_age:
+            status = self._cache[2]
+        else:
+            if self._refresh is None:
+                # No caller owns the git run, so one that goes away cannot cancel it for the others
+                self._refresh = asyncio.ensure_future(self._status())
+                self._refresh.add_done_callback(functools.partial(self._refreshed, key, now))
+            # Concurrent callers share the git run already in flight
+            status = await asyncio.shield(self._refresh)
+        lines = [f"On branch {status['branch']}: {status['status']}"]
+        lines += [f"{change['status']} {change['path']}" for change in status["changes"]]
+        return text_result("\n".join(lines), status)
+
+SERVERS = {"filesystem": FilesystemServer, "git": GitServer}
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a reference MCP server")
+    parser.add_argument("server", choices=sorted(SERVERS))
+    parser.add_argument("--root", default=".", help="Directory or repository to serve")
+    parser.add_argument("--port", type=int, default=None, help="Serve streamable HTTP instead of stdio")
+    parser.add_argument("--host", default="127.0.0.1")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+
+    server = SERVERS[args.server](args.root)
+    if args.port is None:
+        asyncio.run(server.serve_stdio())
+    else:
+        web.run_app(server.http_app(), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Memory Accounting
+
+This module estimates how much memory each subsystem holds and compares
+tracemalloc snapshots, so a growing container can be traced to the message
+store, the connection registry, a cache or in-flight streams.
+
+Subsystems report their own size through a ``memory_usage()`` method built on
+the helpers here. Sizes are estimates: ``deep_sizeof`` follows builtin
+containers and dataclasses only, shared objects are counted once per walk,
+and large collections are measured from an evenly spaced sample and scaled
+up, so a report stays cheap enough to take on a live process. Memory held
+outside Python objects (socket and aiohttp buffers, the allocator's free
+lists) only shows up in the process RSS and in tracemalloc diffs.
+"""
+
+import dataclasses
+import gc
+import itertools
+import logging
+import resource
+import sys
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from startup import lazy_import
+
+# Loaded when a report or snapshot first needs it
+tracemalloc = lazy_import("tracemalloc")
+
+logger = logging.getLogger(__name__)
+
+_CONTAINERS = (list, tuple, set, frozenset, deque)
+_PAGE_SIZE = resource.getpagesize()
+
+def deep_sizeof(obj: Any, seen: Optional[Set[int]] = None) -> int:
+    """Bytes held by an object and the containers and dataclasses it refers to"""
+    seen = set() if seen is None else seen
+    size = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, _CONTAINERS):
+            stack.extend(item)
+        elif dataclasses.is_dataclass(item) and not isinstance(item, type):
+            stack.extend(vars(item).values())
+    return size
+
+def shallow_sizeof(*objects: Any) -> int:
+    """Bytes of the objects themselves, not of what they refer to"""
+    return sum(sys.getsizeof(obj) for obj in objects)
+
+def sampled_sizeof(items: Iterable[Any], count: int, sample: int = 64, seen: Optional[Set[int]] = None) -> int:
+    """Deep size of ``count`` items, measured exactly or from an evenly spaced sample"""
+    if count <= 0:
+        return 0
+    seen = set() if seen is None else seen
+    if count <= sample:
+        return sum(deep_sizeof(item, seen) for item in items)
+    step = count // sample
+    measured = [deep_sizeof(item, seen) for item in itertools.islice(items, 0, step * sample, step)]
+    return int(sum(measured) / len(measured) * count)
+
+def rss_bytes() -> int:
+    """Resident set size of this process"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        # ru_maxrss is the peak, in KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+class MemoryAccountant:
+    """Collects the estimated size of each registered subsystem"""
+
+    def __init__(self):
+        self._sources: "OrderedDict[str, Callable[[], int]]" = OrderedDict()
+
+    def register(self, name: str, usage: Callable[[], int]):
+        self._sources[name] = usage
+
+    def report(self) -> Dict[str, Any]:
+        """Estimated bytes per subsystem next to the process RSS"""
+        started = time.perf_counter()
+        subsystems: Dict[str, Optional[int]] = {}
+        for name, usage in self._sources.items():
+            try:
+                subsystems[name] = int(usage())
+            except Exception as e:
+                logger.warning(f"Memory estimate for {name} failed: {e}")
+                subsystems[name] = None
+        accounted = sum(size for size in subsystems.values() if size)
+        rss = rss_bytes()
+        return {
+            "subsystems": subsystems,
+            "accounted_bytes": accounted,
+            "rss_bytes": rss,
+            "unaccounted_bytes": max(0, rss - accounted),
+            "gc": {"objects": len(gc.get_objects()), "counts": gc.get_count()},
+            "tracemalloc": tracemalloc.is_tracing(),
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 3),
+        }
+
+class SnapshotNotFoundError(KeyError):
+    """No snapshot with the requested id is kept"""
+
+class SnapshotStore:
+    """Takes tracemalloc snapshots and compares them by allocation site"""
+
+    GROUPINGS = ("lineno", "filename", "traceback")
+
+    def __init__(self, frames: int = 10, max_snapshots: int = 8):
+        self.frames = frames
+        self.max_snapshots = max_snapshots
+        self._snapshots: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._ids = itertools.count(1)
+        self._started_tracing = False
+
+    def take(self, label: Optional[str] = None) -> Dict[str, Any]:
+        """Snapshot current allocations, starting tracemalloc on first use"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracing = True
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+        snapshot_id = next(self._ids)
+        current, peak = tracemalloc.get_traced_memory()
+        entry = {
+            "id": snapshot_id,
+            "label": label,
+            "taken_at": time.time(),
+            "traced_bytes": current,
+            "peak_traced_bytes": peak,
+            "snapshot": snapshot,
+        }
+        self._snapshots[snapshot_id] = entry
+        while len(self._snapshots) > self.max_snapshots:
+            self._snapshots.popitem(last=False)
+        return self.describe(entry)
+
+    @staticmethod
+    def describe(entry: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: value for key, value in entry.items() if key != "snapshot"}
+
+    def list(self) -> List[Dict[str, Any]]:
+        return [self.describe(entry) for entry in self._snapshots.values()]
+
+    def get(self, snapshot_id: int) -> "tracemalloc.Snapshot":
+        entry = self._snapshots.get(snapshot_id)
+        if entry is None:
+            raise SnapshotNotFoundError(snapshot_id)
+        return entry["snapshot"]
+
+    def diff(self, first: int, second: int, group_by: str = "lineno", limit: int = 20) -> List[Dict[str, Any]]:
+        """Allocation sites that grew or shrank most from ``first`` to ``second``"""
+        if group_by not in self.GROUPINGS:
+            raise ValueError(f"group_by must be one of {', '.join(self.GROUPINGS)}")
+        stats = self.get(second).compare_to(self.get(first), group_by)
+        return [{
+            "site": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+            "size_diff": stat.size_diff,
+            "count_diff": stat.count_diff,
+            "size": stat.size,
+            "count": stat.count,
+        } for stat in stats[:limit]]
+
+    def clear(self):
+        """Drop every snapshot and stop tracing if it was started here"""
+        self._snapshots.clear()
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def stats(self) -> Dict[str, Any]:
+        """Get snapshot statistics"""
+        return {
+            "tracing": tracemalloc.is_tracing(),
+            "frames": tracemalloc.get_traceback_limit() if tracemalloc.is_tracing() else self.frames,
+            "snapshots": len(self._snapshots),
+        }
@@ -0,0 +1,87 @@
+"""
+Chat Message Store
+
+This module keeps chat messages in memory, indexed by session so history
+reads do not scan every stored message. Messages are de-duplicated by id,
+which lets events replayed from other workers be applied idempotently.
+
+Each message is encoded to JSON once when it is stored, so a history
+response is a concatenation of cached bytes rather than a fresh encode of
+every message.
+"""
+
+import bisect
+from typing import Dict, Iterable, List, Set
+
+from memory import sampled_sizeof, shallow_sizeof
+from serialization import dumps, join_array
+
+class MessageStore:
+    """In-memory chat history indexed by session id"""
+
+    def __init__(self):
+        self.messages: List[Dict] = []
+        self._sessions: Dict[str, List[Dict]] = {}
+        self._session_ids: Dict[str, List[int]] = {}
+        self._encoded: Dict[int, bytes] = {}
+        self._ids: Set[int] = set()
+        self._loaded: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def add(self, message: Dict) -> bool:
+        """Store a message, returning False if its id is already known"""
+        if message["id"] in self._ids:
+            return False
+        self._ids.add(message["id"])
+        self._encoded[message["id"]] = dumps(message)
+        self.messages.append(message)
+        session_id = message["session_id"]
+        history = self._sessions.setdefault(session_id, [])
+        ids = self._session_ids.setdefault(session_id, [])
+        # Messages from other workers can arrive slightly out of id order
+        position = bisect.bisect(ids, message["id"])
+        ids.insert(position, message["id"])
+        history.insert(position, message)
+        return True
+
+    def merge(self, session_id: str, messages: Iterable[Dict]):
+        """Merge durable history for a session and mark it loaded"""
+        for message in messages:
+            self.add(message)
+        self._loaded.add(session_id)
+
+    def is_loaded(self, session_id: str) -> bool:
+        return session_id in self._loaded
+
+    def history(self, session_id: str) -> List[Dict]:
+        """Messages of a session in id order"""
+        return list(self._sessions.get(session_id, ()))
+
+    def encoded(self, message_id: int) -> bytes:
+        """Cached JSON encoding of a stored message"""
+        return self._encoded[message_id]
+
+    def history_json(self, session_id: str) -> bytes:
+        """Messages of a session in id order as a JSON array"""
+        return join_array(self._encoded[message_id] for message_id in self._session_ids.get(session_id, ()))
+
+    def memory_usage(self) -> int:
+        """Estimated bytes held by messages, their encodings and the session indexes"""
+        seen: Set[int] = set()
+        size = sampled_sizeof(self.messages, len(self.messages), seen=seen)
+        size += sampled_sizeof(self._encoded.values(), len(self._encoded), seen=seen)
+        # The indexes share the message dicts, so only their own containers count
+        size += shallow_sizeof(self.messages, self._sessions, self._session_ids, self._encoded, self._ids, self._loaded)
+        size += sum(shallow_sizeof(history) for history in self._sessions.values())
+        size += sum(shallow_sizeof(ids) for ids in self._session_ids.values())
+        return size
+
+    def clear(self):
+        self.messages.clear()
+        self._sessions.clear()
+        self._session_ids.clear()
+        self._ids.clear()
+        self._encoded.clear()
+        self._loaded.clear()
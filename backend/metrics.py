@@ -0,0 +1,294 @@
+"""
+Prometheus Metrics
+
+This module keeps request, tool and upstream metrics in memory and renders
+them in the Prometheus text exposition format (version 0.0.4) for
+``GET /metrics``. It is cheap enough to leave on in production:
+
+- Counters and histograms are plain integers updated on the event loop, so
+  recording a value takes no lock; a histogram observation is one bisect into
+  fixed buckets and two additions
+- Bucket counts are kept per bucket and only made cumulative when scraped
+- Gauges are read from callbacks at scrape time instead of being maintained
+- Upstream HTTP timings come from aiohttp trace hooks, one per upstream
+"""
+
+import functools
+import inspect
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import aiohttp
+
+# Request latencies, from a cache hit to a slow completion
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Starlette appends the charset to text/ media types
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+LabelValues = Tuple[str, ...]
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """A named metric family with fixed label names"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+class Counter(Metric):
+    """Monotonically increasing count per label set"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, *labels: str) -> float:
+        return self.values.get(labels, 0)
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+            for labels, value in sorted(self.values.items())
+        ]
+
+class Gauge(Metric):
+    """Value read from a callback whenever metrics are scraped"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, read: Callable[[], float]):
+        super().__init__(name, help)
+        self.read = read
+
+    def samples(self) -> List[str]:
+        return [f"{self.name} {_number(self.read())}"]
+
+class CallbackCounter(Metric):
+    """Running totals a subsystem already keeps, read whenever metrics are scraped
+
+    ``read`` returns the total or, with label names, a mapping of label values
+    (a string for a single label) to totals.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, read: Callable[[], Any], labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self.read = read
+
+    def samples(self) -> List[str]:
+        if not self.labelnames:
+            return [f"{self.name} {_number(self.read())}"]
+        return [
+            f"{self.name}{_labels(self.labelnames, labels if isinstance(labels, tuple) else (labels,))} {_number(total)}"
+            for labels, total in sorted(self.read().items())
+        ]
+
+class Histogram(Metric):
+    """Observations counted into fixed buckets per label set"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (last is +Inf)], sum
+        self.series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        # Bucket bounds are inclusive, so the first bound >= value counts it
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1][0] += value
+
+    def count(self, *labels: str) -> int:
+        series = self.series.get(labels)
+        return sum(series[0]) if series else 0
+
+    def time(self, *labels: str):
+        """Decorator observing how long each call of a function or coroutine function takes"""
+        def decorate(func):
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def timed_async(*args, **kwargs):
+                    started = time.perf_counter()
+                    try:
+                        return await func(*args, **kwargs)
+                    finally:
+                        self.observe(time.perf_counter() - started, *labels)
+                return timed_async
+
+            @functools.wraps(func)
+            def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - started, *labels)
+            return timed
+        return decorate
+
+    def samples(self) -> List[str]:
+        lines = []
+        bounds = [_number(bound) for bound in self.buckets] + ["+Inf"]
+        for labels, (counts, total) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                le = 'le="' + bound + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total[0])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+class TokenStreamTimer:
+    """Time to first token and token rate of one streamed completion"""
+
+    def __init__(self, first_token: Histogram, tokens_per_second: Histogram):
+        self.first_token = first_token
+        self.tokens_per_second = tokens_per_second
+        self.started = time.perf_counter()
+        self.first: Optional[float] = None
+        self.tokens = 0
+
+    def token(self):
+        if self.first is None:
+            self.first = time.perf_counter()
+            self.first_token.observe(self.first - self.started)
+        self.tokens += 1
+
+    def finish(self):
+        # The rate is measured between tokens, so the wait for the first one is excluded
+        if self.first is not None and self.tokens > 1:
+            elapsed = time.perf_counter() - self.first
+            if elapsed > 0:
+                self.tokens_per_second.observe((self.tokens - 1) / elapsed)
+
+class MetricsRegistry:
+    """Metric families rendered together for a scrape"""
+
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+        self.metrics: Dict[str, Metric] = {}
+        self._trace_configs: Dict[str, aiohttp.TraceConfig] = {}
+
+    def _register(self, metric: Metric) -> Any:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(self.prefix + name, help, labelnames))
+
+    def gauge(self, name: str, help: str, read: Callable[[], float]) -> Gauge:
+        return self._register(Gauge(self.prefix + name, help, read))
+
+    def counter_from(
+        self, name: str, help: str, read: Callable[[], Any], labelnames: Sequence[str] = ()
+    ) -> CallbackCounter:
+        return self._register(CallbackCounter(self.prefix + name, help, read, labelnames))
+
+    def histogram(
+        self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(self.prefix + name, help, labelnames, buckets))
+
+    def upstream_trace(self, upstream: str, latency: Histogram, responses: Counter) -> aiohttp.TraceConfig:
+        """aiohttp trace hooks timing requests to an upstream until its response headers arrive"""
+        trace = self._trace_configs.get(upstream)
+        if trace is not None:
+            return trace
+
+        async def on_start(session, context, params):
+            context.started = time.perf_counter()
+
+        async def on_end(session, context, params):
+            latency.observe(time.perf_counter() - context.started, upstream)
+            responses.inc(upstream, str(params.response.status))
+
+        async def on_exception(session, context, params):
+            latency.observe(time.perf_counter() - context.started, upstream)
+            responses.inc(upstream, "error")
+
+        trace = aiohttp.TraceConfig()
+        trace.on_request_start.append(on_start)
+        trace.on_request_end.append(on_end)
+        trace.on_request_exception.append(on_exception)
+        trace.freeze()
+        self._trace_configs[upstream] = trace
+        return trace
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+class MetricsMiddleware:
+    """ASGI middleware counting and timing HTTP requests per route template"""
+
+    def __init__(self, app, requests: Counter, latency: Histogram, skip: Sequence[str] = ("/metrics",)):
+        self.app = app
+        self.requests = requests
+        self.latency = latency
+        self.skip = set(skip)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip:
+            await self.app(scope, receive, send)
+            return
+
+        status = "500"
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router records the matched route; templates keep path parameters out of the labels
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            self.latency.observe(time.perf_counter() - started, scope["method"], path)
+            self.requests.inc(scope["method"], path, status)
@@ -0,0 +1,70 @@
+"""
+Sampling Profiler
+
+This module profiles the live process without instrumenting it: a background
+thread wakes up at a fixed interval, reads every other thread's current
+frame through ``sys._current_frames`` and counts each distinct stack. The
+event loop keeps serving traffic while it runs, and the cost is one stack
+walk per thread per sample.
+
+The result is in the collapsed-stack format read by flamegraph.pl, speedscope
+and similar tools: one ``root;caller;callee count`` line per distinct stack.
+"""
+
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+class ProfilerBusyError(Exception):
+    """Another profile is already being taken"""
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+class SamplingProfiler:
+    """Counts the stacks of all threads, sampled at a fixed interval"""
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 128):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+        self.profiles = 0
+
+    def _stack(self, frame) -> Tuple[str, ...]:
+        labels = []
+        while frame is not None and len(labels) < self.max_depth:
+            labels.append(_frame_label(frame.f_code))
+            frame = frame.f_back
+        labels.reverse()
+        return tuple(labels)
+
+    def sample(self, seconds: float, thread_id: Optional[int] = None) -> Tuple[Counter, int]:
+        """Sample stacks for ``seconds``; only ``thread_id`` when given"""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusyError("A profile is already running")
+        try:
+            self.profiles += 1
+            stacks: Counter = Counter()
+            samples = 0
+            own = threading.get_ident()
+            names: Dict[int, str] = {t.ident: t.name for t in threading.enumerate()}
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident == own or (thread_id is not None and ident != thread_id):
+                        continue
+                    thread = names.get(ident) or f"thread-{ident}"
+                    stacks[(thread,) + self._stack(frame)] += 1
+                samples += 1
+                time.sleep(self.interval)
+            return stacks, samples
+        finally:
+            self._lock.release()
+
+    def collapsed(self, seconds: float, thread_id: Optional[int] = None) -> str:
+        """Profile for ``seconds`` and render the stacks in collapsed format"""
+        stacks, _ = self.sample(seconds, thread_id)
+        lines = [f"{';'.join(stack)} {count}" for stack, count in stacks.most_common()]
+        return "\n".join(lines) + "\n" if lines else ""
@@ -0,0 +1,171 @@
+"""
+Rate Limiting and Load Shedding
+
+nginx limits requests per IP address, but knows nothing about sessions, what
+a request costs upstream or how busy the process is. This module admits or
+refuses each unit of work in the app itself, so excess work fails at once
+with 429 and Retry-After instead of timing out in a queue:
+
+- RateLimiter keeps token buckets per session and per client (a known API
+  key when one is presented, the address otherwise; an unknown key must not
+  get a bucket of its own, or a caller could dodge the limit by sending a new
+  one with every request). Buckets refill at a steady
+  rate up to a burst size, and each kind of work costs what it costs the
+  server: an LLM turn more than code execution, code execution more than a
+  cheap tool. Work is admitted only if every bucket it draws on holds enough
+  tokens, and only then are they taken.
+- LoadShedder refuses new work while the smoothed event loop lag or the
+  number of generations in flight upstream is over its threshold.
+
+Buckets live in the memory of one worker. With several workers a client may
+get up to the configured rate from each, so size the rates accordingly.
+"""
+
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from memory import deep_sizeof, shallow_sizeof
+
+class RateLimitedError(Exception):
+    """Work refused until ``retry_after`` seconds have passed"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Too many requests ({reason}); retry in {retry_after:.1f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        """Whole seconds for the Retry-After header, never zero"""
+        return str(max(1, math.ceil(self.retry_after)))
+
+@dataclass(frozen=True)
+class Limit:
+    """Tokens a bucket gains per second and the most it holds"""
+    rate: float
+    burst: float
+
+class RateLimiter:
+    """Token buckets per scope (session, client) charged by the kind of work"""
+
+    def __init__(
+        self,
+        limits: Dict[str, Limit],
+        costs: Dict[str, float],
+        max_buckets: int = 100_000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        # A rate of zero switches the scope off
+        self.limits = {scope: limit for scope, limit in limits.items() if limit.rate > 0}
+        self.costs = costs
+        self.max_buckets = max_buckets
+        self.clock = clock
+        # (scope, identity) -> [tokens, last refill], least recently used first
+        self._buckets: "OrderedDict[Tuple[str, str], List[float]]" = OrderedDict()
+        self.admitted: Dict[str, int] = {kind: 0 for kind in costs}
+        self.limited: Dict[str, int] = {scope: 0 for scope in self.limits}
+
+    def _bucket(self, scope: str, identity: str, limit: Limit, now: float) -> List[float]:
+        key = (scope, identity)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [limit.burst, now]
+            # Evicting a drained bucket forgives it, which only matters past max_buckets active clients
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(limit.burst, bucket[0] + (now - bucket[1]) * limit.rate)
+            bucket[1] = now
+        return bucket
+
+    def acquire(self, kind: str, identities: Dict[str, Optional[str]]):
+        """Take the cost of ``kind`` from the bucket of each identity, or raise RateLimitedError"""
+        cost = self.costs[kind]
+        now = self.clock()
+        charged: List[List[float]] = []
+        wait, reason = 0.0, None
+        for scope, identity in identities.items():
+            limit = self.limits.get(scope)
+            if limit is None or not identity:
+                continue
+            bucket = self._bucket(scope, identity, limit, now)
+            # Work costing more than a full bucket is admitted from a full bucket
+            needed = min(cost, limit.burst)
+            if bucket[0] < needed:
+                shortfall = (needed - bucket[0]) / limit.rate
+                if shortfall > wait:
+                    wait, reason = shortfall, scope
+            charged.append(bucket)
+        if reason is not None:
+            self.limited[reason] += 1
+            raise RateLimitedError(reason, wait)
+        for bucket in charged:
+            bucket[0] -= cost
+        self.admitted[kind] += 1
+
+    def reset(self):
+        """Refill every bucket by forgetting them"""
+        self._buckets.clear()
+
+    def memory_usage(self) -> int:
+        """Estimated bytes held by the buckets"""
+        size = shallow_sizeof(self._buckets)
+        if self._buckets:
+            # Keys and buckets all have the same shape, so one of each stands for the rest
+            key, bucket = next(iter(self._buckets.items()))
+            size += len(self._buckets) * (deep_sizeof(key) + deep_sizeof(bucket))
+        return size
+
+    def stats(self) -> Dict[str, Any]:
+        """Get rate limiter statistics"""
+        return {
+            "limits": {scope: {"rate": limit.rate, "burst": limit.burst} for scope, limit in self.limits.items()},
+            "costs": dict(self.costs),
+            "buckets": len(self._buckets),
+            "admitted": dict(self.admitted),
+            "limited": dict(self.limited),
+        }
+
+class LoadShedder:
+    """Refuses new work while the event loop lags or too many generations are in flight"""
+
+    def __init__(
+        self,
+        loop_lag: Callable[[], float],
+        in_flight: Callable[[], int],
+        max_loop_lag: float = 0.0,
+        max_in_flight: int = 0,
+        retry_after: float = 1.0,
+    ):
+        self.loop_lag = loop_lag
+        self.in_flight = in_flight
+        # Zero switches a check off
+        self.max_loop_lag = max_loop_lag
+        self.max_in_flight = max_in_flight
+        self.retry_after = retry_after
+        self.shed: Dict[str, int] = {"loop_lag": 0, "in_flight": 0}
+
+    def check(self):
+        """Raise RateLimitedError if the process is too busy to start more work"""
+        if self.max_loop_lag and self.loop_lag() > self.max_loop_lag:
+            reason = "loop_lag"
+        elif self.max_in_flight and self.in_flight() >= self.max_in_flight:
+            reason = "in_flight"
+        else:
+            return
+        self.shed[reason] += 1
+        raise RateLimitedError(reason, self.retry_after)
+
+    def stats(self) -> Dict[str, Any]:
+        """Get load shedding statistics"""
+        return {
+            "max_loop_lag": self.max_loop_lag,
+            "max_in_flight": self.max_in_flight,
+            "loop_lag": self.loop_lag(),
+            "in_flight": self.in_flight(),
+            "shed": dict(self.shed),
+        }
@@ -0,0 +1,245 @@
+"""
+Search Cache Module
+
+This module provides a bounded, TTL-based cache for web search results.
+Queries are normalized before lookup so trivially different spellings of the
+same question share an entry, "no answer" results are negatively cached for a
+shorter TTL, and an optional SQLite tier lets the cache survive restarts.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from memory import sampled_sizeof, shallow_sizeof
+from startup import lazy_import
+
+# Only the optional persistent tier needs it
+sqlite3 = lazy_import("sqlite3")
+
+logger = logging.getLogger(__name__)
+
+# Characters stripped from both ends of a query before it is used as a key
+_EDGE_PUNCTUATION = " \t\r\n?!.,;:'\"`"
+
+def normalize_query(query: str) -> str:
+    """Normalize a search query into a cache key"""
+    text = unicodedata.normalize("NFKC", query).casefold()
+    text = " ".join(text.split())
+    return text.strip(_EDGE_PUNCTUATION)
+
+@dataclass
+class CacheEntry:
+    """A cached search result"""
+    value: Any
+    expires_at: float
+    negative: bool
+    fetch_latency: float
+
+class SearchCache:
+    """Bounded LRU cache with TTLs, negative caching and an optional disk tier"""
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float = 300.0,
+        negative_ttl: float = 60.0,
+        persist_path: Optional[str] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.persist_path = persist_path
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._db: Optional["sqlite3.Connection"] = None
+        self._db_lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+        self.latency_saved = 0.0
+        if persist_path:
+            self._open_db(persist_path)
+
+    def _open_db(self, path: str):
+        """Open (and create if needed) the persistent tier"""
+        try:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS search_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, negative INTEGER NOT NULL, "
+                "expires_at REAL NOT NULL, fetch_latency REAL NOT NULL)"
+            )
+            self._db.execute("DELETE FROM search_cache WHERE expires_at <= ?", (time.time(),))
+            self._db.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Search cache persistence disabled, could not open {path}: {e}")
+            self._db = None
+
+    def reopen(self):
+        """Reconnect the persistent tier, e.g. in a forked worker; SQLite connections must not cross a fork"""
+        if self.persist_path:
+            self._db = None
+            self._open_db(self.persist_path)
+
+    def _disk_get(self, key: str) -> Optional[CacheEntry]:
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT value, negative, expires_at, fetch_latency FROM search_cache WHERE key = ?",
+                (key,),
+            ).fetchone()
+        if row is None:
+            return None
+        # The disk tier stores wall-clock expiry so it stays valid across restarts
+        remaining = row[2] - time.time()
+        if remaining <= 0:
+            return None
+        return CacheEntry(json.loads(row[0]), time.monotonic() + remaining, bool(row[1]), row[3])
+
+    def _disk_set(self, key: str, entry: CacheEntry):
+        expires_at = time.time() + (entry.expires_at - time.monotonic())
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO search_cache VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(entry.value), int(entry.negative), expires_at, entry.fetch_latency),
+            )
+            self._db.commit()
+
+    def _memory_get(self, key: str) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _memory_set(self, key: str, entry: CacheEntry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def lookup(self, key: str) -> Optional[CacheEntry]:
+        """Look a key up in memory, then in the persistent tier"""
+        entry = self._memory_get(key)
+        if entry is None and self._db is not None:
+            try:
+                entry = await asyncio.to_thread(self._disk_get, key)
+            except sqlite3.Error as e:
+                logger.error(f"Search cache disk read failed: {e}")
+                entry = None
+            if entry is not None:
+                self.disk_hits += 1
+                self._memory_set(key, entry)
+        return entry
+
+    async def store(self, key: str, value: Any, negative: bool = False, fetch_latency: float = 0.0):
+        """Store a value, using the negative TTL for "no answer" results"""
+        ttl = self.negative_ttl if negative else self.ttl
+        entry = CacheEntry(value, time.monotonic() + ttl, negative, fetch_latency)
+        self._memory_set(key, entry)
+        if self._db is not None:
+            try:
+                await asyncio.to_thread(self._disk_set, key, entry)
+            except sqlite3.Error as e:
+                logger.error(f"Search cache disk write failed: {e}")
+
+    async def get_or_fetch(
+        self,
+        query: str,
+        fetch: Callable[[str], Awaitable[Tuple[Any, Optional[bool]]]],
+    ) -> Any:
+        """Return the cached value for a query, fetching it on a miss.
+
+        ``fetch`` receives the normalized query and returns ``(value, negative)``;
+        a ``negative`` of ``None`` marks a transient failure that is not cached.
+        Concurrent misses for the same key share a single upstream fetch; if the
+        caller doing that fetch is cancelled, the others retry rather than being
+        cancelled with it.
+        """
+        key = normalize_query(query)
+        while True:
+            entry = await self.lookup(key)
+            if entry is not None:
+                self.hits += 1
+                if entry.negative:
+                    self.negative_hits += 1
+                self.latency_saved += entry.fetch_latency
+                return entry.value
+
+            pending = self._inflight.get(key)
+            if pending is None:
+                break
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                # Only the fetching caller was cancelled, not this one: take over the fetch
+                if not pending.cancelled() or asyncio.current_task().cancelling():
+                    raise
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            started = time.perf_counter()
+            value, negative = await fetch(key)
+            latency = time.perf_counter() - started
+            if negative is not None:
+                await self.store(key, value, negative, latency)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception retrieved when nobody else was waiting on it
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def clear(self):
+        """Drop every cached entry, including the persistent tier"""
+        self._entries.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM search_cache")
+                self._db.commit()
+
+    def memory_usage(self) -> int:
+        """Estimated bytes held by the in-memory tier"""
+        seen: Set[int] = set()
+        size = shallow_sizeof(self._entries, self._inflight)
+        size += sampled_sizeof(self._entries.keys(), len(self._entries), seen=seen)
+        return size + sampled_sizeof(self._entries.values(), len(self._entries), seen=seen)
+
+    def stats(self) -> Dict[str, Any]:
+        """Get cache statistics"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "upstream_latency_saved_seconds": round(self.latency_saved, 4),
+            "persistent": self._db is not None,
+        }
@@ -0,0 +1,60 @@
+"""
+JSON Serialization
+
+This module is the single place responses and frames are encoded. It uses
+orjson when it is installed and falls back to the standard library encoder
+otherwise, so the output is plain JSON either way. Lists of values that were
+encoded before (such as stored chat messages) can be joined into a JSON array
+without decoding and re-encoding each item. Server-sent events are framed
+here too, one ``data:`` line per line of the payload.
+"""
+
+import json
+import re
+from typing import Any, Iterable, Optional
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ENCODER = "orjson" if orjson is not None else "json"
+
+def dumps(obj: Any) -> bytes:
+    """Encode a value as compact UTF-8 JSON"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def loads(data: Any) -> Any:
+    """Decode JSON from ``str`` or ``bytes``; errors are ``json.JSONDecodeError``"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def join_array(encoded: Iterable[bytes]) -> bytes:
+    """JSON array of already encoded items"""
+    return b"[" + b",".join(encoded) + b"]"
+
+# Line breaks that end an SSE field: CRLF, CR or LF
+SSE_LINE_BREAK = re.compile(r"\r\n|\r|\n")
+
+def sse_event(data: str, event_id: Optional[str] = None) -> bytes:
+    """A server-sent event; readers join its ``data:`` lines back into ``data`` with newlines"""
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines.extend(f"data: {line}" for line in SSE_LINE_BREAK.split(data))
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with the fastest available encoder"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+class RawJSONResponse(JSONResponse):
+    """JSON response whose body was encoded ahead of time"""
+
+    def render(self, content: bytes) -> bytes:
+        return content
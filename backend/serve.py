@@ -0,0 +1,322 @@
+"""
+Production Server
+
+Runs the backend for production instead of ``uvicorn main:app --reload``:
+
+- No file watcher, and WEB_CONCURRENCY worker processes forked from a
+  parent that has already imported the app, so workers start quickly and
+  share its imported code pages. Without BACKPLANE_URL the default is one
+  worker; with it, the CPUs this container may use
+- uvloop and httptools when they are installed, asyncio and h11 otherwise
+- A configurable listen backlog, and a keep-alive timeout longer than the
+  idle timeout of the proxy or load balancer in front, so the proxy never
+  reuses a connection the worker is closing
+
+Client addresses feed the per-IP WebSocket cap and the per-client rate
+limit, so behind a proxy they must come from X-Forwarded-For.
+FORWARDED_ALLOW_IPS lists the proxies (addresses or networks, comma
+separated) whose X-Forwarded-For is believed; the client is the rightmost
+entry none of them vouches for. ``*`` trusts any peer but only the last hop,
+for platforms such as Railway whose edge proxy has no fixed address and is
+the only way in. Left at 127.0.0.1 behind another proxy, every client shares
+the proxy's address and so a single set of limits.
+
+On SIGTERM (or Ctrl-C) every worker drains before shutting down: it stops
+accepting connections, fails /health, refuses new AI turns and gives running
+SSE and WebSocket generations up to DRAIN_TIMEOUT seconds to finish. Only
+then does uvicorn close the remaining connections, wait up to
+GRACEFUL_TIMEOUT seconds for requests still in flight and run the shutdown
+hooks. A second signal skips what is left of the drain. Set the container's
+stop timeout above the sum of both.
+
+Optional dependencies are imported lazily (see startup.py). A single worker
+keeps them deferred for the fastest cold start; a preloading parent imports
+them before forking so workers share them instead of each importing its own.
+
+Each worker keeps its own in-memory state, including the message id
+counter, so more than one worker needs BACKPLANE_URL to share sessions and
+ids between them; without it serve.py starts a single worker unless told
+otherwise, and warns when it is.
+
+Usage (from backend/):
+    python serve.py
+    python serve.py --workers 4 --port 8000 --drain-timeout 30
+"""
+
+import argparse
+import asyncio
+import importlib
+import importlib.util
+import ipaddress
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import uvicorn
+from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
+
+from startup import load_lazy, pending_lazy
+
+logger = logging.getLogger("serve")
+
+# A worker that exits this soon after starting is failing to boot, not crashing
+MIN_WORKER_UPTIME = 5.0
+
+def cpu_count() -> int:
+    """CPUs this process may use, honouring affinity and a cgroup v2 CPU quota"""
+    try:
+        count = len(os.sched_getaffinity(0))
+    except AttributeError:
+        count = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            count = min(count, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return count
+
+def default_workers() -> int:
+    """One worker per CPU when a shared backplane is configured, otherwise one"""
+    # Separate in-process backplanes would split history and hand out the same message ids
+    return cpu_count() if os.environ.get("BACKPLANE_URL") else 1
+
+def load_app(target: str) -> Tuple[Any, Any]:
+    """Import ``module:attribute`` and return the module and the app"""
+    module_name, _, attribute = target.partition(":")
+    module = importlib.import_module(module_name)
+    return module, getattr(module, attribute or "app")
+
+def bind(host: str, port: int, backlog: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+class TrustedProxies:
+    """Proxy addresses and networks from a comma-separated list; ``*`` matches any peer"""
+
+    def __init__(self, spec: str):
+        self.any = False
+        self.hosts = set()
+        self.networks = []
+        for item in (part.strip() for part in spec.split(",")):
+            if item == "*":
+                self.any = True
+            elif item:
+                try:
+                    self.networks.append(ipaddress.ip_network(item, strict=False))
+                except ValueError:
+                    # Not an address, e.g. a unix socket peer or a test client name
+                    self.hosts.add(item)
+
+    def __contains__(self, host: Optional[str]) -> bool:
+        if self.any or host in self.hosts:
+            return True
+        try:
+            address = ipaddress.ip_address(host)
+        except (TypeError, ValueError):
+            return False
+        return any(address in network for network in self.networks)
+
+class ForwardedClientMiddleware(ProxyHeadersMiddleware):
+    """uvicorn's proxy headers middleware trusting networks, and with ``*`` only the last hop"""
+
+    def __init__(self, app, trusted_hosts: str = "127.0.0.1"):
+        super().__init__(app, trusted_hosts)
+        self.trusted_hosts = TrustedProxies(trusted_hosts)
+        # Membership in TrustedProxies covers ``*``
+        self.always_trust = False
+
+    def get_trusted_client_host(self, x_forwarded_for_hosts: List[str]) -> Optional[str]:
+        # Entries left of the first untrusted one may have been written by the client itself
+        if self.trusted_hosts.any:
+            return x_forwarded_for_hosts[-1]
+        for host in reversed(x_forwarded_for_hosts):
+            if host not in self.trusted_hosts:
+                return host
+        return x_forwarded_for_hosts[0]
+
+class DrainingServer(uvicorn.Server):
+    """uvicorn server that drains running generations before its normal shutdown"""
+
+    def __init__(
+        self,
+        config: uvicorn.Config,
+        drain: Optional[Callable[[float], Awaitable[int]]],
+        drain_timeout: float,
+    ):
+        super().__init__(config)
+        self.drain = drain
+        self.drain_timeout = drain_timeout
+        self.draining: Optional[asyncio.Task] = None
+
+    def handle_exit(self, sig: int, frame) -> None:
+        if self.drain is None or self.draining is not None or self.should_exit:
+            # A second signal skips the rest of the drain
+            super().handle_exit(sig, frame)
+            return
+        # uvicorn installs this through loop.add_signal_handler, so it runs on the loop
+        self.draining = asyncio.get_running_loop().create_task(self._drain())
+
+    async def _drain(self):
+        # Set once startup has bound the sockets
+        for server in getattr(self, "servers", []):
+            server.close()
+        try:
+            await self.drain(self.drain_timeout)
+        except Exception as e:
+            logger.error(f"Drain failed: {e}")
+        self.should_exit = True
+
+def run_worker(args, sock: Optional[socket.socket] = None, forked: bool = False):
+    """Serve the app in this process until it is told to stop"""
+    module, app = load_app(args.app)
+    if forked and hasattr(module, "after_fork"):
+        module.after_fork()
+    config = uvicorn.Config(
+        ForwardedClientMiddleware(app, args.forwarded_allow_ips),
+        host=args.host,
+        port=args.port,
+        loop="uvloop" if importlib.util.find_spec("uvloop") else "asyncio",
+        http="httptools" if importlib.util.find_spec("httptools") else "h11",
+        backlog=args.backlog,
+        timeout_keep_alive=args.keep_alive,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        ws_per_message_deflate=True,
+        # ForwardedClientMiddleware replaces uvicorn's own, which cannot trust networks
+        proxy_headers=False,
+        log_level=args.log_level,
+        access_log=args.access_log,
+        lifespan="on",
+    )
+    server = DrainingServer(config, getattr(module, "drain", None), args.drain_timeout)
+    server.run(sockets=[sock] if sock is not None else None)
+
+class Supervisor:
+    """Forks the workers, restarts crashed ones and relays shutdown signals"""
+
+    def __init__(self, args, sock: socket.socket):
+        self.args = args
+        self.sock = sock
+        self.workers: Dict[int, float] = {}
+        self.stopping = False
+        self.failed = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            # Own process group, so a terminal's Ctrl-C reaches workers only through the parent
+            os.setpgid(0, 0)
+            for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGALRM):
+                signal.signal(sig, signal.SIG_DFL)
+            code = 0
+            try:
+                run_worker(self.args, self.sock, forked=True)
+            except BaseException:
+                logger.exception("Worker failed")
+                code = 1
+            finally:
+                os._exit(code)
+        self.workers[pid] = time.monotonic()
+
+    def signal_workers(self, sig: int):
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def stop(self, sig: int, frame):
+        """Forward a shutdown signal; workers treat a repeated one as "skip the drain" """
+        if not self.stopping:
+            self.stopping = True
+            logger.info(f"Stopping {len(self.workers)} workers")
+            # The kernel keeps queueing connections while any process holds the socket
+            self.sock.close()
+            signal.alarm(int(self.args.drain_timeout + self.args.graceful_timeout + 5))
+        self.signal_workers(signal.SIGTERM)
+
+    def kill(self, sig: int, frame):
+        logger.error(f"Killing {len(self.workers)} workers that did not stop in time")
+        self.signal_workers(signal.SIGKILL)
+
+    def run(self) -> int:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGALRM, self.kill)
+        for _ in range(self.args.workers):
+            self.spawn()
+        while self.workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            started = self.workers.pop(pid, None)
+            if started is None or self.stopping:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            if time.monotonic() - started < MIN_WORKER_UPTIME:
+                logger.error(f"Worker {pid} exited with {code} while starting; stopping")
+                self.failed = True
+                self.stop(signal.SIGTERM, None)
+            else:
+                logger.warning(f"Worker {pid} exited with {code}; starting a new one")
+                self.spawn()
+        return 1 if self.failed else 0
+
+def parse_args(argv=None):
+    env = os.environ.get
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", default="main:app", help="ASGI app as module:attribute")
+    parser.add_argument("--host", default=env("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(env("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(env("WEB_CONCURRENCY", "0")) or default_workers(),
+                        help="Worker processes (WEB_CONCURRENCY; default: available CPUs with BACKPLANE_URL, else 1)")
+    parser.add_argument("--no-preload", dest="preload", action="store_false",
+                        help="Import the app in each worker instead of once before forking")
+    parser.add_argument("--backlog", type=int, default=int(env("BACKLOG", "2048")),
+                        help="Listen backlog (capped by net.core.somaxconn)")
+    parser.add_argument("--keep-alive", type=int, default=int(env("KEEPALIVE_TIMEOUT", "75")),
+                        help="Seconds an idle keep-alive connection stays open")
+    parser.add_argument("--drain-timeout", type=float, default=float(env("DRAIN_TIMEOUT", "30")),
+                        help="Seconds running generations get to finish on shutdown")
+    parser.add_argument("--graceful-timeout", type=int, default=int(env("GRACEFUL_TIMEOUT", "5")),
+                        help="Seconds in-flight requests get after the drain")
+    parser.add_argument("--forwarded-allow-ips", default=env("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+                        help="Proxies whose X-Forwarded-For is trusted: addresses, networks or * for the last hop")
+    parser.add_argument("--log-level", default=env("LOG_LEVEL", "info"))
+    parser.add_argument("--no-access-log", dest="access_log", action="store_false")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format="%(levelname)s:     %(name)s: %(message)s")
+    if args.workers <= 1:
+        run_worker(args)
+        return 0
+    if not os.environ.get("BACKPLANE_URL"):
+        logger.warning(
+            f"{args.workers} workers without BACKPLANE_URL: each keeps its own history and message ids"
+        )
+    sock = bind(args.host, args.port, args.backlog)
+    if args.preload:
+        load_app(args.app)
+        load_lazy(pending_lazy())
+    logger.info(
+        f"Serving {args.app} on {args.host}:{args.port} with {args.workers} workers "
+        f"({'preloaded' if args.preload else 'not preloaded'}, "
+        f"{'uvloop' if importlib.util.find_spec('uvloop') else 'asyncio'}, "
+        f"{'httptools' if importlib.util.find_spec('httptools') else 'h11'})"
+    )
+    return Supervisor(args, sock).run()
+
+if __name__ == "__main__":
+    sys.exit(main())
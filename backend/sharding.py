@@ -0,0 +1,305 @@
+"""
+Session Sharding Module
+
+This module runs the backend as N worker processes with every session pinned
+to one worker, so per-session state (history, caches, in-flight generations)
+stays in a single process. A consistent-hash ring maps ``session_id`` to a
+worker; a lightweight front router forwards HTTP requests, SSE streams and
+WebSocket upgrades to the owning worker, adding X-Forwarded-For so workers
+see the client's address. Resuming a generation (``GET /ai/stream/{id}``)
+must name its session in the ``session_id`` query argument or an
+``X-Session-Id`` header so it reaches the shard running it. Adding or
+removing a worker only moves the sessions that hashed to it.
+
+Message ids and history broadcasts still go through the backplane, so more
+than one worker needs a shared one: set BACKPLANE_URL.
+
+Usage:
+    python sharding.py serve --workers 4 --port 8000
+    python sharding.py nginx --workers 4          # hash-based nginx upstream instead
+"""
+
+import argparse
+import asyncio
+import bisect
+import hashlib
+import itertools
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Headers that describe a single hop and must not be forwarded
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te",
+    "trailer", "transfer-encoding", "upgrade", "content-length", "host",
+}
+FORWARDING_HEADERS = {"x-forwarded-for", "x-forwarded-proto"}
+
+WEBSOCKET_PATH = re.compile(r"^/ws/([^/]+)$")
+RESUME_PATH = re.compile(r"^/ai/stream/[^/]+$")
+
+class HashRing:
+    """Consistent-hash ring with virtual nodes"""
+
+    def __init__(self, nodes: Optional[List[str]] = None, replicas: int = 128):
+        self.replicas = replicas
+        self._keys: List[int] = []
+        self._nodes: Dict[int, str] = {}
+        for node in nodes or []:
+            self.add(node)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+    def add(self, node: str):
+        for replica in range(self.replicas):
+            point = self._hash(f"{node}#{replica}")
+            self._nodes[point] = node
+            bisect.insort(self._keys, point)
+
+    def remove(self, node: str):
+        for replica in range(self.replicas):
+            point = self._hash(f"{node}#{replica}")
+            if self._nodes.pop(point, None) is not None:
+                self._keys.remove(point)
+
+    def node_for(self, key: str) -> str:
+        """The node owning a key"""
+        if not self._keys:
+            raise LookupError("Hash ring is empty")
+        index = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._nodes[self._keys[index]]
+
+def forwardable(headers) -> Dict[str, str]:
+    # Forwarding headers are rebuilt by forwarding_headers(), under their canonical names
+    return {
+        name: value for name, value in headers.items()
+        if name.lower() not in HOP_BY_HOP_HEADERS and name.lower() not in FORWARDING_HEADERS
+    }
+
+def forwarding_headers(request: web.Request) -> Dict[str, str]:
+    """X-Forwarded-For and -Proto telling a worker who the client is, appended to any from a proxy in front"""
+    chain = request.headers.get("X-Forwarded-For")
+    client = request.remote or "unknown"
+    return {
+        "X-Forwarded-For": f"{chain}, {client}" if chain else client,
+        "X-Forwarded-Proto": request.headers.get("X-Forwarded-Proto", request.scheme),
+    }
+
+class ShardRouter:
+    """Front router forwarding each request to the worker owning its session"""
+
+    def __init__(self, workers: List[str], replicas: int = 128):
+        self.workers = workers
+        self.shard_index = {worker: str(index) for index, worker in enumerate(workers)}
+        self.ring = HashRing(workers, replicas)
+        self._round_robin = itertools.cycle(workers)
+        self._client: Optional[aiohttp.ClientSession] = None
+        self.forwarded: Dict[str, int] = {worker: 0 for worker in workers}
+        self.app = web.Application(client_max_size=16 * 1024 * 1024)
+        self.app.router.add_route("*", "/{tail:.*}", self.handle)
+        self.app.on_startup.append(self._start)
+        self.app.on_cleanup.append(self._stop)
+
+    async def _start(self, app: web.Application):
+        # Bodies are relayed untouched, compression included
+        self._client = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0),
+            auto_decompress=False,
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=5),
+        )
+
+    async def _stop(self, app: web.Application):
+        if self._client is not None:
+            await self._client.close()
+
+    @staticmethod
+    def session_key(request: web.Request, body: bytes = b"") -> Optional[str]:
+        """Find the session id of a request in its path, query, headers or JSON body"""
+        match = WEBSOCKET_PATH.match(request.path)
+        if match:
+            return match.group(1)
+        if request.query.get("session_id"):
+            return request.query["session_id"]
+        if request.headers.get("X-Session-Id"):
+            return request.headers["X-Session-Id"]
+        if body and request.content_type == "application/json":
+            try:
+                data = json.loads(body)
+            except ValueError:
+                return None
+            if isinstance(data, dict) and isinstance(data.get("session_id"), str):
+                return data["session_id"]
+        return None
+
+    def worker_for(self, session_id: Optional[str]) -> str:
+        if session_id is None:
+            return next(self._round_robin)
+        return self.ring.node_for(session_id)
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        if request.headers.get("Upgrade", "").lower() == "websocket":
+            worker = self.worker_for(self.session_key(request))
+            self.forwarded[worker] += 1
+            return await self._proxy_websocket(request, worker)
+
+        body = await request.read()
+        session_id = self.session_key(request, body)
+        if session_id is None and RESUME_PATH.match(request.path):
+            # Generations live on the shard of their session; any other shard would answer 404
+            return web.json_response({"detail": "session_id is required to resume a generation"}, status=400)
+        worker = self.worker_for(session_id)
+        self.forwarded[worker] += 1
+        try:
+            async with self._client.request(
+                request.method,
+                worker + request.path_qs,
+                headers={**forwardable(request.headers), **forwarding_headers(request)},
+                data=body or None,
+            ) as upstream:
+                response = web.StreamResponse(status=upstream.status, headers=forwardable(upstream.headers))
+                response.headers["X-Shard"] = self.shard_index[worker]
+                await response.prepare(request)
+                # Relay chunks as they arrive so SSE streams are not buffered
+                async for chunk in upstream.content.iter_any():
+                    await response.write(chunk)
+                await response.write_eof()
+                return response
+        except aiohttp.ClientError as e:
+            logger.error(f"Forwarding to shard {worker} failed: {e}")
+            return web.json_response({"detail": "Shard unavailable"}, status=502)
+
+    async def _proxy_websocket(self, request: web.Request, worker: str) -> web.WebSocketResponse:
+        protocols = [p.strip() for p in request.headers.get("Sec-WebSocket-Protocol", "").split(",") if p.strip()]
+        try:
+            upstream = await self._client.ws_connect(
+                "ws" + worker[len("http"):] + request.path_qs,
+                protocols=protocols,
+                headers=forwarding_headers(request),
+                compress=15 if "permessage-deflate" in request.headers.get("Sec-WebSocket-Extensions", "") else 0,
+            )
+        except aiohttp.ClientError as e:
+            logger.error(f"WebSocket upgrade to shard {worker} failed: {e}")
+            return web.json_response({"detail": "Shard unavailable"}, status=502)
+
+        client = web.WebSocketResponse(protocols=[upstream.protocol] if upstream.protocol else ())
+        await client.prepare(request)
+
+        async def pump(source, target):
+            async for message in source:
+                if message.type == aiohttp.WSMsgType.TEXT:
+                    await target.send_str(message.data)
+                elif message.type == aiohttp.WSMsgType.BINARY:
+                    await target.send_bytes(message.data)
+                else:
+                    break
+
+        tasks = [asyncio.create_task(pump(client, upstream)), asyncio.create_task(pump(upstream, client))]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await upstream.close()
+            await client.close()
+        return client
+
+def nginx_upstream(workers: List[str], name: str = "backend") -> str:
+    """An nginx upstream hashing session ids onto the given workers.
+
+    The session id comes from the WebSocket path, the ``session_id`` query
+    argument or an ``X-Session-Id`` header (send it with JSON POST bodies).
+    """
+    servers = "\n".join(f"        server {worker.split('://', 1)[-1]};" for worker in workers)
+    return f"""    map $uri $oasiz_path_session {{
+        ~^(/api)?/ws/(?<sid>[^/]+)$ $sid;
+        default "";
+    }}
+
+    upstream {name} {{
+        hash $oasiz_path_session$arg_session_id$http_x_session_id consistent;
+{servers}
+    }}
+"""
+
+def start_workers(count: int, base_port: int, host: str = "127.0.0.1") -> List[subprocess.Popen]:
+    """Start one uvicorn process per shard"""
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    processes = []
+    for index in range(count):
+        # Workers trust X-Forwarded-For from the router, which connects from localhost
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", host,
+             "--port", str(base_port + index), "--log-level", "warning",
+             "--proxy-headers", "--forwarded-allow-ips", "127.0.0.1"],
+            cwd=backend_dir,
+        ))
+    return processes
+
+async def wait_until_ready(urls: List[str], timeout: float = 30.0):
+    """Wait until every worker answers its health check"""
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        for url in urls:
+            while True:
+                try:
+                    async with session.get(f"{url}/health") as response:
+                        if response.status == 200:
+                            break
+                except aiohttp.ClientError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Shard {url} did not become ready")
+                await asyncio.sleep(0.1)
+
+def serve(workers: int, port: int, host: str, base_port: int):
+    """Run N shard workers behind the session router"""
+    processes = start_workers(workers, base_port)
+    urls = [f"http://127.0.0.1:{base_port + index}" for index in range(workers)]
+    try:
+        asyncio.run(wait_until_ready(urls))
+        router = ShardRouter(urls)
+        logger.info(f"Routing {workers} shards on {host}:{port}")
+        web.run_app(router.app, host=host, port=port, access_log=None, print=None)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the backend sharded by session id")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subcommands.add_parser("serve", help="Start workers and the session router")
+    serve_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    serve_parser.add_argument("--host", default="0.0.0.0")
+    serve_parser.add_argument("--port", type=int, default=int(os.getenv("PORT", 8000)))
+    serve_parser.add_argument("--base-port", type=int, default=8100, help="First worker port")
+    nginx_parser = subcommands.add_parser("nginx", help="Print a hash-based nginx upstream")
+    nginx_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    nginx_parser.add_argument("--host", default="backend")
+    nginx_parser.add_argument("--base-port", type=int, default=8100)
+    args = parser.parse_args(argv)
+    if args.workers > 1 and not os.getenv("BACKPLANE_URL"):
+        # Separate in-process backplanes would hand out the same message ids on every shard
+        parser.error("more than one worker needs a shared backplane; set BACKPLANE_URL")
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "serve":
+        serve(args.workers, args.port, args.host, args.base_port)
+    else:
+        print(nginx_upstream([f"{args.host}:{args.base_port + index}" for index in range(args.workers)]))
+
+if __name__ == "__main__":
+    main()
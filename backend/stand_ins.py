@@ -0,0 +1,321 @@
+"""
+Local Stand-in Upstreams
+
+This module provides hermetic fake HTTP servers for every upstream the backend
+talks to: the OpenAI chat-completions API (streaming and non-streaming),
+OpenWeatherMap, wttr.in and the DuckDuckGo Instant Answer API. Latency, jitter,
+error rate and streaming speed are configurable per upstream so load and
+performance tests can run without network access.
+
+A ``files`` upstream serves arbitrarily large text bodies at ``/files/{size}``
+with ETag and Last-Modified validators, for exercising bounded downloads.
+
+Usage:
+    python stand_ins.py --port 9100 --latency 0.05 --tokens-per-second 40
+
+and point the backend at it with the printed ``*_BASE_URL`` variables.
+"""
+
+import argparse
+import asyncio
+import email.utils
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
+from typing import Dict, Iterator, List, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+UPSTREAMS = ["openai", "openweathermap", "wttr", "duckduckgo", "files"]
+
+# Repeated to build large bodies; the multi-byte characters straddle chunk boundaries
+FILE_PATTERN = "Stand-in file line with a café and 🌟 emoji.\n".encode("utf-8")
+FILE_MODIFIED = email.utils.formatdate(1_700_000_000, usegmt=True)
+
+@dataclass
+class StandInConfig:
+    """Behaviour of a single stand-in upstream"""
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 500
+    tokens_per_second: float = 0.0
+    reply: Optional[str] = None
+    search_results: Dict[str, str] = field(default_factory=dict)
+    tool_calls: List[Dict] = field(default_factory=list)
+
+class StandInServer:
+    """Serves every stand-in upstream from a single local port"""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        configs: Optional[Dict[str, StandInConfig]] = None,
+        seed: Optional[int] = None,
+    ):
+        self.host = host
+        self.port = port
+        self.configs: Dict[str, StandInConfig] = {name: StandInConfig() for name in UPSTREAMS}
+        self.configs.update(configs or {})
+        self.requests: Dict[str, int] = {name: 0 for name in UPSTREAMS}
+        self.chat_bodies: List[Dict] = []
+        self.file_bytes_sent = 0
+        self._random = random.Random(seed)
+        self._runner: Optional[web.AppRunner] = None
+        self.app = self._build_app()
+
+    def _build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/openai/v1/chat/completions", self._openai_chat)
+        app.router.add_get("/openweathermap/data/2.5/weather", self._openweathermap)
+        app.router.add_get("/wttr/{location}", self._wttr)
+        app.router.add_get("/duckduckgo/", self._duckduckgo)
+        app.router.add_get("/files/{size}", self._files)
+        return app
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def base_urls(self) -> Dict[str, str]:
+        """Environment variables that point the backend at this server"""
+        return {
+            "OPENAI_BASE_URL": f"{self.base_url}/openai/v1",
+            "OPENWEATHER_BASE_URL": f"{self.base_url}/openweathermap/data/2.5",
+            "WTTR_BASE_URL": f"{self.base_url}/wttr",
+            "DUCKDUCKGO_BASE_URL": f"{self.base_url}/duckduckgo",
+        }
+
+    async def start(self):
+        """Start serving on the event loop of the caller"""
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # Resolve the real port when an ephemeral one was requested
+        self.port = site._server.sockets[0].getsockname()[1]
+        logger.info(f"Stand-in upstreams listening on {self.base_url}")
+
+    async def stop(self):
+        """Stop serving and close open connections"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    @contextmanager
+    def running(self) -> Iterator["StandInServer"]:
+        """Run the server on a background thread for synchronous callers"""
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        asyncio.run_coroutine_threadsafe(self.start(), loop).result()
+        try:
+            yield self
+        finally:
+            asyncio.run_coroutine_threadsafe(self.stop(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+    async def _delay_or_fail(self, upstream: str) -> Optional[web.Response]:
+        """Apply latency injection and return an error response when one is drawn"""
+        self.requests[upstream] += 1
+        config = self.configs[upstream]
+        delay = config.latency + self._random.uniform(-config.jitter, config.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if config.error_rate and self._random.random() < config.error_rate:
+            return web.json_response(
+                {"error": {"message": f"Injected {upstream} failure", "type": "stand_in_error"}},
+                status=config.error_status,
+            )
+        return None
+
+    def _reply_for(self, messages: List[Dict]) -> str:
+        config = self.configs["openai"]
+        if config.reply is not None:
+            return config.reply
+        last_user = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+        return f"Stand-in reply to: {last_user}"
+
+    async def _openai_chat(self, request: web.Request) -> web.StreamResponse:
+        failure = await self._delay_or_fail("openai")
+        if failure is not None:
+            return failure
+
+        body = await request.json()
+        self.chat_bodies.append(body)
+        messages = body.get("messages", [])
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        model = body.get("model", "gpt-3.5-turbo")
+
+        tool_calls = None
+        config = self.configs["openai"]
+        answered_tools = any(m.get("role") == "tool" for m in messages)
+        if body.get("tools") and config.tool_calls and not answered_tools:
+            tool_calls = [
+                {
+                    "id": f"call_{index}",
+                    "type": "function",
+                    "function": {"name": call["name"], "arguments": json.dumps(call.get("arguments", {}))},
+                }
+                for index, call in enumerate(config.tool_calls)
+            ]
+
+        if not body.get("stream"):
+            message = {"role": "assistant", "content": None if tool_calls else self._reply_for(messages)}
+            if tool_calls:
+                message["tool_calls"] = tool_calls
+            prompt_tokens = sum(len((m.get("content") or "").split()) for m in messages)
+            completion_tokens = len((message["content"] or "").split())
+            return web.json_response({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": message,
+                    "finish_reason": "tool_calls" if tool_calls else "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+
+        async def send(delta: Dict, finish_reason: Optional[str] = None):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+        await send({"role": "assistant"})
+        if tool_calls:
+            for index, call in enumerate(tool_calls):
+                await send({"tool_calls": [dict(call, index=index)]})
+            await send({}, "tool_calls")
+        else:
+            interval = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0
+            words = self._reply_for(messages).split(" ")
+            for index, word in enumerate(words):
+                if interval:
+                    await asyncio.sleep(interval)
+                await send({"content": word if index == 0 else " " + word})
+            await send({}, "stop")
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def _openweathermap(self, request: web.Request) -> web.Response:
+        failure = await self._delay_or_fail("openweathermap")
+        if failure is not None:
+            return failure
+        location = request.query.get("q", "")
+        return web.json_response({
+            "weather": [{"id": 800, "main": "Clear", "description": "clear sky", "icon": "01d"}],
+            "main": {"temp": 21.5, "feels_like": 21.0, "pressure": 1015, "humidity": 40},
+            "name": location,
+            "cod": 200,
+        })
+
+    async def _wttr(self, request: web.Request) -> web.Response:
+        failure = await self._delay_or_fail("wttr")
+        if failure is not None:
+            return failure
+        location = request.match_info["location"]
+        return web.Response(text=f"{location}: ☀️ +21°C\n")
+
+    async def _duckduckgo(self, request: web.Request) -> web.Response:
+        failure = await self._delay_or_fail("duckduckgo")
+        if failure is not None:
+            return failure
+        query = request.query.get("q", "")
+        results = self.configs["duckduckgo"].search_results
+        abstract = results.get(query, f"Stand-in abstract for {query}")
+        # The real API labels its JSON as JavaScript
+        return web.Response(
+            text=json.dumps({"Abstract": abstract, "Answer": "", "RelatedTopics": []}),
+            content_type="application/x-javascript",
+        )
+
+    async def _files(self, request: web.Request) -> web.StreamResponse:
+        failure = await self._delay_or_fail("files")
+        if failure is not None:
+            return failure
+        size = int(request.match_info["size"])
+        headers = {"ETag": f'"size-{size}"', "Last-Modified": FILE_MODIFIED}
+        if request.headers.get("If-None-Match") == headers["ETag"] or (
+            request.headers.get("If-Modified-Since") == FILE_MODIFIED and "If-None-Match" not in request.headers
+        ):
+            return web.Response(status=304, headers=headers)
+        response = web.StreamResponse(headers=headers)
+        response.content_type = "text/plain"
+        response.charset = "utf-8"
+        response.content_length = size
+        await response.prepare(request)
+        chunk = FILE_PATTERN * (65536 // len(FILE_PATTERN))
+        remaining = size
+        try:
+            while remaining > 0:
+                part = chunk[:remaining]
+                await response.write(part)
+                self.file_bytes_sent += len(part)
+                remaining -= len(part)
+        except ConnectionResetError:
+            # The client stopped reading early
+            pass
+        return response
+
+def main():
+    parser = argparse.ArgumentParser(description="Run local stand-in upstream servers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform +/- jitter in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="Streaming speed, 0 for unlimited")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    config = StandInConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        tokens_per_second=args.tokens_per_second,
+    )
+    server = StandInServer(
+        args.host, args.port, {name: replace(config) for name in UPSTREAMS}, seed=args.seed
+    )
+
+    async def serve():
+        await server.start()
+        for name, url in server.base_urls().items():
+            print(f"export {name}={url}")
+        await asyncio.Event().wait()
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
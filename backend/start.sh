@@ -4,5 +4,7 @@ echo "Python version: $(python3 --version)"
 echo "Installing dependencies..."
 pip install -r requirements.txt
 echo "Starting FastAPI server..."
-uvicorn main:app --host 0.0.0.0 --port $PORT --log-level info
+# Railway's edge proxy has no fixed address and is the only way in, so trust its last hop
+export FORWARDED_ALLOW_IPS="${FORWARDED_ALLOW_IPS:-*}"
+exec python serve.py --port $PORT --log-level info
 
@@ -0,0 +1,120 @@
+"""
+Startup Timing and Lazy Imports
+
+Containers are scaled up and down often, so the time from process start to
+the first request served matters. This module helps keep it short:
+
+- ``lazy_import`` returns a module whose code only runs on first attribute
+  access, so optional dependencies (storage drivers, profilers, optional
+  codecs) cost nothing until a feature uses them. Dependencies of the request
+  path, like the HTTP client, stay eager: loading them on first use would
+  stall the event loop while the first requests wait
+- StartupTimer records, relative to the process start, when the app module
+  finished importing, when startup hooks completed and when the first
+  request was answered; StartupTimingMiddleware catches the first response
+
+Per-module import times come from ``python -X importtime``; see
+benchmarks/bench_startup.py for a report combining both.
+"""
+
+import importlib.util
+import logging
+import os
+import sys
+import time
+from types import ModuleType
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+def lazy_import(name: str) -> ModuleType:
+    """Module ``name``, imported on first attribute access; raises ImportError if it is not installed"""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+def is_loaded(name: str) -> bool:
+    """Whether a module has been imported and, if lazy, actually executed"""
+    module = sys.modules.get(name)
+    # type() does not go through the lazy module's attribute hook
+    return module is not None and not isinstance(module, importlib.util._LazyModule)
+
+def load_lazy(names: Iterable[str]) -> List[str]:
+    """Execute pending lazy modules now, e.g. before forking workers; returns those loaded"""
+    loaded = []
+    for name in names:
+        module = sys.modules.get(name)
+        if module is not None and not is_loaded(name):
+            getattr(module, "__name__")
+            loaded.append(name)
+    return loaded
+
+def pending_lazy() -> List[str]:
+    """Lazy modules not executed yet"""
+    return [name for name, module in list(sys.modules.items()) if isinstance(module, importlib.util._LazyModule)]
+
+def process_age() -> Optional[float]:
+    """Seconds since this process started, from /proc; None where unavailable"""
+    try:
+        with open("/proc/self/stat") as f:
+            # The command name may contain spaces, so count fields after its closing parenthesis
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK"))
+    except (OSError, IndexError, ValueError):
+        return None
+
+class StartupTimer:
+    """Milestones of a cold start, in seconds since the process started"""
+
+    def __init__(self):
+        age = process_age()
+        # Without /proc, time from the first import of this module instead
+        self.process_started = time.monotonic() - (age or 0.0)
+        self.exact = age is not None
+        self.marks: Dict[str, float] = {}
+
+    def mark(self, name: str) -> float:
+        """Record a milestone the first time it is reached"""
+        if name not in self.marks:
+            self.marks[name] = round(time.monotonic() - self.process_started, 6)
+        return self.marks[name]
+
+    def stats(self) -> Dict[str, Any]:
+        """Get startup statistics"""
+        return {"since_process_start": self.exact, **self.marks, "lazy_pending": pending_lazy()}
+
+class StartupTimingMiddleware:
+    """ASGI middleware marking when the first HTTP response was sent"""
+
+    def __init__(self, app, timer: StartupTimer):
+        self.app = app
+        self.timer = timer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or "first_request" in self.timer.marks:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_marking_first(message):
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body") \
+                    and "first_request" not in self.timer.marks:
+                self.timer.mark("first_request")
+                logger.info(
+                    "Cold start: "
+                    + ", ".join(f"{name} at {seconds * 1000:.0f} ms" for name, seconds in self.timer.marks.items())
+                    + (" after process start" if self.timer.exact else "")
+                )
+
+        await self.app(scope, receive, send_marking_first)
@@ -0,0 +1,127 @@
+"""
+Test suite for the message store and the pub/sub backplane
+"""
+
+import asyncio
+import json
+import os
+import pytest
+from fastapi.testclient import TestClient
+import main
+from main import app
+from backplane import InProcessBackplane, InProcessHub, RedisBackplane, create_backplane
+from message_store import MessageStore
+
+def make_message(message_id, session_id="s1", sender="user", text="hi"):
+    return {"id": message_id, "sender": sender, "text": text, "timestamp": "t", "session_id": session_id}
+
+class TestMessageStore:
+    """Test the session-indexed store"""
+
+    def test_history_is_per_session(self):
+        """Test that history only returns the requested session"""
+        store = MessageStore()
+        store.add(make_message(1, "a"))
+        store.add(make_message(2, "b"))
+        store.add(make_message(3, "a"))
+        assert [m["id"] for m in store.history("a")] == [1, 3]
+        assert store.history("missing") == []
+
+    def test_duplicates_and_order(self):
+        """Test that replayed events are ignored and late ids are ordered"""
+        store = MessageStore()
+        assert store.add(make_message(2))
+        assert store.add(make_message(1))
+        assert not store.add(make_message(2))
+        assert [m["id"] for m in store.history("s1")] == [1, 2]
+        assert len(store) == 2
+
+class TestInProcessBackplane:
+    """Test event delivery between in-process workers"""
+
+    def test_events_reach_other_workers_only(self):
+        """Test that a publisher does not receive its own events"""
+        async def run():
+            hub = InProcessHub()
+            first, second = InProcessBackplane(hub), InProcessBackplane(hub)
+            received = {"first": [], "second": []}
+
+            async def on_first(event):
+                received["first"].append(event)
+
+            async def on_second(event):
+                received["second"].append(event)
+
+            await first.start(on_first)
+            await second.start(on_second)
+            await first.publish({"type": "message", "message": make_message(1)})
+            return first, received
+
+        first, received = asyncio.run(run())
+        assert received["first"] == []
+        assert received["second"][0]["origin"] == first.worker_id
+
+    def test_ids_unique_across_workers(self):
+        """Test that workers sharing a hub never reuse an id"""
+        async def run():
+            hub = InProcessHub()
+            workers = [InProcessBackplane(hub) for _ in range(4)]
+            return [await worker.next_id() for worker in workers for _ in range(25)]
+
+        ids = asyncio.run(run())
+        assert len(set(ids)) == 100
+
+    def test_create_backplane_defaults_to_in_process(self):
+        """Test backend selection from the URL"""
+        assert isinstance(create_backplane(None), InProcessBackplane)
+
+class TestCrossWorkerDelivery:
+    """Test that events from another worker reach history and sockets"""
+
+    def test_remote_message_delivered(self):
+        """Test history and WebSocket delivery of a peer worker's message"""
+        peer = InProcessBackplane(hub=main.backplane.hub)
+        message = make_message(10_000, "cross-worker-session", "bot", "from another worker")
+        with TestClient(app) as client:
+            with client.websocket_connect("/ws/cross-worker-session") as websocket:
+                client.portal.call(peer.publish, {"type": "message", "message": message})
+                frame = json.loads(websocket.receive_text())
+            history = client.get("/chat/history?session_id=cross-worker-session").json()
+        assert frame == {"type": "bot_response", "message": message}
+        assert history == [message]
+
+    def test_send_reaches_other_tabs(self):
+        """Test that REST messages are pushed to the session's sockets"""
+        with TestClient(app) as client:
+            with client.websocket_connect("/ws/tab-session") as websocket:
+                client.post("/chat/send", json={"sender": "user", "text": "hello tabs", "session_id": "tab-session"})
+                frame = json.loads(websocket.receive_text())
+        assert frame["type"] == "message_sent"
+        assert frame["message"]["text"] == "hello tabs"
+
+@pytest.mark.skipif(not os.getenv("REDIS_URL"), reason="REDIS_URL not set")
+class TestRedisBackplane:
+    """Test the Redis backplane against a live server"""
+
+    def test_round_trip(self):
+        """Test pub/sub, id allocation and durable history"""
+        async def run():
+            channel = f"oasiz-test-{os.getpid()}"
+            first = RedisBackplane(os.environ["REDIS_URL"], channel=channel)
+            second = RedisBackplane(os.environ["REDIS_URL"], channel=channel)
+            received = asyncio.Queue()
+            await first.start(received.put)
+            await second.start(received.put)
+            message = make_message(await first.next_id(), channel)
+            await first.save_message(message)
+            await first.publish({"type": "message", "message": message})
+            event = await asyncio.wait_for(received.get(), 5)
+            history = await second.load_session(channel)
+            await first.redis.delete(f"{channel}:history:{channel}", f"{channel}:message_id")
+            await first.stop()
+            await second.stop()
+            return message, event, history
+
+        message, event, history = asyncio.run(run())
+        assert event["message"] == message
+        assert history == [message]
@@ -0,0 +1,227 @@
+"""
+Test suite for the WebSocket connection registry
+"""
+
+import asyncio
+import json
+import time
+import pytest
+from unittest.mock import patch, AsyncMock
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+from connections import (
+    ConnectionManager, SLOW_CONSUMER_CLOSE_CODE, SATURATED_CLOSE_CODE, LIMIT_CLOSE_CODE, IDLE_CLOSE_CODE
+)
+import main
+from main import app
+
+class FakeWebSocket:
+    """Minimal stand-in for a Starlette WebSocket"""
+
+    def __init__(self, delay: float = 0.0, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+        self.sent = []
+        self.close_code = None
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, message):
+        if self.fail:
+            raise ConnectionResetError("peer went away")
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.sent.append(message)
+
+    async def send_bytes(self, message):
+        await self.send_text(message)
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+async def drain():
+    """Let writer tasks run until their queues are empty"""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+class TestConnectionRegistry:
+    """Test registry bookkeeping and delivery"""
+
+    def test_indexed_by_session(self):
+        """Test connect and O(1) disconnect by id"""
+        async def run():
+            manager = ConnectionManager()
+            first = await manager.connect(FakeWebSocket(), "s1")
+            second = await manager.connect(FakeWebSocket(), "s1")
+            await manager.connect(FakeWebSocket(), "s2")
+            assert set(manager.sessions["s1"]) == {first.id, second.id}
+            manager.disconnect(first)
+            manager.disconnect(first)
+            assert set(manager.sessions["s1"]) == {second.id}
+            manager.disconnect(second)
+            assert "s1" not in manager.sessions
+            assert manager.stats()["connections"] == 1
+
+        asyncio.run(run())
+
+    def test_send_to_session_excludes_origin(self):
+        """Test cross-tab delivery within one session"""
+        async def run():
+            manager = ConnectionManager()
+            sockets = [FakeWebSocket() for _ in range(3)]
+            origin = await manager.connect(sockets[0], "s1")
+            await manager.connect(sockets[1], "s1")
+            await manager.connect(sockets[2], "other")
+            assert await manager.send_to_session("s1", "hi", exclude=origin.id) == 1
+            await drain()
+            return sockets
+
+        sockets = asyncio.run(run())
+        assert [s.sent for s in sockets] == [[], ["hi"], []]
+
+    def test_send_errors_are_logged_and_disconnect(self):
+        """Test that failing sockets are removed instead of silently ignored"""
+        async def run():
+            manager = ConnectionManager()
+            await manager.connect(FakeWebSocket(fail=True), "s1")
+            await manager.broadcast("hello")
+            await drain()
+            return manager
+
+        stats = asyncio.run(run()).stats()
+        assert stats["connections"] == 0
+        assert stats["send_errors"] == 1
+
+    def test_drop_policy_keeps_slow_consumer(self):
+        """Test that the drop policy discards overflow but stays connected"""
+        async def run():
+            manager = ConnectionManager(queue_size=2, overflow_policy="drop")
+            await manager.connect(FakeWebSocket(delay=10), "s1")
+            for index in range(5):
+                await manager.broadcast(str(index))
+            return manager
+
+        stats = asyncio.run(run()).stats()
+        assert stats["connections"] == 1
+        assert stats["messages_dropped"] >= 2
+
+    def test_heartbeat_failures_are_counted(self):
+        """Test that a ping that cannot be queued to a backed-up consumer is counted"""
+        async def run():
+            manager = ConnectionManager(queue_size=1, overflow_policy="drop", heartbeat_interval=1, idle_timeout=60)
+            await manager.connect(FakeWebSocket(delay=10), "s1")
+            for index in range(3):
+                await manager.broadcast(str(index))
+            await manager.reap_idle()
+            return manager
+
+        stats = asyncio.run(run()).stats()
+        assert stats["heartbeat_failures"] == 1 and stats["heartbeats_sent"] == 0
+
+class TestBroadcastLoad:
+    """Load test broadcast fan-out with simulated sockets"""
+
+    def test_10k_sockets_with_slow_consumers(self):
+        """Test that slow sockets neither stall nor starve the others"""
+        async def run():
+            manager = ConnectionManager(queue_size=8, overflow_policy="disconnect")
+            fast = [FakeWebSocket() for _ in range(10_000)]
+            slow = [FakeWebSocket(delay=60) for _ in range(50)]
+            for index, websocket in enumerate(fast + slow):
+                await manager.connect(websocket, f"session-{index % 2500}")
+
+            started = time.perf_counter()
+            for index in range(20):
+                await manager.broadcast(f"message {index}")
+                await drain()
+            elapsed = time.perf_counter() - started
+            await drain()
+            return manager, fast, slow, elapsed
+
+        manager, fast, slow, elapsed = asyncio.run(run())
+        assert all(len(websocket.sent) == 20 for websocket in fast)
+        assert all(websocket.close_code == SLOW_CONSUMER_CLOSE_CODE for websocket in slow)
+        assert manager.stats()["connections"] == 10_000
+        assert manager.stats()["slow_disconnects"] == 50
+        # Serial awaits on the slow sockets alone would take 50 minutes
+        assert elapsed < 10
+
+class TestWebSocketEndpoint:
+    """Test the chat WebSocket end to end"""
+
+    def test_message_round_trip(self):
+        """Test that a message is acknowledged and answered"""
+        client = TestClient(app)
+        with patch('main.get_ai_response', new_callable=AsyncMock) as mock_ai:
+            mock_ai.return_value = "Hi there!"
+            with client.websocket_connect("/ws/ws-test-session") as websocket:
+                websocket.send_text(json.dumps({"type": "message", "message": "Hello"}))
+                sent = json.loads(websocket.receive_text())
+                reply = json.loads(websocket.receive_text())
+        assert sent["type"] == "message_sent"
+        assert reply["type"] == "bot_response"
+        assert reply["message"]["text"] == "Hi there!"
+
+class TestAdmissionAndHeartbeats:
+    """Test connection caps, heartbeats and idle reaping"""
+
+    def test_caps(self):
+        """Test global, per-IP and per-session admission limits"""
+        async def run():
+            manager = ConnectionManager(max_connections=3, max_per_ip=2, max_per_session=1)
+            refused = {}
+            assert await manager.connect(FakeWebSocket(), "a", client_ip="1.1.1.1")
+            refused["per_session"] = FakeWebSocket()
+            assert await manager.connect(refused["per_session"], "a", client_ip="2.2.2.2") is None
+            assert await manager.connect(FakeWebSocket(), "b", client_ip="1.1.1.1")
+            refused["per_ip"] = FakeWebSocket()
+            assert await manager.connect(refused["per_ip"], "c", client_ip="1.1.1.1") is None
+            assert await manager.connect(FakeWebSocket(), "d", client_ip="3.3.3.3")
+            refused["saturated"] = FakeWebSocket()
+            assert await manager.connect(refused["saturated"], "e", client_ip="4.4.4.4") is None
+            return manager, refused
+
+        manager, refused = asyncio.run(run())
+        assert refused["per_session"].close_code == LIMIT_CLOSE_CODE
+        assert refused["per_ip"].close_code == LIMIT_CLOSE_CODE
+        assert refused["saturated"].close_code == SATURATED_CLOSE_CODE
+        stats = manager.stats()
+        assert stats["rejected"] == {"saturated": 1, "per_ip": 1, "per_session": 1}
+        assert stats["max_connections_per_ip"] == 2
+
+    def test_idle_connections_are_reaped(self):
+        """Test that silent sockets are closed and live ones are pinged"""
+        async def run():
+            manager = ConnectionManager(heartbeat_interval=1, idle_timeout=0.05)
+            idle, live = FakeWebSocket(), FakeWebSocket()
+            await manager.connect(idle, "s1")
+            live_connection = await manager.connect(live, "s2")
+            await asyncio.sleep(0.1)
+            manager.touch(live_connection)
+            reaped = await manager.reap_idle()
+            await drain()
+            return manager, reaped, idle, live
+
+        manager, reaped, idle, live = asyncio.run(run())
+        assert reaped == 1
+        assert idle.close_code == IDLE_CLOSE_CODE
+        assert json.loads(live.sent[0]) == {"type": "ping"}
+        assert manager.stats()["connections"] == 1
+        assert manager.stats()["idle_reaped"] == 1
+        assert manager.stats()["heartbeat_failures"] == 0
+
+    def test_endpoint_refuses_over_session_cap(self, monkeypatch):
+        """Test that the endpoint rejects upgrades past the session cap"""
+        monkeypatch.setattr(main.manager, "max_per_session", 1)
+        client = TestClient(app)
+        with client.websocket_connect("/ws/capped-session") as websocket:
+            websocket.send_text(json.dumps({"type": "ping"}))
+            assert json.loads(websocket.receive_text()) == {"type": "pong"}
+            with pytest.raises(WebSocketDisconnect):
+                with client.websocket_connect("/ws/capped-session"):
+                    pass
+        metrics = client.get("/metrics").text
+        assert f'oasiz_websocket_rejected_total{{reason="per_session"}} {main.manager.rejected["per_session"]}' in metrics
+        assert "oasiz_websocket_heartbeat_failures_total" in metrics
+        assert "oasiz_websocket_idle_reaped_total" in metrics
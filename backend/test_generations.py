@@ -0,0 +1,272 @@
+"""
+Test suite for resumable AI generations
+"""
+
+import asyncio
+import json
+import time
+import pytest
+from unittest.mock import patch, AsyncMock
+from fastapi.testclient import TestClient
+import main
+from main import app
+from generations import GenerationRegistry, ReplayGapError
+from test_stand_ins import stand_in  # noqa: F401
+
+async def produce(chunks, delay: float = 0.0):
+    for chunk in chunks:
+        if delay:
+            await asyncio.sleep(delay)
+        yield chunk
+
+def parse_events(text: str):
+    """Split a server-sent event stream into (id, data) pairs"""
+    events = []
+    for block in filter(None, text.split("\n\n")):
+        event_id, data = None, []
+        for line in block.split("\n"):
+            name, _, value = line.partition(": ")
+            if name == "id":
+                event_id = value
+            elif name == "data":
+                data.append(value)
+        events.append((event_id, "\n".join(data)))
+    return events
+
+class TestGenerationRegistry:
+    """Test replay buffers and their lifetime"""
+
+    def test_resume_mid_generation(self):
+        """Test that a late follower replays from its offset and then keeps up"""
+        async def run():
+            registry = GenerationRegistry()
+            generation = registry.start("s1", produce(["a", "b", "c", "d"], delay=0.01))
+            await asyncio.sleep(0.025)
+            resumed = [chunk async for chunk in registry.resume(generation.id, "s1").follow(1)]
+            return generation, resumed, registry.stats()
+
+        generation, resumed, stats = asyncio.run(run())
+        assert resumed == [(1, "b"), (2, "c"), (3, "d")]
+        assert generation.text == "abcd"
+        assert stats["resumed"] == 1 and stats["active"] == 0
+
+    def test_evicted_offset_is_a_gap(self):
+        """Test that offsets older than the ring buffer cannot be replayed"""
+        async def run():
+            registry = GenerationRegistry(buffer_size=2)
+            generation = registry.start("s1", produce(["a", "b", "c"]))
+            await generation.wait()
+            with pytest.raises(ReplayGapError):
+                [chunk async for chunk in generation.follow(0)]
+            return generation, [chunk async for chunk in generation.follow(1)]
+
+        generation, replayed = asyncio.run(run())
+        assert replayed == [(1, "b"), (2, "c")]
+        # Only the ring buffer is kept, so evicted output is gone from the text too
+        assert generation.text == "bc" and not generation.complete
+
+    def test_expired_after_grace_period(self):
+        """Test that finished generations are only kept for the grace period"""
+        async def run():
+            registry = GenerationRegistry(grace_period=0.01)
+            generation = registry.start("s1", produce(["a"]))
+            await generation.wait()
+            assert registry.resume(generation.id, "s1") is generation
+            assert registry.resume(generation.id, "other-session") is None
+            await asyncio.sleep(0.02)
+            return registry.resume(generation.id, "s1")
+
+        assert asyncio.run(run()) is None
+
+    def test_stop_cancels_running(self):
+        """Test that shutdown cancels generations still in flight"""
+        async def run():
+            registry = GenerationRegistry()
+            generation = registry.start("s1", produce(["a", "b"], delay=10))
+            await asyncio.sleep(0)
+            await registry.stop()
+            return generation
+
+        generation = asyncio.run(run())
+        assert generation.done and generation.error == "cancelled"
+
+    def test_drain_waits_for_running(self):
+        """Test that draining lets short generations finish and reports those past the deadline"""
+        async def run():
+            registry = GenerationRegistry()
+            short = registry.start("s1", produce(["a", "b"], delay=0.02))
+            long = registry.start("s2", produce(["a", "b"], delay=10))
+            remaining = await registry.drain(0.2)
+            await registry.stop()
+            return short, long, remaining, registry.stats()
+
+        short, long, remaining, stats = asyncio.run(run())
+        assert short.text == "ab" and short.error is None
+        assert long.error == "cancelled"
+        assert remaining == 1 and stats["draining"] is True
+
+class TestCancellation:
+    """Test cancelling generations nobody is reading"""
+
+    def test_abandoned_generation_is_cancelled(self):
+        """Test that the upstream stops once the last reader has been gone for the grace period"""
+        async def run():
+            registry = GenerationRegistry(cancel_grace=0.05)
+            generation = registry.start("s1", produce(["a"] * 100, delay=0.01))
+            async for offset, _ in generation.follow():
+                if offset == 2:
+                    break
+            await asyncio.sleep(0.2)
+            return registry, generation
+
+        registry, generation = asyncio.run(run())
+        assert generation.error == "cancelled"
+        assert 3 <= generation.next_offset < 100
+        assert registry.stats()["cancelled"] == 1
+
+    def test_reattaching_keeps_generation_alive(self):
+        """Test that a reader resuming within the grace period prevents cancellation"""
+        async def run():
+            registry = GenerationRegistry(cancel_grace=0.05)
+            generation = registry.start("s1", produce(["a"] * 10, delay=0.01))
+            async for _ in generation.follow():
+                break
+            return [chunk async for chunk in generation.follow(1)], generation
+
+        resumed, generation = asyncio.run(run())
+        assert len(resumed) == 9
+        assert generation.error is None
+
+    def test_sse_disconnect_cancels_upstream(self, stand_in, monkeypatch):
+        """Test that a client going away mid-stream stops the completion and counts the savings"""
+        monkeypatch.setattr(main.generations, "cancel_grace", 0)
+        stand_in.configs["openai"].reply = " ".join(["word"] * 50)
+        stand_in.configs["openai"].tokens_per_second = 50
+        cancelled_before = main.generations.cancelled
+        saved_before = main.generations.tokens_saved_upper_bound
+
+        async def run():
+            body = json.dumps({"message": "tell me a long story", "session_id": "s1"}).encode()
+            messages = [{"type": "http.request", "body": body, "more_body": False}]
+            events = []
+
+            async def receive():
+                if messages:
+                    return messages.pop(0)
+                # The browser goes away after a few tokens
+                await asyncio.sleep(0.2)
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                events.append(message)
+
+            scope = {
+                "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+                "scheme": "http", "path": "/ai/stream", "raw_path": b"/ai/stream", "query_string": b"",
+                "root_path": "", "headers": [(b"content-type", b"application/json")],
+                "client": ("127.0.0.1", 1234), "server": ("testserver", 80),
+            }
+            await app(scope, receive, send)
+            generation_id = dict(events[0]["headers"])[b"x-generation-id"].decode()
+            generation = main.generations.get(generation_id)
+            await asyncio.wait([generation.task])
+            return generation
+
+        generation = asyncio.run(run())
+        assert generation.error == "cancelled"
+        assert 0 < generation.next_offset < 50
+        assert generation.text.startswith("word")
+        assert main.generations.cancelled == cancelled_before + 1
+        assert main.generations.tokens_saved_upper_bound == saved_before + main.STREAM_MAX_TOKENS - generation.next_offset
+
+    def test_code_execution_is_cancellable(self):
+        """Test that cancelling a code run kills the interpreter instead of waiting for it"""
+        async def run():
+            started = time.perf_counter()
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(main.execute_code("import time\ntime.sleep(30)"), 0.5)
+            return time.perf_counter() - started
+
+        assert asyncio.run(run()) < 3
+
+class TestResumeEndpoints:
+    """Test resuming over SSE and WebSocket"""
+
+    def test_sse_resume_from_last_event_id(self, stand_in):
+        """Test that a reconnecting client only receives events after Last-Event-ID"""
+        stand_in.configs["openai"].reply = "one two three"
+        with TestClient(app) as client:
+            response = client.post("/ai/stream", json={"message": "count for me", "session_id": "s1"})
+            generation_id = response.headers["X-Generation-Id"]
+            events = parse_events(response.text)
+            assert events[0] == (f"{generation_id}:0", "one")
+
+            resumed = client.get(
+                f"/ai/stream/{generation_id}?session_id=s1", headers={"Last-Event-ID": events[1][0]}
+            )
+            assert parse_events(resumed.text) == events[2:]
+            assert client.get(f"/ai/stream/{generation_id}?offset=3",
+                              headers={"X-Session-Id": "s1"}).text.endswith("data: [DONE]\n\n")
+            assert client.get("/ai/stream/unknown?session_id=s1").status_code == 404
+        assert stand_in.requests["openai"] == 1
+
+    def test_sse_multiline_chunks(self):
+        """Test that chunks with line breaks keep one event each and resume at the right offset"""
+        async def start():
+            return main.generations.start("s1", produce(["```py\nprint(1)\n```", "- a\r\n- b", "\n"]))
+
+        with TestClient(app) as client:
+            generation = client.portal.call(start)
+            response = client.get(f"/ai/stream/{generation.id}?session_id=s1")
+            events = parse_events(response.text)
+            assert events == [
+                (f"{generation.id}:0", "```py\nprint(1)\n```"),
+                (f"{generation.id}:1", "- a\n- b"),
+                (f"{generation.id}:2", "\n"),
+            ]
+            resumed = client.get(f"/ai/stream/{generation.id}?session_id=s1", headers={"Last-Event-ID": events[0][0]})
+            assert parse_events(resumed.text) == events[1:]
+        assert "data: print(1)\n" in response.text
+
+    def test_sse_gap_is_gone(self, stand_in, monkeypatch):
+        """Test that resuming before the buffered window answers 410"""
+        monkeypatch.setattr(main.generations, "buffer_size", 2)
+        stand_in.configs["openai"].reply = "one two three"
+        with TestClient(app) as client:
+            response = client.post("/ai/stream", json={"message": "count", "session_id": "s1"})
+            generation_id = response.headers["X-Generation-Id"]
+            assert client.get(f"/ai/stream/{generation_id}?offset=0&session_id=s1").status_code == 410
+
+    def test_sse_resume_needs_the_owning_session(self, stand_in):
+        """Test that only the session that started a generation can resume it"""
+        stand_in.configs["openai"].reply = "private reply"
+        with TestClient(app) as client:
+            response = client.post("/ai/stream", json={"message": "secret", "session_id": "victim"})
+            generation_id = response.headers["X-Generation-Id"]
+            assert len(generation_id) == 32 and not generation_id.isdigit()
+            assert client.get(f"/ai/stream/{generation_id}").status_code == 400
+            assert client.get(f"/ai/stream/{generation_id}?session_id=attacker").status_code == 404
+            assert client.get(f"/ai/stream/{generation_id}?session_id=victim").status_code == 200
+
+    def test_websocket_resume_by_offset(self):
+        """Test that another socket of the session can replay a generation"""
+        with patch('main.get_ai_response', new_callable=AsyncMock) as mock_ai:
+            mock_ai.return_value = "Hi there!"
+            with TestClient(app) as client:
+                with client.websocket_connect("/ws/resume-session") as websocket:
+                    websocket.send_text(json.dumps({"type": "message", "message": "Hello"}))
+                    ack = json.loads(websocket.receive_text())
+                    reply = json.loads(websocket.receive_text())
+                assert reply["generation_id"] == ack["generation_id"]
+                assert reply["generation_id"] != str(ack["message"]["id"])
+
+                with client.websocket_connect("/ws/resume-session") as websocket:
+                    websocket.send_text(json.dumps({"type": "resume", "generation_id": reply["generation_id"]}))
+                    chunk = json.loads(websocket.receive_text())
+                    done = json.loads(websocket.receive_text())
+                with client.websocket_connect("/ws/other-session") as websocket:
+                    websocket.send_text(json.dumps({"type": "resume", "generation_id": reply["generation_id"]}))
+                    refused = json.loads(websocket.receive_text())
+        assert chunk == {"type": "chunk", "generation_id": reply["generation_id"], "offset": 0, "text": "Hi there!"}
+        assert done["type"] == "generation_done"
+        assert refused["type"] == "error"
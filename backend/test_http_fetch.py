@@ -0,0 +1,90 @@
+"""
+Test suite for bounded HTTP fetching against the stand-in file server
+"""
+
+import asyncio
+import pytest
+from http_fetch import HTTPFetcher
+from mcp_integration import MCPManager
+from stand_ins import FILE_PATTERN, StandInServer
+
+@pytest.fixture
+def files():
+    """Stand-in server serving large bodies"""
+    server = StandInServer(seed=1)
+    with server.running():
+        yield server
+
+class TestBoundedReads:
+    """Test the byte cap and incremental decoding"""
+
+    def test_large_body_is_cut_off(self, files):
+        """Test that a 200 MB body costs no more than the cap"""
+        fetcher = HTTPFetcher(max_bytes=100_000)
+        result = asyncio.run(fetcher.fetch(f"{files.base_url}/files/200000000"))
+        assert result.truncated
+        assert result.bytes_read == 100_000
+        # The server could not push much past the cap before the connection closed
+        assert files.file_bytes_sent < 20_000_000
+        assert result.text.startswith(FILE_PATTERN.decode("utf-8"))
+
+    def test_multibyte_characters_across_chunks(self, files):
+        """Test that characters split between chunks are decoded intact"""
+        fetcher = HTTPFetcher(max_bytes=1_000_000, chunk_size=7)
+        size = len(FILE_PATTERN) * 100
+        result = asyncio.run(fetcher.fetch(f"{files.base_url}/files/{size}"))
+        assert not result.truncated
+        assert result.text == FILE_PATTERN.decode("utf-8") * 100
+
+class TestConditionalCache:
+    """Test ETag and Last-Modified revalidation"""
+
+    def test_revalidation_returns_cached_body(self, files):
+        """Test that a repeat fetch is answered by a 304"""
+        async def run():
+            fetcher = HTTPFetcher()
+            first = await fetcher.fetch(f"{files.base_url}/files/1000")
+            sent = files.file_bytes_sent
+            second = await fetcher.fetch(f"{files.base_url}/files/1000")
+            return fetcher, first, second, sent
+
+        fetcher, first, second, sent = asyncio.run(run())
+        assert not first.from_cache and second.from_cache
+        assert second.text == first.text
+        assert files.file_bytes_sent == sent
+        assert files.requests["files"] == 2
+        assert fetcher.stats()["revalidated"] == 1
+
+    def test_last_modified_only(self, files):
+        """Test revalidation with If-Modified-Since when there is no ETag"""
+        async def run():
+            fetcher = HTTPFetcher()
+            url = f"{files.base_url}/files/500"
+            await fetcher.fetch(url)
+            fetcher._cache[url].etag = None
+            return await fetcher.fetch(url)
+
+        assert asyncio.run(run()).from_cache
+
+    def test_lru_is_bounded(self, files):
+        """Test that the least recently used response is evicted"""
+        async def run():
+            fetcher = HTTPFetcher(cache_entries=2)
+            for size in (100, 200, 100, 300):
+                await fetcher.fetch(f"{files.base_url}/files/{size}")
+            return fetcher
+
+        fetcher = asyncio.run(run())
+        assert list(fetcher._cache) == [f"{files.base_url}/files/{size}" for size in (100, 300)]
+        assert fetcher.stats()["evictions"] == 1
+
+class TestHTTPTool:
+    """Test the simulated MCP http_get tool on top of the fetcher"""
+
+    def test_http_get_tool(self, files):
+        """Test the tool reports a capped, preview-sized result"""
+        manager = MCPManager(idle_timeout=0, health_interval=0, http_max_bytes=4096)
+        result = asyncio.run(manager.execute_tool("http", "http_get", {"url": f"{files.base_url}/files/10000000"}))
+        assert result["success"] and result["truncated"]
+        assert result["bytes_read"] == 4096
+        assert len(result["content"]) == 503
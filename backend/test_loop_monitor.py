@@ -0,0 +1,91 @@
+"""
+Test suite for the event loop monitor
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import main
+from loop_monitor import LoopBlockedError, LoopMonitor, LoopMonitorMiddleware
+from metrics import Histogram
+
+def block_the_loop(seconds: float):
+    time.sleep(seconds)
+
+def monitored_app(monitor: LoopMonitor) -> FastAPI:
+    @asynccontextmanager
+    async def lifespan(app):
+        monitor.start()
+        yield
+        await monitor.stop()
+
+    app = FastAPI(lifespan=lifespan)
+    app.add_middleware(LoopMonitorMiddleware, monitor=monitor)
+
+    @app.get("/blocking/{name}")
+    async def blocking(name: str):
+        block_the_loop(0.2)
+        return {"name": name}
+
+    @app.get("/cooperative")
+    async def cooperative():
+        await asyncio.sleep(0.2)
+        return {"ok": True}
+
+    return app
+
+class TestLoopMonitor:
+    """Test lag measurement and stall capture"""
+
+    def test_lag_and_stall_stack(self):
+        """Test that a blocking call is measured as lag and captured with its stack"""
+        histogram = Histogram("lag", "Lag", buckets=(0.01, 0.1, 1.0))
+
+        async def run():
+            monitor = LoopMonitor(interval=0.01, threshold=0.05, lag_histogram=histogram)
+            monitor.start()
+            await asyncio.sleep(0.03)
+
+            async def handler():
+                block_the_loop(0.15)
+
+            await asyncio.create_task(handler(), name="slow-handler")
+            await asyncio.sleep(0.03)
+            smoothed = monitor.lag
+            await monitor.stop()
+            return monitor, smoothed
+
+        monitor, smoothed = asyncio.run(run())
+        assert monitor.stall_count == 1
+        stall = monitor.stalls[0]
+        assert stall.route == "task slow-handler"
+        assert "block_the_loop" in stall.stack and "time.sleep(seconds)" in stall.stack
+        assert monitor.max_lag >= 0.1
+        # The stall still weighs on the smoothed lag a few ticks later, which a stopped monitor clears
+        assert 0 < smoothed < monitor.max_lag and monitor.lag == 0.0
+        assert histogram.count() > 3
+        monitor.check()
+
+    def test_test_mode_fails_blocking_handlers(self):
+        """Test that in test mode a handler blocking past the limit fails with its route and stack"""
+        monitor = LoopMonitor(interval=0.01, fail_after=0.05)
+        with TestClient(monitored_app(monitor)) as client:
+            assert client.get("/cooperative").json() == {"ok": True}
+            with pytest.raises(LoopBlockedError, match=r"GET /blocking/\{name\} blocked the event loop") as error:
+                client.get("/blocking/x")
+        assert "block_the_loop" in str(error.value)
+
+    def test_app_handlers_do_not_block(self, monkeypatch):
+        """Test that code execution keeps the loop free while the interpreter runs"""
+        monkeypatch.setattr(main.loop_monitor, "fail_after", 0.1)
+        monkeypatch.setattr(main.loop_monitor, "threshold", 0.1)
+        with TestClient(main.app) as client:
+            response = client.post("/tools/execute", json={
+                "tool": "code_execute", "params": {"code": "import time\ntime.sleep(0.3)\nprint('done')"}
+            })
+            stats = client.get("/stats").json()["event_loop"]
+        assert response.json()["result"] == "Code executed successfully:\ndone\n"
+        assert stats["stalls"] == 0
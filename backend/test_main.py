@@ -336,5 +336,20 @@ class TestSecurity:
         
         assert response.status_code == 200  # Should handle gracefully
 
+class TestStats:
+    """Test runtime statistics endpoint"""
+    
+    def setup_method(self):
+        """Setup test client for each test method"""
+        self.client = TestClient(app)
+    
+    def test_search_cache_stats(self):
+        """Test that search cache metrics are exposed"""
+        response = self.client.get("/stats")
+        assert response.status_code == 200
+        data = response.json()
+        assert "hit_ratio" in data["search_cache"]
+        assert "upstream_latency_saved_seconds" in data["search_cache"]
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"]) 
\ No newline at end of file
@@ -0,0 +1,343 @@
+"""
+Test suite for pooled MCP client sessions
+"""
+
+import asyncio
+import json
+import sys
+import textwrap
+import time
+import pytest
+from aiohttp import web
+from mcp_client import MCPError, MCPPool
+from mcp_integration import MCPManager, MCPServer
+
+STDIO_SERVER = textwrap.dedent('''
+    import json, sys
+
+    def answer(message, batch_size):
+        method = message["method"]
+        if method == "initialize":
+            result = {"protocolVersion": "2025-03-26", "capabilities": {"tools": {}}, "serverInfo": {"name": "echo"}}
+        elif method == "tools/call":
+            arguments = dict(message["params"]["arguments"], **({"batch": batch_size} if batch_size else {}))
+            text = json.dumps(arguments, sort_keys=True)
+            result = {"content": [{"type": "text", "text": text}], "isError": message["params"]["name"] == "fail"}
+        else:
+            result = {}
+        return {"jsonrpc": "2.0", "id": message["id"], "result": result}
+
+    for line in sys.stdin:
+        payload = json.loads(line)
+        if isinstance(payload, list):
+            print(json.dumps([answer(m, len(payload)) for m in payload if "id" in m]), flush=True)
+        elif "id" in payload:
+            print(json.dumps(answer(payload, 0)), flush=True)
+''')
+
+@pytest.fixture
+def stdio_server(tmp_path):
+    """Command line of a minimal stdio MCP server"""
+    script = tmp_path / "echo_server.py"
+    script.write_text(STDIO_SERVER)
+    return [sys.executable, str(script)]
+
+def make_manager(**servers) -> MCPManager:
+    manager = MCPManager(idle_timeout=0, health_interval=0)
+    for name, (url, command) in servers.items():
+        manager.servers[name] = MCPServer(name, url, [], name, command)
+    return manager
+
+async def start_http_server(stream: bool, latency: float = 0.0, protocol_version: str = "2025-03-26"):
+    """Streamable HTTP MCP server answering with JSON or server-sent events"""
+    sessions = []
+
+    async def answer(message):
+        if message["method"] == "tools/call":
+            await asyncio.sleep(latency)
+            result = {"content": [{"type": "text", "text": f"fetched {message['params']['arguments']['url']}"}]}
+        else:
+            result = {"protocolVersion": protocol_version, "capabilities": {}, "serverInfo": {"name": "http"}}
+        return {"jsonrpc": "2.0", "id": message["id"], "result": result}
+
+    async def handle(request: web.Request) -> web.StreamResponse:
+        message = await request.json()
+        sessions.append(request.headers.get("Mcp-Session-Id"))
+        if isinstance(message, list):
+            return web.json_response(await asyncio.gather(*[answer(m) for m in message if "id" in m]))
+        if "id" not in message:
+            return web.Response(status=202)
+        reply = await answer(message)
+        headers = {"Mcp-Session-Id": "abc"}
+        if not stream:
+            return web.json_response(reply, headers=headers)
+        response = web.StreamResponse(headers=dict(headers, **{"Content-Type": "text/event-stream"}))
+        await response.prepare(request)
+        await response.write(f"event: message\ndata: {json.dumps(reply)}\n\n".encode())
+        return response
+
+    app = web.Application()
+    app.router.add_post("/mcp", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/mcp", sessions
+
+class TestTransports:
+    """Test tool calls over real transports"""
+
+    def test_stdio_session_is_reused(self, stdio_server):
+        """Test that repeated calls share one warm subprocess session"""
+        async def run():
+            manager = make_manager(echo=("stdio://echo", stdio_server))
+            first = await manager.execute_tool("echo", "say", {"text": "hi"})
+            process = manager.pool.sessions["echo"].transport.process
+            second = await manager.execute_tool("echo", "fail", {"text": "boom"})
+            assert manager.pool.sessions["echo"].transport.process is process
+            stats = manager.stats()
+            await manager.pool.stop()
+            return first, second, stats
+
+        first, second, stats = asyncio.run(run())
+        assert first == {"success": True, "data": '{"text": "hi"}', "content": [{"type": "text", "text": '{"text": "hi"}'}]}
+        assert second == {"error": '{"text": "boom"}'}
+        assert stats["connects"] == 1 and stats["reuses"] == 1
+
+    @pytest.mark.parametrize("stream", [False, True])
+    def test_http_session(self, stream):
+        """Test JSON and event-stream answers and that the session id is echoed"""
+        async def run():
+            runner, url, sessions = await start_http_server(stream)
+            manager = make_manager(web=(url, None))
+            try:
+                result = await manager.execute_tool("web", "http_get", {"url": "https://example.com"})
+                await manager.execute_tool("web", "http_get", {"url": "https://example.org"})
+            finally:
+                await manager.pool.stop()
+                await runner.cleanup()
+            return result, sessions
+
+        result, sessions = asyncio.run(run())
+        assert result["data"] == "fetched https://example.com"
+        assert sessions == [None, "abc", "abc", "abc"]
+
+    def test_simulated_fallback(self):
+        """Test that mcp:// servers are still answered in-process"""
+        async def run():
+            manager = MCPManager(idle_timeout=0, health_interval=0)
+            result = await manager.execute_tool("git", "git_status", {})
+            return result, manager.get_available_servers()
+
+        result, servers = asyncio.run(run())
+        assert result["status"] == "clean"
+        assert [s["connected"] for s in servers] == [False, True, False, False]
+
+class TestExecuteMany:
+    """Test batched and pipelined execution"""
+
+    def test_same_server_calls_are_batched(self, stdio_server):
+        """Test that calls to one batching server go out as one JSON-RPC batch"""
+        async def run():
+            manager = make_manager(echo=("stdio://echo", stdio_server))
+            results = await manager.execute_many([
+                ("echo", "say", {"n": 1}), ("git", "git_status", {}), ("echo", "fail", {"n": 2}),
+                ("echo", "say", {"n": 3}), ("missing", "x", {}),
+            ])
+            await manager.pool.stop()
+            return results
+
+        results = asyncio.run(run())
+        assert results[0]["data"] == '{"batch": 3, "n": 1}'
+        assert results[1]["status"] == "clean"
+        assert results[2] == {"error": '{"batch": 3, "n": 2}'}
+        assert results[3]["data"] == '{"batch": 3, "n": 3}'
+        assert results[4] == {"error": "Unknown server: missing"}
+
+    @pytest.mark.parametrize("protocol_version", ["2025-03-26", "2025-06-18"])
+    def test_calls_overlap_across_and_within_servers(self, protocol_version):
+        """Test that batches or pipelined requests beat sequential round trips"""
+        async def run():
+            servers = [await start_http_server(False, 0.2, protocol_version) for _ in range(2)]
+            manager = make_manager(a=(servers[0][1], None), b=(servers[1][1], None))
+            calls = [(name, "http_get", {"url": f"https://{name}{i}"}) for name in "ab" for i in range(3)]
+            try:
+                await manager.connect_to_server("a")
+                await manager.connect_to_server("b")
+                started = time.perf_counter()
+                results = await manager.execute_many(calls)
+                elapsed = time.perf_counter() - started
+            finally:
+                await manager.pool.stop()
+                for runner, _, _ in servers:
+                    await runner.cleanup()
+            return results, elapsed, servers[0][2]
+
+        results, elapsed, requests = asyncio.run(run())
+        assert [r["data"] for r in results] == [f"fetched https://{n}{i}" for n in "ab" for i in range(3)]
+        # Six sequential calls would take 1.2s
+        assert elapsed < 0.6
+        # initialize, initialized, then either one batch or three pipelined calls
+        assert len(requests) == (3 if protocol_version == "2025-03-26" else 5)
+
+class TestPool:
+    """Test pool limits, eviction, health checks and backoff"""
+
+    def test_size_limit_evicts_least_recently_used(self):
+        """Test that connecting past the limit closes the oldest session"""
+        async def run():
+            manager = MCPManager(max_sessions=2, idle_timeout=0, health_interval=0)
+            for name in ("filesystem", "git", "filesystem", "http"):
+                await manager.connect_to_server(name)
+            return manager
+
+        manager = asyncio.run(run())
+        assert set(manager.active_connections) == {"filesystem", "http"}
+        assert manager.stats()["evictions"] == 1
+
+    def test_idle_sessions_are_evicted(self, stdio_server):
+        """Test that last_used drives idle eviction and closes the process"""
+        async def run():
+            manager = make_manager(echo=("stdio://echo", stdio_server))
+            await manager.execute_tool("echo", "say", {})
+            process = manager.pool.sessions["echo"].transport.process
+            await manager.connect_to_server("git")
+            await asyncio.sleep(0.1)
+            await manager.connect_to_server("git")
+            manager.pool.idle_timeout = 0.05
+            evicted = await manager.pool.evict_idle()
+            sessions = set(manager.pool.sessions)
+            await manager.pool.stop()
+            return evicted, sessions, process
+
+        evicted, sessions, process = asyncio.run(run())
+        assert evicted == 1
+        assert sessions == {"git"}
+        assert process.returncode is not None
+
+    def test_health_check_reconnects_with_backoff(self, stdio_server):
+        """Test that a dead server is replaced by a new session in the background"""
+        async def run():
+            manager = make_manager(echo=("stdio://echo", stdio_server))
+            manager.pool.backoff_base = 0.01
+            await manager.connect_to_server("echo")
+            old = manager.pool.sessions["echo"]
+            old.transport.process.kill()
+            await old.transport.process.wait()
+            failed = await manager.pool.check_health()
+            for _ in range(200):
+                if "echo" in manager.pool.sessions:
+                    break
+                await asyncio.sleep(0.01)
+            new = manager.pool.sessions["echo"]
+            result = await manager.execute_tool("echo", "say", {"n": 1})
+            await manager.pool.stop()
+            return failed, old, new, result
+
+        failed, old, new, result = asyncio.run(run())
+        assert failed == 1
+        assert new is not old
+        assert result["success"]
+
+    def test_failed_connects_back_off(self):
+        """Test that a failing server is not retried before its backoff expires"""
+        attempts = []
+
+        async def factory(server_name):
+            attempts.append(time.monotonic())
+            raise ConnectionRefusedError("nobody home")
+
+        async def run():
+            pool = MCPPool(factory, idle_timeout=0, health_interval=0, backoff_base=0.05)
+            with pytest.raises(MCPError, match="Could not connect"):
+                await pool.acquire("down")
+            with pytest.raises(MCPError, match="backing off"):
+                await pool.acquire("down")
+            await asyncio.sleep(0.06)
+            with pytest.raises(MCPError, match="Could not connect"):
+                await pool.acquire("down")
+            return pool._backoff("down")
+
+        assert asyncio.run(run()) == 0.1
+        assert len(attempts) == 2
+
+CHANGING_SERVER = textwrap.dedent('''
+    import json, sys
+
+    tools = ["lookup"]
+    for line in sys.stdin:
+        message = json.loads(line)
+        if "id" not in message:
+            continue
+        method = message["method"]
+        if method == "initialize":
+            result = {"protocolVersion": "2025-03-26", "capabilities": {"tools": {"listChanged": True}}}
+        elif method == "tools/list":
+            result = {"tools": [{"name": name} for name in tools]}
+        elif method == "tools/call":
+            tools.append(message["params"]["arguments"]["name"])
+            print(json.dumps({"jsonrpc": "2.0", "method": "notifications/tools/list_changed"}), flush=True)
+            result = {"content": [{"type": "text", "text": "added"}]}
+        else:
+            result = {}
+        print(json.dumps({"jsonrpc": "2.0", "id": message["id"], "result": result}), flush=True)
+''')
+
+class TestCapabilityRegistry:
+    """Test config-driven servers and the cached tool index"""
+
+    def test_servers_load_from_config_without_connecting(self, tmp_path, stdio_server):
+        """Test that configured servers are registered and indexed but not started"""
+        config = tmp_path / "mcp.json"
+        config.write_text(json.dumps({"mcpServers": {
+            "echo": {"command": stdio_server[0], "args": stdio_server[1:], "capabilities": ["say"]},
+            "remote": {"url": "https://mcp.example.com/mcp", "capabilities": ["say", "search"]},
+        }}))
+        manager = MCPManager(idle_timeout=0, health_interval=0, config_path=str(config))
+        assert manager.servers["echo"].command == stdio_server
+        assert manager.server_for("say") == "echo"
+        assert manager.server_for("search") == "remote"
+        assert manager.server_for("file_read") is None
+        assert manager.pool.sessions == {} and manager.pool.connects == 0
+
+    def test_tool_list_is_cached_until_changed(self, tmp_path):
+        """Test that tools/list is fetched once per TTL and again after list_changed"""
+        script = tmp_path / "changing_server.py"
+        script.write_text(CHANGING_SERVER)
+
+        async def run():
+            manager = make_manager(dynamic=("stdio://dynamic", [sys.executable, str(script)]))
+            manager.tools_ttl = 60
+            first = await manager.list_tools("dynamic")
+            await manager.list_tools("dynamic")
+            cached_fetches = manager.tool_list_fetches
+            await manager.execute_tool("dynamic", "add", {"name": "translate"})
+            # The notification is read before the reply it precedes
+            invalidated = "dynamic" not in manager._tools
+            second = await manager.list_tools("dynamic")
+            await manager.pool.stop()
+            return manager, first, second, cached_fetches, invalidated
+
+        manager, first, second, cached_fetches, invalidated = asyncio.run(run())
+        assert [tool["name"] for tool in first] == ["lookup"]
+        assert cached_fetches == 1
+        assert invalidated
+        assert [tool["name"] for tool in second] == ["lookup", "translate"]
+        assert manager.server_for("translate") == "dynamic"
+        assert manager.get_server_capabilities("dynamic") == ["lookup", "translate"]
+
+    def test_responses_route_through_the_index(self, monkeypatch):
+        """Test that chat commands reach whichever server the index names"""
+        from mcp_integration import get_mcp_response
+        import mcp_integration
+
+        manager = MCPManager(idle_timeout=0, health_interval=0)
+        manager.servers["vcs"] = manager.servers.pop("git")
+        manager.servers["vcs"].name = "vcs"
+        manager._reindex()
+        monkeypatch.setattr(mcp_integration, "mcp_manager", manager)
+
+        response = asyncio.run(get_mcp_response("git status please"))
+        assert response.startswith("✅ MCP vcs result:")
+        assert manager.pool.stats()["sessions"] == 1
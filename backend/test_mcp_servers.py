@@ -0,0 +1,200 @@
+"""
+Test suite for the reference MCP filesystem and git servers
+"""
+
+import asyncio
+import os
+import subprocess
+import pytest
+from aiohttp import web
+from mcp_integration import MCPManager, MCPServer
+from mcp_servers import FilesystemServer, GitServer
+
+def call(server, name, **arguments):
+    message = {"jsonrpc": "2.0", "id": 1, "method": "tools/call", "params": {"name": name, "arguments": arguments}}
+    return asyncio.run(server.handle(message))["result"]
+
+class TestFilesystemServer:
+    """Test ranged reads and paginated listings"""
+
+    def test_ranged_read_of_huge_file(self, tmp_path):
+        """Test reading a few bytes near the end of a sparse 4 GiB file"""
+        path = tmp_path / "huge.bin"
+        with open(path, "wb") as f:
+            f.truncate(4 * 1024 ** 3)
+            f.seek(4 * 1024 ** 3 - 5)
+            f.write(b"tail!")
+        result = call(FilesystemServer(str(tmp_path)), "file_read", path="huge.bin", offset=4 * 1024 ** 3 - 5, length=100)
+        assert result["content"][0]["text"] == "tail!"
+        assert result["structuredContent"]["size"] == 4 * 1024 ** 3
+        assert result["structuredContent"]["next_offset"] is None
+
+    def test_read_is_capped(self, tmp_path):
+        """Test that one call never returns more than the read limit"""
+        (tmp_path / "big.txt").write_bytes(b"x" * 5000)
+        (tmp_path / "empty.txt").write_bytes(b"")
+        server = FilesystemServer(str(tmp_path), max_read=1024)
+        result = call(server, "file_read", path="big.txt")
+        assert result["structuredContent"]["length"] == 1024
+        assert result["structuredContent"]["next_offset"] == 1024
+        assert call(server, "file_read", path="empty.txt")["content"][0]["text"] == ""
+
+    def test_paths_outside_root_are_refused(self, tmp_path):
+        """Test that traversal out of the root is an error"""
+        result = call(FilesystemServer(str(tmp_path)), "file_read", path="../../etc/passwd")
+        assert result["isError"]
+        assert "escapes" in result["content"][0]["text"]
+
+    def test_bad_arguments_are_tool_errors(self, tmp_path):
+        """Test that arguments of the wrong type get an error result instead of escaping the handler"""
+        (tmp_path / "a.txt").write_text("x")
+        server = FilesystemServer(str(tmp_path))
+        for name, arguments in [
+            ("file_list", {"limit": "ten"}),
+            ("file_list", {"cursor": 3}),
+            ("file_read", {"path": "a.txt", "offset": None}),
+            ("file_read", {"path": ["a.txt"]}),
+        ]:
+            result = call(server, name, **arguments)
+            assert result["isError"] and "must be" in result["content"][0]["text"]
+        assert call(server, "file_list", limit="1")["structuredContent"]["files"][0]["name"] == "a.txt"
+
+    def test_listing_pages(self, tmp_path):
+        """Test that cursors walk a large directory exactly once"""
+        for index in range(250):
+            (tmp_path / f"f{index}.txt").write_text("x")
+        (tmp_path / "sub").mkdir()
+        server = FilesystemServer(str(tmp_path), page_size=100)
+        names, cursor, pages = [], None, 0
+        while True:
+            page = call(server, "file_list", path=".", cursor=cursor)["structuredContent"]
+            names += [entry["name"] for entry in page["files"]]
+            pages += 1
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        assert pages == 3
+        assert names == sorted([f"f{index}.txt" for index in range(250)] + ["sub/"])
+
+    def test_listing_cursor_is_a_name(self, tmp_path, monkeypatch):
+        """Test that later pages reuse the cached scan and survive entries added before the cursor"""
+        for name in ("a", "b", "c", "d"):
+            (tmp_path / name).write_text("x")
+        server = FilesystemServer(str(tmp_path), page_size=2)
+        first = call(server, "file_list", path=".")["structuredContent"]
+        assert [entry["name"] for entry in first["files"]] == ["a", "b"] and first["next_cursor"] == "b"
+
+        scans = []
+        real_scandir = os.scandir
+        monkeypatch.setattr(os, "scandir", lambda path: scans.append(path) or real_scandir(path))
+        second = call(server, "file_list", path=".", cursor="b")["structuredContent"]
+        assert [entry["name"] for entry in second["files"]] == ["c", "d"] and second["next_cursor"] is None
+        assert scans == []
+
+        # A new entry sorting before the cursor neither shifts the page nor repeats one
+        (tmp_path / "0").write_text("x")
+        again = call(server, "file_list", path=".", cursor="b")["structuredContent"]
+        assert [entry["name"] for entry in again["files"]] == ["c", "d"] and len(scans) == 1
+
+@pytest.fixture
+def repo(tmp_path):
+    """A git repository with one committed and one untracked file"""
+    def git(*args):
+        subprocess.run(["git", "-C", str(tmp_path), *args], check=True, capture_output=True)
+
+    git("init", "-q", "-b", "main")
+    (tmp_path / "tracked.txt").write_text("one")
+    git("add", "tracked.txt")
+    git("-c", "user.email=dev@example.com", "-c", "user.name=dev", "commit", "-q", "-m", "init")
+    (tmp_path / "new.txt").write_text("new")
+    return tmp_path, git
+
+class TestGitServer:
+    """Test git status and its index-keyed cache"""
+
+    def test_status_is_cached_until_index_changes(self, repo):
+        """Test that repeat calls reuse one git run and staging invalidates it"""
+        path, git = repo
+        server = GitServer(str(path), max_age=60)
+
+        async def run():
+            first = await server.handle({"jsonrpc": "2.0", "id": 1, "method": "tools/call", "params": {"name": "git_status"}})
+            second = await asyncio.gather(*[server.git_status({}) for _ in range(5)])
+            runs_before = server.runs
+            git("add", "new.txt")
+            # Make sure the index mtime moves on filesystems with coarse timestamps
+            os.utime(path / ".git" / "index", ns=(1, 1))
+            third = await server.git_status({})
+            return first["result"], second, runs_before, third
+
+        first, second, runs_before, third = asyncio.run(run())
+        assert first["structuredContent"]["branch"] == "main"
+        assert first["structuredContent"]["changes"] == [{"status": "??", "path": "new.txt"}]
+        assert all(result == first for result in second)
+        assert runs_before == 1
+        assert third["structuredContent"]["changes"] == [{"status": "A", "path": "new.txt"}]
+        assert server.runs == 2
+
+    def test_cancelled_caller_does_not_cancel_the_git_run(self, repo):
+        """Test that the first caller going away leaves the shared run to finish for the others"""
+        path, _ = repo
+        server = GitServer(str(path), max_age=60)
+
+        async def run():
+            first = asyncio.ensure_future(server.git_status({}))
+            await asyncio.sleep(0)
+            while server._refresh is None:
+                await asyncio.sleep(0.001)
+            second = asyncio.ensure_future(server.git_status({}))
+            await asyncio.sleep(0)
+            first.cancel()
+            result = await second
+            return first.cancelled(), result, server._cache is not None
+
+        cancelled, result, cached = asyncio.run(run())
+        assert cancelled and cached
+        assert result["structuredContent"]["branch"] == "main"
+        assert server.runs == 1
+
+class TestReferenceServersThroughManager:
+    """Test the reference servers behind MCPManager"""
+
+    def test_stdio_servers(self, repo):
+        """Test file and git tools over stdio sessions, in one execute_many"""
+        path, _ = repo
+
+        async def run():
+            manager = MCPManager(idle_timeout=0, health_interval=0, reference_root=str(path))
+            try:
+                return await manager.execute_many([
+                    ("filesystem", "file_read", {"path": "tracked.txt"}),
+                    ("filesystem", "file_list", {"path": "."}),
+                    ("git", "git_status", {}),
+                ])
+            finally:
+                await manager.pool.stop()
+
+        read, listing, status = asyncio.run(run())
+        assert read["data"] == "one"
+        assert {"tracked.txt", "new.txt", ".git/"} <= set(listing["data"].split("\n"))
+        assert status["structured"]["status"] == "dirty"
+
+    def test_http_server(self, tmp_path):
+        """Test the streamable HTTP endpoint"""
+        (tmp_path / "hello.txt").write_text("hello over http")
+
+        async def run():
+            runner = web.AppRunner(FilesystemServer(str(tmp_path)).http_app())
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/mcp"
+            manager = MCPManager(idle_timeout=0, health_interval=0)
+            manager.servers["files"] = MCPServer("files", url, ["file_read"], "files")
+            try:
+                return await manager.execute_tool("files", "file_read", {"path": "hello.txt", "offset": 6})
+            finally:
+                await manager.pool.stop()
+                await runner.cleanup()
+
+        assert asyncio.run(run())["data"] == "over http"
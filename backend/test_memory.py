@@ -0,0 +1,135 @@
+"""
+Test suite for memory accounting and tracemalloc snapshots
+"""
+
+import asyncio
+import sys
+import pytest
+from fastapi.testclient import TestClient
+import main
+from main import app
+from generations import GenerationRegistry
+from memory import MemoryAccountant, SnapshotNotFoundError, SnapshotStore, deep_sizeof, sampled_sizeof
+from message_store import MessageStore
+from search_cache import SearchCache
+
+def make_message(message_id: int, session_id: str = "s1") -> dict:
+    return {
+        "id": message_id,
+        "sender": "user",
+        "text": f"message number {message_id} " * 4,
+        "timestamp": "2025-07-20T08:00:00",
+        "session_id": session_id,
+    }
+
+class TestSizing:
+    """Test the size estimates"""
+
+    def test_deep_sizeof_counts_shared_objects_once(self):
+        """Test that nested containers are followed and shared objects counted once"""
+        text = "x" * 1000
+        assert deep_sizeof([text, text]) == sys.getsizeof([text, text]) + sys.getsizeof(text)
+        assert deep_sizeof({"a": [text]}) > sys.getsizeof(text)
+
+    def test_sampled_estimate_is_close(self):
+        """Test that a sampled estimate of uniform items stays close to the exact size"""
+        items = [make_message(i) for i in range(5000)]
+        exact = deep_sizeof(items) - sys.getsizeof(items)
+        estimate = sampled_sizeof(items, len(items))
+        assert abs(estimate - exact) / exact < 0.1
+
+    def test_subsystems_grow_with_content(self):
+        """Test that the message store, search cache and generations report more bytes as they fill"""
+        store = MessageStore()
+        empty = store.memory_usage()
+        for i in range(1, 501):
+            store.add(make_message(i, f"s{i % 7}"))
+        assert store.memory_usage() - empty > 500 * len(make_message(1)["text"])
+
+        cache = SearchCache(max_entries=100)
+        before = cache.memory_usage()
+        asyncio.run(cache.store("python", {"results": ["x" * 2000]}))
+        assert cache.memory_usage() - before > 2000
+
+        async def produce():
+            registry = GenerationRegistry()
+
+            async def chunks():
+                for i in range(10):
+                    yield f"{i:<500}"
+
+            generation = registry.start("s1", chunks())
+            await generation.wait()
+            return registry.memory_usage()
+
+        assert asyncio.run(produce()) > 10 * 500
+
+    def test_report_survives_failing_estimates(self):
+        """Test that one failing estimate is reported as unknown without hiding the others"""
+        accountant = MemoryAccountant()
+        accountant.register("fine", lambda: 1234)
+        accountant.register("broken", lambda: 1 / 0)
+        report = accountant.report()
+        assert report["subsystems"] == {"fine": 1234, "broken": None}
+        assert report["accounted_bytes"] == 1234
+        assert report["rss_bytes"] > 0
+
+class TestSnapshots:
+    """Test tracemalloc snapshots and their diffs"""
+
+    def test_diff_points_at_the_allocation_site(self):
+        """Test that a diff ranks the line that allocated the most first"""
+        snapshots = SnapshotStore(frames=1, max_snapshots=3)
+        try:
+            first = snapshots.take("before")["id"]
+            retained = [bytearray(1024) for _ in range(2000)]
+            second = snapshots.take("after")["id"]
+            sites = snapshots.diff(first, second, limit=5)
+            assert sites[0]["site"][0].startswith(__file__)
+            assert sites[0]["size_diff"] >= 2000 * 1024
+            assert sites[0]["count_diff"] >= 2000
+            del retained
+        finally:
+            snapshots.clear()
+
+    def test_old_snapshots_are_dropped(self):
+        """Test that only the newest snapshots are kept"""
+        snapshots = SnapshotStore(frames=1, max_snapshots=2)
+        try:
+            ids = [snapshots.take()["id"] for _ in range(3)]
+            assert [s["id"] for s in snapshots.list()] == ids[1:]
+            with pytest.raises(SnapshotNotFoundError):
+                snapshots.diff(ids[0], ids[2])
+            with pytest.raises(ValueError):
+                snapshots.diff(ids[1], ids[2], group_by="module")
+        finally:
+            snapshots.clear()
+        assert snapshots.stats()["tracing"] is False
+
+    def test_endpoints_are_guarded(self, monkeypatch):
+        """Test that the memory endpoints need the debug token and diff snapshots"""
+        with TestClient(app) as client:
+            monkeypatch.setattr(main, "DEBUG_TOKEN", None)
+            assert client.get("/debug/memory").status_code == 404
+            assert client.post("/debug/memory/snapshots").status_code == 404
+            monkeypatch.setattr(main, "DEBUG_TOKEN", "secret")
+            assert client.get("/debug/memory", headers={"X-Debug-Token": "wrong"}).status_code == 403
+
+            headers = {"X-Debug-Token": "secret"}
+            client.post("/chat/send", json={"sender": "user", "text": "hello", "session_id": "memory"})
+            report = client.get("/debug/memory", headers=headers).json()
+            assert set(report["subsystems"]) >= {
+                "message_store", "connection_registry", "search_cache", "in_flight_streams", "trace_buffer",
+            }
+            assert report["subsystems"]["message_store"] > 0
+            try:
+                first = client.post("/debug/memory/snapshots?label=start", headers=headers).json()
+                assert first["label"] == "start" and first["traced_bytes"] >= 0
+                for i in range(20):
+                    client.post("/chat/send", json={"sender": "user", "text": "x" * 1000, "session_id": "memory"})
+                diff = client.get(f"/debug/memory/diff?first={first['id']}", headers=headers).json()
+                assert diff["second"] > first["id"] and diff["sites"]
+                assert client.get("/debug/memory/diff?first=9999", headers=headers).status_code == 404
+                assert len(client.get("/debug/memory/snapshots", headers=headers).json()["snapshots"]) == 2
+            finally:
+                assert client.delete("/debug/memory/snapshots", headers=headers).json()["snapshots"] == 0
@@ -0,0 +1,124 @@
+"""
+Test suite for Prometheus metrics
+"""
+
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+import main
+from main import app
+from metrics import Histogram, MetricsRegistry, TokenStreamTimer
+from test_stand_ins import stand_in  # noqa: F401
+
+def sample(text: str, line_start: str) -> float:
+    """Value of the first exposition line starting with ``line_start``"""
+    for line in text.splitlines():
+        if line.startswith(line_start):
+            return float(line.rsplit(" ", 1)[1])
+    raise AssertionError(f"No sample {line_start}")
+
+class TestRegistry:
+    """Test metric families and the exposition format"""
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Test that observations land in inclusive buckets and render cumulatively"""
+        registry = MetricsRegistry(prefix="t_")
+        histogram = registry.histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value, "/a")
+        text = registry.render()
+        assert "# TYPE t_latency_seconds histogram" in text
+        assert 't_latency_seconds_bucket{route="/a",le="0.1"} 2' in text
+        assert 't_latency_seconds_bucket{route="/a",le="1.0"} 3' in text
+        assert 't_latency_seconds_bucket{route="/a",le="+Inf"} 4' in text
+        assert 't_latency_seconds_count{route="/a"} 4' in text
+        assert sample(text, 't_latency_seconds_sum{route="/a"}') == pytest.approx(3.65)
+
+    def test_counters_gauges_and_escaping(self):
+        """Test counter labels are escaped and gauges are read at scrape time"""
+        registry = MetricsRegistry()
+        counter = registry.counter("calls_total", "Calls", ("name",))
+        counter.inc('say "hi"\\')
+        counter.inc('say "hi"\\', amount=2)
+        size = [1]
+        registry.gauge("size", "Size", lambda: size[0])
+        size[0] = 7
+        text = registry.render()
+        assert 'calls_total{name="say \\"hi\\"\\\\"} 3' in text
+        assert "size 7" in text
+        total = [3]
+        registry.counter_from("kept_total", "Kept elsewhere", lambda: total[0])
+        total[0] = 5
+        text = registry.render()
+        assert "# TYPE kept_total counter" in text and "kept_total 5" in text
+        registry.counter_from("refused_total", "Refused", lambda: {"per_ip": 2, "saturated": 1}, ("reason",))
+        text = registry.render()
+        assert 'refused_total{reason="per_ip"} 2' in text and 'refused_total{reason="saturated"} 1' in text
+        with pytest.raises(ValueError):
+            registry.counter("calls_total", "Again")
+
+    def test_timed_functions(self):
+        """Test the timing decorator on plain and coroutine functions"""
+        histogram = Histogram("tool_seconds", "Tools", ("tool",))
+
+        @histogram.time("sync")
+        def plain():
+            return 1
+
+        @histogram.time("async")
+        async def coroutine():
+            raise RuntimeError("boom")
+
+        assert plain() == 1
+        with pytest.raises(RuntimeError):
+            asyncio.run(coroutine())
+        assert histogram.count("sync") == 1 and histogram.count("async") == 1
+
+    def test_token_stream_timer(self):
+        """Test that the rate excludes the wait for the first token"""
+        first_token = Histogram("ttft", "TTFT")
+        rate = Histogram("rate", "Rate", buckets=(10, 1000, 100000))
+        timer = TokenStreamTimer(first_token, rate)
+        timer.token()
+        timer.finish()
+        assert first_token.count() == 1 and rate.count() == 0
+        timer.token()
+        timer.token()
+        timer.finish()
+        assert rate.count() == 1
+
+class TestMetricsEndpoint:
+    """Test metrics recorded by the app"""
+
+    def test_routes_upstreams_and_tokens(self, stand_in):
+        """Test that a streamed completion shows up per route, per upstream and as token timings"""
+        stand_in.configs["openai"].reply = "one two three"
+        with TestClient(app) as client:
+            before = client.get("/metrics").text
+            client.post("/ai/stream", json={"message": "count for me", "session_id": "s1"})
+            client.get("/chat/history?session_id=s1")
+            client.get("/ai/stream/missing-generation?session_id=s1")
+            response = client.get("/metrics")
+
+        text = response.text
+        assert response.headers["content-type"] == "text/plain; version=0.0.4; charset=utf-8"
+        route = 'oasiz_http_requests_total{method="POST",route="/ai/stream",status="200"}'
+        assert sample(text, route) == sample(before + f"\n{route} 0", route) + 1
+        assert sample(text, 'oasiz_http_requests_total{method="GET",route="/ai/stream/{generation_id}",status="404"}') >= 1
+        assert 'route="/chat/history"' in text
+        assert "/metrics" not in text.split("# HELP oasiz_http_requests_total")[1].split("# HELP")[0]
+        assert sample(text, 'oasiz_upstream_responses_total{upstream="openai",status="200"}') >= 1
+        assert sample(text, "oasiz_openai_time_to_first_token_seconds_count") >= 1
+        assert "oasiz_websocket_connections 0" in text
+        assert sample(text, "oasiz_message_store_messages") == len(main.message_store)
+
+    def test_tool_latency(self, stand_in):
+        """Test that tool calls are timed per tool"""
+        before = main.tool_latency.count("weather")
+        with TestClient(app) as client:
+            client.post("/tools/execute", json={"tool": "weather", "params": {"location": "Paris"}})
+            text = client.get("/metrics").text
+        assert main.tool_latency.count("weather") == before + 1
+        assert sample(text, "oasiz_search_cache_hit_ratio") == main.search_cache.stats()["hit_ratio"]
+        assert sample(text, "oasiz_search_cache_misses_total") == main.search_cache.misses
+        assert sample(text, 'oasiz_upstream_responses_total{upstream="openweathermap",status="200"}') >= 1
@@ -0,0 +1,154 @@
+"""
+Test suite for rate limiting and load shedding
+"""
+
+import pytest
+from fastapi.testclient import TestClient
+import main
+from main import app
+from rate_limit import Limit, LoadShedder, RateLimitedError, RateLimiter
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+def make_limiter(clock: FakeClock, session: Limit = Limit(1, 10), client: Limit = Limit(10, 100), **kwargs) -> RateLimiter:
+    return RateLimiter({"session": session, "client": client}, {"llm": 5, "code": 3, "tool": 1}, clock=clock, **kwargs)
+
+class TestRateLimiter:
+    """Test the token buckets"""
+
+    def test_burst_then_refill(self):
+        """Test that a full bucket admits a burst, then refuses until enough tokens have refilled"""
+        clock = FakeClock()
+        limiter = make_limiter(clock)
+        limiter.acquire("llm", {"session": "s1"})
+        limiter.acquire("llm", {"session": "s1"})
+        with pytest.raises(RateLimitedError) as refused:
+            limiter.acquire("tool", {"session": "s1"})
+        assert refused.value.reason == "session"
+        assert refused.value.retry_after == pytest.approx(1.0)
+        assert refused.value.retry_after_header == "1"
+
+        clock.now += 3
+        limiter.acquire("code", {"session": "s1"})
+        with pytest.raises(RateLimitedError):
+            limiter.acquire("tool", {"session": "s1"})
+        # Other sessions have buckets of their own
+        limiter.acquire("llm", {"session": "s2"})
+        assert limiter.stats()["admitted"] == {"llm": 3, "code": 1, "tool": 0}
+        assert limiter.stats()["limited"] == {"session": 2, "client": 0}
+
+    def test_refused_work_takes_nothing(self):
+        """Test that work refused by one bucket leaves the others untouched"""
+        clock = FakeClock()
+        limiter = make_limiter(clock, client=Limit(1, 5))
+        limiter.acquire("llm", {"session": "s1", "client": "key:a"})
+        with pytest.raises(RateLimitedError) as refused:
+            limiter.acquire("llm", {"session": "s1", "client": "key:a"})
+        # The client bucket is the emptier one, so it sets the wait
+        assert refused.value.reason == "client" and refused.value.retry_after == pytest.approx(5.0)
+        clock.now += 5
+        limiter.acquire("llm", {"session": "s1", "client": "key:a"})
+
+    def test_disabled_scopes_and_missing_identities(self):
+        """Test that a zero rate switches a scope off and work without an identity is not charged to it"""
+        limiter = make_limiter(FakeClock(), session=Limit(0, 10))
+        for _ in range(50):
+            limiter.acquire("llm", {"session": "s1", "client": None})
+        assert limiter.stats()["buckets"] == 0
+        assert "session" not in limiter.stats()["limits"]
+
+    def test_least_recently_used_buckets_are_evicted(self):
+        """Test that only max_buckets buckets are kept, dropping the least recently used"""
+        limiter = make_limiter(FakeClock(), max_buckets=3)
+        for session in ("a", "b", "c", "a", "d"):
+            limiter.acquire("tool", {"session": session})
+        assert [identity for _, identity in limiter._buckets] == ["c", "a", "d"]
+        assert limiter.memory_usage() > 0
+
+class TestLoadShedder:
+    """Test shedding on loop lag and in-flight generations"""
+
+    def test_sheds_over_either_threshold(self):
+        """Test that work is refused while lag or in-flight generations are over their limits"""
+        lag, in_flight = [0.0], [0]
+        shedder = LoadShedder(lambda: lag[0], lambda: in_flight[0], max_loop_lag=0.25, max_in_flight=4)
+        shedder.check()
+        lag[0] = 0.3
+        with pytest.raises(RateLimitedError) as refused:
+            shedder.check()
+        assert refused.value.reason == "loop_lag"
+        lag[0], in_flight[0] = 0.0, 4
+        with pytest.raises(RateLimitedError) as refused:
+            shedder.check()
+        assert refused.value.reason == "in_flight"
+        assert shedder.stats()["shed"] == {"loop_lag": 1, "in_flight": 1}
+
+        disabled = LoadShedder(lambda: 10.0, lambda: 1000)
+        disabled.check()
+
+class TestEndpoints:
+    """Test that endpoints answer refused work with 429 and Retry-After"""
+
+    def test_http_and_websocket_turns_are_limited(self, monkeypatch):
+        """Test that tools, AI turns and WebSocket turns are charged and refused when out of tokens"""
+        limiter = RateLimiter(
+            {"session": Limit(0.01, 5), "client": Limit(0.01, 3)}, {"llm": 5, "code": 3, "tool": 1},
+        )
+        monkeypatch.setattr(main, "rate_limiter", limiter)
+        monkeypatch.setattr(main, "RATE_LIMIT_API_KEYS", ["first", "second", "third", "fourth"])
+        with TestClient(app) as client:
+            for _ in range(3):
+                assert client.post("/tools/execute", json={"tool": "time", "params": {}},
+                                   headers={"X-API-Key": "first"}).status_code == 200
+            response = client.post("/tools/execute", json={"tool": "time", "params": {}}, headers={"X-API-Key": "first"})
+            assert response.status_code == 429
+            assert int(response.headers["Retry-After"]) >= 100
+            # Another key has its own bucket
+            assert client.post("/tools/execute", json={"tool": "time", "params": {}},
+                               headers={"X-API-Key": "second"}).status_code == 200
+
+            response = client.post("/ai/stream", json={"message": "hi", "session_id": "limited"},
+                                   headers={"X-API-Key": "third"})
+            assert response.status_code == 200
+            response = client.post("/ai/chat", json={"message": "hi", "session_id": "limited"},
+                                   headers={"X-API-Key": "fourth"})
+            assert response.status_code == 429 and "session" in response.json()["detail"]
+
+            with client.websocket_connect("/ws/limited") as websocket:
+                websocket.send_json({"type": "message", "message": "hi"})
+                frame = websocket.receive_json()
+                assert frame["type"] == "error" and frame["retry_after"] >= 1
+
+        assert main.metrics.render().count('rejected_work_total{kind="llm",reason="session"}') == 1
+
+    def test_unknown_api_keys_share_the_address_bucket(self, monkeypatch):
+        """Test that a new made-up API key on every request is charged to the caller's address"""
+        limiter = RateLimiter({"client": Limit(0.01, 3)}, {"llm": 5, "code": 3, "tool": 1})
+        monkeypatch.setattr(main, "rate_limiter", limiter)
+        monkeypatch.setattr(main, "RATE_LIMIT_API_KEYS", ["known"])
+        with TestClient(app) as client:
+            statuses = [
+                client.post("/tools/execute", json={"tool": "time", "params": {}},
+                            headers={"X-API-Key": f"made-up-{index}"}).status_code
+                for index in range(4)
+            ]
+            assert statuses == [200, 200, 200, 429]
+            assert client.post("/tools/execute", json={"tool": "time", "params": {}},
+                               headers={"X-API-Key": "known"}).status_code == 200
+        assert main.client_identity("known", "10.0.0.1") == "key:0"
+        assert main.client_identity("unknown", "10.0.0.1") == main.client_identity(None, "10.0.0.1") == "ip:10.0.0.1"
+
+    def test_overload_sheds_new_turns(self, monkeypatch):
+        """Test that new AI turns are refused while the event loop lags"""
+        shedder = LoadShedder(lambda: 1.0, lambda: 0, max_loop_lag=0.25)
+        monkeypatch.setattr(main, "load_shedder", shedder)
+        with TestClient(app) as client:
+            response = client.post("/ai/stream", json={"message": "hi", "session_id": "shed"})
+            assert response.status_code == 429 and response.headers["Retry-After"] == "1"
+            assert client.post("/chat/send", json={"sender": "user", "text": "hi", "session_id": "shed"}).status_code == 200
+        assert shedder.stats()["shed"]["loop_lag"] == 1
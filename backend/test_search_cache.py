@@ -0,0 +1,172 @@
+"""
+Test suite for the search result cache
+"""
+
+import asyncio
+import pytest
+from search_cache import SearchCache, normalize_query
+
+class TestQueryNormalization:
+    """Test cache key normalization"""
+
+    def test_case_and_whitespace(self):
+        """Test that case and whitespace differences share a key"""
+        assert normalize_query("  Python   Programming ") == "python programming"
+
+    def test_edge_punctuation(self):
+        """Test that trailing question marks do not split the cache"""
+        assert normalize_query("what is python?") == normalize_query("What is Python")
+
+    def test_inner_punctuation_kept(self):
+        """Test that meaningful punctuation is preserved"""
+        assert normalize_query("C++ templates") == "c++ templates"
+
+class TestSearchCache:
+    """Test caching behaviour"""
+
+    def test_hit_after_miss(self):
+        """Test that a repeated query is served from the cache"""
+        calls = []
+
+        async def fetch(key):
+            calls.append(key)
+            return {"kind": "answer", "text": "42"}, False
+
+        async def run():
+            cache = SearchCache()
+            first = await cache.get_or_fetch("Meaning of life", fetch)
+            second = await cache.get_or_fetch("meaning of LIFE?", fetch)
+            return cache, first, second
+
+        cache, first, second = asyncio.run(run())
+        assert first == second
+        assert calls == ["meaning of life"]
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["hit_ratio"] == 0.5
+
+    def test_negative_caching_uses_short_ttl(self):
+        """Test that "no answer" results expire with the negative TTL"""
+        calls = []
+
+        async def fetch(key):
+            calls.append(key)
+            return {"kind": "empty", "text": ""}, True
+
+        async def run():
+            cache = SearchCache(ttl=60, negative_ttl=0.05)
+            await cache.get_or_fetch("obscure", fetch)
+            await cache.get_or_fetch("obscure", fetch)
+            await asyncio.sleep(0.1)
+            await cache.get_or_fetch("obscure", fetch)
+            return cache
+
+        cache = asyncio.run(run())
+        assert len(calls) == 2
+        assert cache.stats()["negative_hits"] == 1
+
+    def test_failures_are_not_cached(self):
+        """Test that transient upstream failures are retried"""
+        calls = []
+
+        async def fetch(key):
+            calls.append(key)
+            return {"kind": "unavailable", "text": ""}, None
+
+        async def run():
+            cache = SearchCache()
+            await cache.get_or_fetch("down", fetch)
+            await cache.get_or_fetch("down", fetch)
+
+        asyncio.run(run())
+        assert len(calls) == 2
+
+    def test_lru_bound(self):
+        """Test that the cache never grows past max_entries"""
+        async def fetch(key):
+            return key, False
+
+        async def run():
+            cache = SearchCache(max_entries=3)
+            for query in ["a", "b", "c", "d", "e"]:
+                await cache.get_or_fetch(query, fetch)
+            return cache
+
+        cache = asyncio.run(run())
+        assert cache.stats()["size"] == 3
+        assert cache.stats()["evictions"] == 2
+
+    def test_concurrent_misses_coalesce(self):
+        """Test that simultaneous misses share one upstream call"""
+        calls = []
+
+        async def fetch(key):
+            calls.append(key)
+            await asyncio.sleep(0.05)
+            return "value", False
+
+        async def run():
+            cache = SearchCache()
+            return cache, await asyncio.gather(*[cache.get_or_fetch("same", fetch) for _ in range(10)])
+
+        cache, results = asyncio.run(run())
+        assert results == ["value"] * 10
+        assert len(calls) == 1
+        assert cache.stats()["coalesced"] == 9
+
+    def test_cancelled_fetch_does_not_cancel_waiters(self):
+        """Test that cancelling the caller doing the fetch leaves coalesced callers to retry it"""
+        calls = []
+
+        async def fetch(key):
+            calls.append(key)
+            await asyncio.sleep(0.05)
+            return "value", False
+
+        async def run():
+            cache = SearchCache()
+            leader = asyncio.create_task(cache.get_or_fetch("same", fetch))
+            await asyncio.sleep(0)
+            waiters = [asyncio.create_task(cache.get_or_fetch("same", fetch)) for _ in range(3)]
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            results = await asyncio.gather(*waiters)
+            assert leader.cancelled()
+            return results
+
+        assert asyncio.run(run()) == ["value"] * 3
+        assert len(calls) == 2
+
+    def test_fetch_exception_propagates(self):
+        """Test that fetch errors reach the caller and are not cached"""
+        async def fetch(key):
+            raise RuntimeError("boom")
+
+        async def run():
+            cache = SearchCache()
+            with pytest.raises(RuntimeError):
+                await cache.get_or_fetch("q", fetch)
+            return cache
+
+        assert asyncio.run(run()).stats()["size"] == 0
+
+    def test_persistent_tier_survives_restart(self, tmp_path):
+        """Test that entries are reloaded from disk by a new cache"""
+        path = str(tmp_path / "search.db")
+        calls = []
+
+        async def fetch(key):
+            calls.append(key)
+            return {"kind": "abstract", "text": "A language"}, False
+
+        async def run():
+            await SearchCache(persist_path=path).get_or_fetch("python", fetch)
+            restarted = SearchCache(persist_path=path)
+            value = await restarted.get_or_fetch("Python", fetch)
+            return restarted, value
+
+        restarted, value = asyncio.run(run())
+        assert value["text"] == "A language"
+        assert calls == ["python"]
+        assert restarted.stats()["disk_hits"] == 1
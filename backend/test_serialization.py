@@ -0,0 +1,66 @@
+"""
+Test suite for the JSON serialization layer
+"""
+
+import json
+from fastapi.testclient import TestClient
+import serialization
+from main import app
+from message_store import MessageStore
+from ws_codec import JSON_CODEC, LEGACY_CODEC
+
+MESSAGE = {"id": 1, "sender": "bot", "text": "Héllo 🌟", "timestamp": "2025-01-01T00:00:00", "session_id": "s"}
+
+class TestEncoding:
+    """Test the encoder and its fallback"""
+
+    def test_round_trip(self):
+        """Test compact UTF-8 output that decodes to the same value"""
+        encoded = serialization.dumps(MESSAGE)
+        assert isinstance(encoded, bytes)
+        assert serialization.loads(encoded) == MESSAGE
+        assert "🌟".encode("utf-8") in encoded
+
+    def test_stdlib_fallback(self, monkeypatch):
+        """Test that output is identical JSON without orjson"""
+        fast = serialization.dumps(MESSAGE)
+        monkeypatch.setattr(serialization, "orjson", None)
+        assert serialization.dumps(MESSAGE) == fast
+        assert serialization.loads(fast) == MESSAGE
+
+    def test_join_array(self):
+        """Test joining pre-encoded items"""
+        items = [serialization.dumps({"a": 1}), serialization.dumps([2])]
+        assert json.loads(serialization.join_array(items)) == [{"a": 1}, [2]]
+        assert serialization.join_array([]) == b"[]"
+
+    def test_sse_event_lines(self):
+        """Test that every line of an event payload gets its own data field"""
+        assert serialization.sse_event("one") == b"data: one\n\n"
+        assert serialization.sse_event("a\nb\r\nc", "g:1") == b"id: g:1\ndata: a\ndata: b\ndata: c\n\n"
+
+    def test_legacy_frames_unchanged(self):
+        """Test that only negotiated JSON frames switch encoder"""
+        frame = {"type": "bot_response", "message": MESSAGE}
+        assert LEGACY_CODEC.encode(frame) == json.dumps(frame)
+        assert json.loads(JSON_CODEC.encode(frame)) == frame
+
+class TestCachedHistory:
+    """Test history served from cached message encodings"""
+
+    def test_history_json_matches_history(self):
+        """Test that cached bytes decode to the ordered history"""
+        store = MessageStore()
+        for message_id in (3, 1, 2):
+            store.add(dict(MESSAGE, id=message_id))
+        store.add(dict(MESSAGE, id=4, session_id="other"))
+        assert json.loads(store.history_json("s")) == store.history("s")
+        assert store.history_json("missing") == b"[]"
+
+    def test_history_endpoint(self):
+        """Test the endpoint returns the cached encoding"""
+        client = TestClient(app)
+        sent = client.post("/chat/send", json={"sender": "user", "text": "Héllo 🌟", "session_id": "serialized"}).json()
+        response = client.get("/chat/history?session_id=serialized")
+        assert response.headers["content-type"] == "application/json"
+        assert response.json() == [sent]
@@ -0,0 +1,149 @@
+"""
+Test suite for the production launcher and graceful drain
+"""
+
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import aiohttp
+import pytest
+import uvicorn
+from fastapi.testclient import TestClient
+import main
+from main import app
+from fastapi import WebSocketDisconnect
+from rate_limit import Limit, RateLimiter
+from serve import DrainingServer, ForwardedClientMiddleware, TrustedProxies, cpu_count, parse_args
+from stand_ins import StandInConfig, StandInServer
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class TestDrainingApp:
+    """Test how the app behaves once a worker starts draining"""
+
+    def test_draining_refuses_new_turns(self, monkeypatch):
+        """Test that health fails and new streams and WebSocket turns are refused while draining"""
+        with TestClient(app) as client:
+            monkeypatch.setattr(main.generations, "draining", True)
+            health = client.get("/health")
+            assert health.status_code == 503 and health.json()["status"] == "draining"
+            for path in ("/ai/stream", "/ai/chat"):
+                response = client.post(path, json={"message": "hi", "session_id": "drain"})
+                assert response.status_code == 503 and response.headers["retry-after"] == "1"
+            with client.websocket_connect("/ws/drain") as ws:
+                ws.send_json({"type": "message", "message": "hi"})
+                assert "restarting" in ws.receive_json()["message"]
+            assert client.get("/chat/history?session_id=drain").json() == []
+
+class TestForwardedClients:
+    """Test that limits keyed on the client address see the address behind the proxy"""
+
+    def test_trusted_proxies(self):
+        """Test that the client is the rightmost address no trusted proxy vouches for"""
+        assert "10.1.2.3" in TrustedProxies("127.0.0.1, 10.0.0.0/8") and "11.0.0.1" not in TrustedProxies("10.0.0.0/8")
+        middleware = ForwardedClientMiddleware(app, "10.0.0.0/8")
+        assert middleware.get_trusted_client_host(["6.6.6.6", "1.2.3.4", "10.0.0.5"]) == "1.2.3.4"
+        # Any peer is a proxy, but only its own entry is believed
+        assert ForwardedClientMiddleware(app, "*").get_trusted_client_host(["6.6.6.6", "1.2.3.4"]) == "1.2.3.4"
+
+    def test_per_ip_limits_use_the_forwarded_address(self, monkeypatch):
+        """Test that the per-IP WebSocket cap and the client rate bucket are per forwarded client"""
+        monkeypatch.setattr(main.manager, "max_per_ip", 1)
+        monkeypatch.setattr(main, "rate_limiter", RateLimiter({"client": Limit(0.01, 1)}, {"llm": 5, "code": 3, "tool": 1}))
+        # The test client connects as "testclient", standing in for the proxy
+        with TestClient(ForwardedClientMiddleware(app, "testclient")) as client:
+            first = {"X-Forwarded-For": "203.0.113.1"}
+            with client.websocket_connect("/ws/forwarded-a", headers=first):
+                with pytest.raises(WebSocketDisconnect):
+                    with client.websocket_connect("/ws/forwarded-b", headers={"X-Forwarded-For": "6.6.6.6, 203.0.113.1"}):
+                        pass
+                with client.websocket_connect("/ws/forwarded-c", headers={"X-Forwarded-For": "203.0.113.2"}):
+                    pass
+
+            body = {"tool": "time", "params": {}}
+            assert client.post("/tools/execute", json=body, headers=first).status_code == 200
+            assert client.post("/tools/execute", json=body, headers=first).status_code == 429
+            assert client.post("/tools/execute", json=body, headers={"X-Forwarded-For": "203.0.113.2"}).status_code == 200
+
+class TestServe:
+    """Test the launcher's settings and its shutdown"""
+
+    def test_defaults(self, monkeypatch):
+        """Test that settings come from the environment and default to one worker, or one per CPU with a backplane"""
+        monkeypatch.delenv("WEB_CONCURRENCY", raising=False)
+        monkeypatch.delenv("BACKPLANE_URL", raising=False)
+        assert parse_args([]).workers == 1
+        monkeypatch.setenv("BACKPLANE_URL", "redis://localhost:6379/0")
+        assert parse_args([]).workers == cpu_count() >= 1
+        monkeypatch.setenv("WEB_CONCURRENCY", "3")
+        monkeypatch.setenv("DRAIN_TIMEOUT", "12")
+        args = parse_args(["--port", "9000"])
+        assert (args.workers, args.drain_timeout, args.port, args.preload) == (3, 12.0, 9000, True)
+
+    def test_second_signal_skips_the_drain(self):
+        """Test that the first signal starts a drain and a second one exits at once"""
+        async def run():
+            started = asyncio.Event()
+
+            async def drain(timeout):
+                started.set()
+                await asyncio.sleep(timeout)
+
+            server = DrainingServer(uvicorn.Config(app), drain, 10)
+            server.handle_exit(signal.SIGTERM, None)
+            await started.wait()
+            assert not server.should_exit
+            server.handle_exit(signal.SIGTERM, None)
+            assert server.should_exit
+            server.draining.cancel()
+
+        asyncio.run(run())
+
+    @pytest.mark.skipif(not hasattr(os, "fork"), reason="workers are forked")
+    def test_sigterm_lets_streams_finish(self):
+        """Test that SIGTERM mid-stream lets the stream finish before the workers exit"""
+        stand_in = StandInServer(configs={"openai": StandInConfig(tokens_per_second=20, reply="word " * 15)}, seed=1)
+        with stand_in.running():
+            port = free_port()
+            env = dict(os.environ, **stand_in.base_urls(), OPENAI_API_KEY="sk-stand-in")
+            command = [sys.executable, "serve.py", "--workers", "2", "--port", str(port), "--host", "127.0.0.1",
+                       "--drain-timeout", "10", "--log-level", "warning", "--no-access-log"]
+            server = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+            url = f"http://127.0.0.1:{port}"
+
+            async def stream_through_shutdown():
+                async with aiohttp.ClientSession() as session:
+                    deadline = time.monotonic() + 20
+                    while True:
+                        try:
+                            async with session.get(f"{url}/health") as response:
+                                if response.status == 200:
+                                    break
+                        except aiohttp.ClientError:
+                            if time.monotonic() > deadline:
+                                raise
+                        await asyncio.sleep(0.1)
+                    events = []
+                    body = {"message": "tell me a story", "session_id": "drain"}
+                    async with session.post(f"{url}/ai/stream", json=body) as response:
+                        async for line in response.content:
+                            if line.startswith(b"data: "):
+                                events.append(line[6:].strip())
+                                if len(events) == 2:
+                                    server.send_signal(signal.SIGTERM)
+                    return events
+
+            try:
+                events = asyncio.run(stream_through_shutdown())
+                assert server.wait(timeout=20) == 0
+            finally:
+                if server.poll() is None:
+                    server.kill()
+            assert events[-1] == b"[DONE]" and events.count(b"word") == 15
@@ -0,0 +1,157 @@
+"""
+Test suite for consistent-hash session sharding
+"""
+
+import asyncio
+from collections import Counter
+import aiohttp
+import pytest
+from aiohttp import web
+import sharding
+from sharding import HashRing, ShardRouter, nginx_upstream
+
+async def start_app(app: web.Application):
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+def make_worker(name: str) -> web.Application:
+    """A fake shard that reports which worker served the request"""
+    async def history(request):
+        return web.json_response({
+            "worker": name,
+            "session_id": request.query.get("session_id"),
+            "forwarded_for": request.headers.get("X-Forwarded-For"),
+        })
+
+    async def send(request):
+        body = await request.json()
+        return web.json_response({"worker": name, "session_id": body["session_id"]})
+
+    async def stream(request):
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for index in range(3):
+            await response.write(f"data: {name}-{index}\n\n".encode())
+        await response.write_eof()
+        return response
+
+    async def websocket(request):
+        ws = web.WebSocketResponse(protocols=["oasiz.json"])
+        await ws.prepare(request)
+        async for message in ws:
+            await ws.send_str(f"{name}:{message.data}")
+        return ws
+
+    app = web.Application()
+    app.router.add_get("/chat/history", history)
+    app.router.add_post("/chat/send", send)
+    app.router.add_post("/ai/stream", stream)
+    app.router.add_get("/ai/stream/{generation_id}", history)
+    app.router.add_get("/ws/{session_id}", websocket)
+    return app
+
+class TestHashRing:
+    """Test consistent hashing"""
+
+    def test_stable_and_balanced(self):
+        """Test that keys map deterministically and spread evenly"""
+        ring = HashRing(["a", "b", "c", "d"])
+        owners = Counter(ring.node_for(f"session-{index}") for index in range(20_000))
+        assert ring.node_for("session-1") == HashRing(["a", "b", "c", "d"]).node_for("session-1")
+        assert min(owners.values()) > 20_000 / 4 * 0.8
+
+    def test_adding_a_node_moves_few_keys(self):
+        """Test that growing the ring only moves keys to the new node"""
+        before = HashRing(["a", "b", "c"])
+        after = HashRing(["a", "b", "c", "d"])
+        keys = [f"session-{index}" for index in range(10_000)]
+        moved = [key for key in keys if before.node_for(key) != after.node_for(key)]
+        assert all(after.node_for(key) == "d" for key in moved)
+        assert len(moved) < len(keys) * 0.35
+
+class TestShardRouter:
+    """Test request forwarding to the owning shard"""
+
+    def test_routes_by_session(self):
+        """Test that HTTP, SSE and WebSocket traffic reach the session's shard"""
+        async def run():
+            runners, urls = [], []
+            for name in ["w0", "w1", "w2"]:
+                runner, url = await start_app(make_worker(name))
+                runners.append(runner)
+                urls.append(url)
+            router = ShardRouter(urls)
+            router_runner, router_url = await start_app(router.app)
+            expected = {url: name for url, name in zip(urls, ["w0", "w1", "w2"])}
+            results = []
+            async with aiohttp.ClientSession() as client:
+                for index in range(20):
+                    session_id = f"s{index}"
+                    owner = expected[router.ring.node_for(session_id)]
+                    async with client.get(f"{router_url}/chat/history", params={"session_id": session_id}) as r:
+                        by_query = (await r.json())["worker"]
+                    async with client.post(f"{router_url}/chat/send", json={"session_id": session_id}) as r:
+                        by_body = (await r.json())["worker"]
+                    async with client.post(f"{router_url}/ai/stream", json={"session_id": session_id}) as r:
+                        stream = await r.text()
+                    async with client.ws_connect(f"{router_url}/ws/{session_id}", protocols=["oasiz.json"]) as ws:
+                        protocol = ws.protocol
+                        await ws.send_str("ping")
+                        echo = (await ws.receive()).data
+                    results.append((owner, by_query, by_body, stream, echo, protocol))
+            await router_runner.cleanup()
+            for runner in runners:
+                await runner.cleanup()
+            return results
+
+        for owner, by_query, by_body, stream, echo, protocol in asyncio.run(run()):
+            assert by_query == by_body == owner
+            assert stream == "".join(f"data: {owner}-{index}\n\n" for index in range(3))
+            assert echo == f"{owner}:ping"
+            assert protocol == "oasiz.json"
+
+    def test_resume_and_client_address(self):
+        """Test that resumes reach the session's shard and workers see the client's address"""
+        async def run():
+            runners, urls = [], []
+            for name in ["w0", "w1", "w2"]:
+                runner, url = await start_app(make_worker(name))
+                runners.append(runner)
+                urls.append(url)
+            router = ShardRouter(urls)
+            router_runner, router_url = await start_app(router.app)
+            names = dict(zip(urls, ["w0", "w1", "w2"]))
+            try:
+                async with aiohttp.ClientSession() as client:
+                    for index in range(10):
+                        session_id = f"s{index}"
+                        async with client.get(f"{router_url}/ai/stream/gen{index}", params={"session_id": session_id}) as r:
+                            resumed = await r.json()
+                        assert resumed["worker"] == names[router.ring.node_for(session_id)]
+                        assert resumed["forwarded_for"] == "127.0.0.1"
+                    async with client.get(f"{router_url}/ai/stream/gen0") as r:
+                        assert r.status == 400
+                    async with client.get(f"{router_url}/chat/history", params={"session_id": "s1"},
+                                          headers={"X-Forwarded-For": "203.0.113.9"}) as r:
+                        assert (await r.json())["forwarded_for"] == "203.0.113.9, 127.0.0.1"
+            finally:
+                await router_runner.cleanup()
+                for runner in runners:
+                    await runner.cleanup()
+
+        asyncio.run(run())
+
+    def test_several_workers_need_a_backplane(self, monkeypatch):
+        """Test that serving more than one shard without a shared backplane is refused"""
+        monkeypatch.delenv("BACKPLANE_URL", raising=False)
+        with pytest.raises(SystemExit):
+            sharding.main(["serve", "--workers", "2"])
+
+    def test_nginx_upstream(self):
+        """Test the generated hash-based nginx upstream"""
+        config = nginx_upstream(["backend:8100", "backend:8101"])
+        assert "hash $oasiz_path_session$arg_session_id$http_x_session_id consistent;" in config
+        assert "server backend:8101;" in config
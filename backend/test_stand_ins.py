@@ -0,0 +1,141 @@
+"""
+Test suite running the backend against local stand-in upstreams
+
+No network access or API keys are needed: every upstream is served by
+stand_ins.StandInServer on an ephemeral local port.
+"""
+
+import asyncio
+import time
+import pytest
+from fastapi.testclient import TestClient
+import main
+from main import app
+from stand_ins import StandInConfig, StandInServer
+
+@pytest.fixture
+def stand_in(monkeypatch):
+    """Start the stand-in server and point the backend at it"""
+    server = StandInServer(seed=1)
+    with server.running():
+        for name, url in server.base_urls().items():
+            monkeypatch.setattr(main, name, url)
+        monkeypatch.setattr(main, "OPENAI_API_KEY", "sk-stand-in")
+        monkeypatch.setattr(main, "WEATHER_API_KEY", "stand-in-weather-key")
+        main.search_cache.clear()
+        yield server
+
+class TestStandInUpstreams:
+    """Test tool and AI paths end to end over HTTP"""
+
+    def test_openweathermap(self, stand_in):
+        """Test the OpenWeatherMap format"""
+        result = asyncio.run(main.get_weather("Paris"))
+        assert "Weather in Paris: 21.5°C, clear sky" in result
+        assert stand_in.requests["openweathermap"] == 1
+
+    def test_wttr_fallback(self, stand_in, monkeypatch):
+        """Test the wttr.in format used without a weather key"""
+        monkeypatch.setattr(main, "WEATHER_API_KEY", "your-weather-api-key-here")
+        result = asyncio.run(main.get_weather("Oslo"))
+        assert result == "🌤️ Oslo: ☀️ +21°C"
+
+    def test_duckduckgo(self, stand_in):
+        """Test the DuckDuckGo format and that repeats hit the cache"""
+        first = asyncio.run(main.search_web("FastAPI"))
+        second = asyncio.run(main.search_web("fastapi"))
+        assert "Stand-in abstract for fastapi" in first
+        assert "Stand-in abstract for fastapi" in second
+        assert stand_in.requests["duckduckgo"] == 1
+
+    def test_openai_non_streaming(self, stand_in):
+        """Test a chat completion round trip"""
+        result = asyncio.run(main.get_ai_response("tell me about otters"))
+        assert result == "Stand-in reply to: tell me about otters"
+
+    def test_openai_streaming(self, stand_in):
+        """Test the streaming endpoint against a streamed completion"""
+        stand_in.configs["openai"].reply = "one two three"
+        client = TestClient(app)
+        response = client.post("/ai/stream", json={"message": "count for me", "session_id": "s1"})
+        assert response.status_code == 200
+        assert "data: one\n\n" in response.text
+        assert "data:  three\n\n" in response.text
+        assert response.text.endswith("data: [DONE]\n\n")
+
+    def test_tokens_per_second(self, stand_in):
+        """Test that the streaming speed is throttled"""
+        stand_in.configs["openai"] = StandInConfig(reply="a b c d e", tokens_per_second=50)
+        client = TestClient(app)
+        started = time.perf_counter()
+        client.post("/ai/stream", json={"message": "slow", "session_id": "s1"})
+        assert time.perf_counter() - started >= 5 / 50
+
+    def test_latency_injection(self, stand_in):
+        """Test that configured latency delays responses"""
+        stand_in.configs["openweathermap"] = StandInConfig(latency=0.1)
+        started = time.perf_counter()
+        asyncio.run(main.get_weather("Rome"))
+        assert time.perf_counter() - started >= 0.1
+
+    def test_error_injection(self, stand_in):
+        """Test that injected upstream failures surface as errors"""
+        stand_in.configs["openai"] = StandInConfig(error_rate=1.0)
+        result = asyncio.run(main.get_ai_response("hello there"))
+        assert result.startswith("Sorry, I encountered an error")
+        assert "Injected openai failure" in result
+
+class TestFunctionRouter:
+    """Test routing through OpenAI function calling"""
+
+    @pytest.fixture(autouse=True)
+    def functions_mode(self, stand_in, monkeypatch):
+        monkeypatch.setattr(main, "ROUTER_MODE", "functions")
+
+    def test_tools_declared_from_registry(self):
+        """Test that every registered tool is declared as a function"""
+        names = [schema["function"]["name"] for schema in main.get_tool_schemas()]
+        assert names == list(main.AVAILABLE_TOOLS)
+
+    def test_fast_path_skips_model(self, stand_in):
+        """Test that cheap intents never reach the model"""
+        result = asyncio.run(main.get_ai_response("what time is it?"))
+        assert result.startswith("Current time:")
+        assert stand_in.requests["openai"] == 0
+
+    def test_time_word_no_longer_hijacks(self, stand_in):
+        """Test that a sentence mentioning time goes to the model"""
+        result = asyncio.run(main.get_ai_response("is it time to learn rust"))
+        assert result == "Stand-in reply to: is it time to learn rust"
+
+    def test_parallel_tool_calls(self, stand_in):
+        """Test that tool calls run concurrently and feed the final answer"""
+        stand_in.configs["openai"].tool_calls = [
+            {"name": "weather", "arguments": {"location": "Paris"}},
+            {"name": "search", "arguments": {"query": "louvre opening hours"}},
+        ]
+        stand_in.configs["openai"].reply = "Sunny, and the Louvre opens at nine."
+        stand_in.configs["openweathermap"] = StandInConfig(latency=0.3)
+        stand_in.configs["duckduckgo"] = StandInConfig(latency=0.3)
+
+        started = time.perf_counter()
+        result = asyncio.run(main.get_ai_response("weather in Paris and when does the louvre open"))
+        elapsed = time.perf_counter() - started
+
+        assert result == "Sunny, and the Louvre opens at nine."
+        assert elapsed < 0.55
+        assert stand_in.requests["openai"] == 2
+        follow_up = stand_in.chat_bodies[-1]["messages"]
+        tool_messages = [m for m in follow_up if m["role"] == "tool"]
+        assert [m["tool_call_id"] for m in tool_messages] == ["call_0", "call_1"]
+        assert "Weather in Paris" in tool_messages[0]["content"]
+        assert "louvre opening hours" in tool_messages[1]["content"]
+
+    def test_streamed_turn(self, stand_in):
+        """Test that the final answer after tool calls is streamed"""
+        stand_in.configs["openai"].tool_calls = [{"name": "time", "arguments": {}}]
+        stand_in.configs["openai"].reply = "It is late."
+        client = TestClient(app)
+        response = client.post("/ai/stream", json={"message": "should I sleep", "session_id": "s1"})
+        assert "data: It\n\n" in response.text
+        assert response.text.endswith("data: [DONE]\n\n")
@@ -0,0 +1,162 @@
+"""
+Test suite for tracing spans and the sampling profiler
+"""
+
+import asyncio
+import json
+import threading
+import time
+import pytest
+from aiohttp import web
+from fastapi.testclient import TestClient
+import main
+from main import app
+from profiling import ProfilerBusyError, SamplingProfiler
+from tracing import JSONExporter, OTLPExporter, Tracer
+from test_stand_ins import stand_in  # noqa: F401
+
+class TestSpans:
+    """Test span nesting and export"""
+
+    def test_spans_nest_across_tasks(self):
+        """Test that child spans, including those in tasks started inside a span, share its trace"""
+        tracer = Tracer()
+
+        async def child():
+            with tracer.span("child"):
+                await asyncio.sleep(0)
+
+        async def run():
+            with tracer.span("root") as root:
+                await asyncio.gather(asyncio.create_task(child()), child())
+            with pytest.raises(RuntimeError):
+                with tracer.span("failing"):
+                    raise RuntimeError("boom")
+            return root
+
+        root = asyncio.run(run())
+        spans = tracer.trace(root.trace_id)
+        assert [span["name"] for span in spans] == ["root", "child", "child"]
+        assert all(span["parent_id"] == root.span_id for span in spans[1:])
+        failing = tracer.recent_spans()[-1]
+        assert failing["error"] == "RuntimeError: boom" and failing["trace_id"] != root.trace_id
+
+    def test_traceparent_is_continued(self):
+        """Test that a W3C traceparent makes the server span a child of the caller's span"""
+        tracer = Tracer()
+        with tracer.server_span("GET /", "00-" + "a" * 32 + "-" + "b" * 16 + "-01") as span:
+            pass
+        assert span.trace_id == "a" * 32 and span.parent_id == "b" * 16
+        with tracer.server_span("GET /", "garbage") as span:
+            pass
+        assert span.parent_id is None
+
+    def test_json_export(self, tmp_path):
+        """Test that flushed spans are appended as JSON lines"""
+        path = tmp_path / "spans.jsonl"
+        tracer = Tracer(exporter=JSONExporter(str(path)))
+
+        async def run():
+            with tracer.span("a", user="u1"):
+                with tracer.span("b"):
+                    pass
+            await tracer.stop()
+
+        asyncio.run(run())
+        lines = [json.loads(line) for line in path.read_text().splitlines()]
+        assert [line["name"] for line in lines] == ["b", "a"]
+        assert lines[1]["attributes"] == {"user": "u1"}
+        assert tracer.stats()["exported"] == 2
+
+    def test_otlp_export(self):
+        """Test that spans reach an OTLP/HTTP collector in the JSON encoding"""
+        received = []
+
+        async def collect(request: web.Request) -> web.Response:
+            received.append(await request.json())
+            return web.json_response({})
+
+        async def run():
+            collector = web.Application()
+            collector.router.add_post("/v1/traces", collect)
+            runner = web.AppRunner(collector)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+            tracer = Tracer(exporter=OTLPExporter(f"http://127.0.0.1:{port}", "test-service"), flush_interval=0.01)
+            tracer.start()
+            with tracer.span("work", kind="client", items=3, ratio=0.5):
+                pass
+            await asyncio.sleep(0.1)
+            await tracer.stop()
+            await runner.cleanup()
+
+        asyncio.run(run())
+        resource = received[0]["resourceSpans"][0]
+        assert resource["resource"]["attributes"][0]["value"] == {"stringValue": "test-service"}
+        span = resource["scopeSpans"][0]["spans"][0]
+        assert span["name"] == "work" and span["kind"] == 3 and len(span["traceId"]) == 32
+        assert {"key": "items", "value": {"intValue": "3"}} in span["attributes"]
+        assert {"key": "ratio", "value": {"doubleValue": 0.5}} in span["attributes"]
+
+    def test_stream_turn_is_traced(self, stand_in):
+        """Test that a streamed turn records the request, stream and upstream spans in one trace"""
+        stand_in.configs["openai"].reply = "one two three"
+        with TestClient(app) as client:
+            response = client.post("/ai/stream", json={"message": "count for me", "session_id": "s1"})
+        trace_id = response.headers["X-Trace-Id"]
+        spans = {span["name"]: span for span in main.tracer.trace(trace_id)}
+        assert spans["POST /ai/stream"]["kind"] == "server"
+        assert spans["ai.stream"]["attributes"]["chunks"] == 4
+        assert spans["POST openai"]["parent_id"] == spans["ai.stream"]["span_id"]
+        assert spans["POST openai"]["attributes"]["http.status_code"] == 200
+
+class TestProfiler:
+    """Test the sampling profiler and its endpoint"""
+
+    def test_collapsed_stacks(self):
+        """Test that a busy thread shows up as a collapsed stack ending in its function"""
+        stop = threading.Event()
+
+        def spin_for_profile():
+            while not stop.is_set():
+                sum(range(1000))
+
+        thread = threading.Thread(target=spin_for_profile, name="spinner")
+        thread.start()
+        try:
+            output = SamplingProfiler(interval=0.001).collapsed(0.1, thread.ident)
+        finally:
+            stop.set()
+            thread.join()
+        lines = output.splitlines()
+        assert lines and all(line.startswith("spinner;") for line in lines)
+        assert any("spin_for_profile (" in line for line in lines)
+        assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+    def test_one_profile_at_a_time(self):
+        """Test that concurrent profiles are refused"""
+        profiler = SamplingProfiler()
+        thread = threading.Thread(target=profiler.sample, args=(0.2,))
+        thread.start()
+        time.sleep(0.05)
+        try:
+            with pytest.raises(ProfilerBusyError):
+                profiler.sample(0.01)
+        finally:
+            thread.join()
+
+    def test_endpoint_is_guarded(self, monkeypatch):
+        """Test that profiling needs the debug token and returns collapsed stacks of the event loop"""
+        with TestClient(app) as client:
+            monkeypatch.setattr(main, "DEBUG_TOKEN", None)
+            assert client.get("/debug/profile?seconds=0.05").status_code == 404
+            monkeypatch.setattr(main, "DEBUG_TOKEN", "secret")
+            assert client.get("/debug/profile?seconds=0.05", headers={"X-Debug-Token": "wrong"}).status_code == 403
+            headers = {"X-Debug-Token": "secret"}
+            assert client.get("/debug/profile?seconds=600", headers=headers).status_code == 400
+            response = client.get("/debug/profile?seconds=0.1", headers=headers)
+            assert response.status_code == 200
+            assert "run_until_complete" in response.text or "_run_once" in response.text
+            assert client.get("/debug/traces?limit=5", headers=headers).json()["tracer"]["finished"] > 0
@@ -0,0 +1,97 @@
+"""
+Test suite for traffic recording
+"""
+
+import asyncio
+import json
+import pytest
+from unittest.mock import patch, AsyncMock
+from fastapi.testclient import TestClient
+from main import app
+from traffic import TrafficRecorder, TrafficRecorderMiddleware, classify, read_log, synthesize
+from test_stand_ins import stand_in  # noqa: F401
+
+def recording_client(path) -> TestClient:
+    recorder = TrafficRecorder(str(path), flush_interval=60)
+    return TestClient(TrafficRecorderMiddleware(app, recorder)), recorder
+
+class TestAnonymization:
+    """Test that recorded shapes keep the workload but not the data"""
+
+    @pytest.mark.parametrize("message", [
+        "What's the weather like in Reykjavik today?",
+        "search for the best ramen near 5th avenue",
+        "tell me something funny",
+        "How do transformers work in machine learning and why are they popular?",
+    ])
+    def test_synthesized_text_keeps_intent_and_length(self, message):
+        """Test that a replayed message routes like the original and is about as long"""
+        recorder = TrafficRecorder("unused")
+        shape = recorder.anonymize({"message": message, "session_id": "alice-123"})
+        assert message not in json.dumps(shape) and "alice" not in json.dumps(shape)
+        replayed = synthesize(shape)
+        assert classify(replayed["message"]) == classify(message)
+        assert len(message) <= len(replayed["message"]) <= len(message) + 12
+        assert replayed["session_id"] == recorder.pseudonym("alice-123")
+
+    def test_other_values(self):
+        """Test that enumerations and numbers survive and free strings keep only their length"""
+        recorder = TrafficRecorder("unused")
+        shape = recorder.anonymize({"tool": "weather", "params": {"location": "Oslo", "days": 3}})
+        assert shape == {"tool": "weather", "params": {"location": {"$str": 4}, "days": 3}}
+        assert synthesize(shape) == {"tool": "weather", "params": {"location": "xxxx", "days": 3}}
+
+class TestRecording:
+    """Test what the middleware writes"""
+
+    def test_http_and_sse_requests(self, stand_in, tmp_path):
+        """Test that requests are logged with anonymized routes, bodies and stream timings"""
+        path = tmp_path / "traffic.jsonl.gz"
+        stand_in.configs["openai"].reply = "one two three"
+        client, recorder = recording_client(path)
+        with client:
+            client.post("/chat/send", json={"sender": "user", "text": "my secret plan", "session_id": "bob"})
+            client.get("/chat/history?session_id=bob")
+            response = client.post("/ai/stream", json={"message": "write a poem", "session_id": "bob"})
+            client.get(f"/ai/stream/{response.headers['X-Generation-Id']}?offset=1", headers={"X-Session-Id": "bob"})
+            client.get("/metrics")
+        asyncio.run(recorder.stop())
+        records = read_log(str(path))
+        text = path.read_bytes()
+        assert b"secret" not in text and b"bob" not in text
+
+        send, history, stream, resume = records
+        bob = recorder.pseudonym("bob")
+        assert send["r"] == "/chat/send" and send["s"] == 200
+        assert send["b"] == {"sender": "user", "text": {"$text": "chat", "len": 14}, "session_id": bob}
+        assert history["q"] == {"session_id": bob}
+        assert stream["n"] == 4 and 0 < stream["f"] <= stream["d"]
+        assert resume["r"] == "/ai/stream/{generation_id}" and resume["q"] == {"offset": 1}
+        assert response.headers["X-Generation-Id"] not in resume["p"]
+        assert [r["t"] for r in records] == sorted(r["t"] for r in records)
+
+    def test_websocket_events(self, tmp_path):
+        """Test that a socket is logged as open, inbound frames and close"""
+        path = tmp_path / "traffic.jsonl"
+        client, recorder = recording_client(path)
+        with patch('main.get_ai_response', new_callable=AsyncMock) as mock_ai:
+            mock_ai.return_value = "Hi there!"
+            with client:
+                with client.websocket_connect("/ws/carol", subprotocols=["oasiz.json"]) as websocket:
+                    websocket.send_text(json.dumps({"type": "message", "message": "tell me a joke"}))
+                    websocket.receive_text()
+                    websocket.receive_text()
+        asyncio.run(recorder.stop())
+        opened, frame, closed = read_log(str(path))
+        assert opened["e"] == "open" and opened["p"] == f"/ws/{recorder.pseudonym('carol')}"
+        assert opened["sp"] == ["oasiz.json"]
+        assert frame["b"] == {"type": "message", "message": {"$text": "joke", "len": 14}}
+        assert closed["e"] == "close" and closed["n"] == 2
+        assert opened["c"] == frame["c"] == closed["c"]
+
+    def test_sampling(self, tmp_path):
+        """Test that unsampled requests are not recorded"""
+        recorder = TrafficRecorder(str(tmp_path / "t.jsonl"), sample_rate=0.0)
+        with TestClient(TrafficRecorderMiddleware(app, recorder)) as client:
+            client.get("/")
+        assert recorder.stats()["recorded"] == 0
@@ -0,0 +1,70 @@
+"""
+Test suite for negotiated WebSocket frame encodings
+"""
+
+import json
+from unittest.mock import patch, AsyncMock
+import msgpack
+from fastapi.testclient import TestClient
+from main import app
+from ws_codec import (
+    JSON_PROTOCOL, MSGPACK_PROTOCOL, LEGACY_CODEC, JSON_CODEC, MSGPACK_CODEC, negotiate
+)
+
+MESSAGE = {"id": 7, "sender": "user", "text": "Hello", "timestamp": "2025-01-01T00:00:00", "session_id": "s"}
+
+class TestNegotiation:
+    """Test subprotocol selection"""
+
+    def test_prefers_msgpack(self):
+        """Test that the most compact offered encoding wins"""
+        assert negotiate([JSON_PROTOCOL, MSGPACK_PROTOCOL]) is MSGPACK_CODEC
+        assert negotiate([JSON_PROTOCOL]) is JSON_CODEC
+
+    def test_unknown_protocols_fall_back_to_legacy(self):
+        """Test that existing clients keep the original frames"""
+        assert negotiate([]) is LEGACY_CODEC
+        assert negotiate(["graphql-ws"]) is LEGACY_CODEC
+
+    def test_slim_ack(self):
+        """Test that negotiated codecs acknowledge with id and timestamp only"""
+        assert MSGPACK_CODEC.ack(MESSAGE) == {"type": "message_sent", "id": 7, "timestamp": MESSAGE["timestamp"]}
+        assert LEGACY_CODEC.ack(MESSAGE) == {"type": "message_sent", "message": MESSAGE}
+
+    def test_msgpack_round_trip(self):
+        """Test binary encoding round trip"""
+        frame = {"type": "bot_response", "message": MESSAGE}
+        encoded = MSGPACK_CODEC.encode(frame)
+        assert isinstance(encoded, bytes)
+        assert MSGPACK_CODEC.decode(encoded) == frame
+        assert len(encoded) < len(LEGACY_CODEC.encode(frame))
+
+class TestWebSocketEncodings:
+    """Test the chat WebSocket with each encoding"""
+
+    def test_msgpack_session(self):
+        """Test a full turn over binary MessagePack frames"""
+        client = TestClient(app)
+        with patch('main.get_ai_response', new_callable=AsyncMock) as mock_ai:
+            mock_ai.return_value = "Hi there!"
+            with client.websocket_connect("/ws/msgpack-session", subprotocols=[MSGPACK_PROTOCOL]) as websocket:
+                assert websocket.accepted_subprotocol == MSGPACK_PROTOCOL
+                websocket.send_bytes(msgpack.packb({"type": "message", "message": "Hello"}))
+                ack = msgpack.unpackb(websocket.receive_bytes())
+                reply = msgpack.unpackb(websocket.receive_bytes())
+        assert set(ack) == {"type", "id", "timestamp", "generation_id"}
+        assert reply["type"] == "bot_response"
+        assert reply["message"]["text"] == "Hi there!"
+
+    def test_json_session(self):
+        """Test slim acknowledgements over JSON text frames"""
+        client = TestClient(app)
+        with patch('main.get_ai_response', new_callable=AsyncMock) as mock_ai:
+            mock_ai.return_value = "Hi there!"
+            with client.websocket_connect("/ws/json-session", subprotocols=[JSON_PROTOCOL]) as websocket:
+                assert websocket.accepted_subprotocol == JSON_PROTOCOL
+                websocket.send_text(json.dumps({"type": "message", "message": "Hello"}))
+                ack = json.loads(websocket.receive_text())
+                reply = json.loads(websocket.receive_text())
+        assert "message" not in ack
+        assert reply["message"]["text"] == "Hi there!"
@@ -0,0 +1,387 @@
+"""
+Request Tracing
+
+This module records lightweight spans for chat turns so a slow request can be
+split into routing, tool, upstream, storage and serialization time. Spans are
+context managers that nest through ``contextvars``, so a span opened in a
+request handler becomes the parent of spans opened by the tools, streams and
+background generations it starts.
+
+Finished spans are kept in a bounded in-memory buffer and, when an exporter
+is configured, shipped in batches by a background task:
+
+- JSONExporter: appends one JSON object per span to a file
+- OTLPExporter: posts OTLP/HTTP JSON to a collector (``/v1/traces``)
+
+Incoming W3C ``traceparent`` headers are honoured, so traces join those of
+the caller.
+"""
+
+import asyncio
+import contextvars
+import functools
+import inspect
+import itertools
+import json
+import logging
+import os
+import re
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional
+
+import aiohttp
+
+from memory import deep_sizeof, shallow_sizeof
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+def _new_id(size: int) -> str:
+    return os.urandom(size).hex()
+
+class Span:
+    """One timed operation within a trace"""
+
+    __slots__ = ("tracer", "name", "trace_id", "span_id", "parent_id", "kind",
+                 "attributes", "start_ns", "end_ns", "error", "_token")
+
+    def __init__(
+        self,
+        tracer: "Tracer",
+        name: str,
+        parent: Optional["Span"],
+        attributes: Optional[Dict[str, Any]] = None,
+        kind: str = "internal",
+        trace_id: Optional[str] = None,
+        parent_id: Optional[str] = None,
+    ):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent else (trace_id or _new_id(16))
+        self.span_id = _new_id(8)
+        self.parent_id = parent.span_id if parent else parent_id
+        self.kind = kind
+        self.attributes = attributes or {}
+        self.start_ns = 0
+        self.end_ns = 0
+        self.error: Optional[str] = None
+        self._token = None
+
+    def set(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    @property
+    def duration(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e9
+
+    def __enter__(self) -> "Span":
+        self.start_ns = time.time_ns()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.time_ns()
+        if exc_type is not None and not issubclass(exc_type, (asyncio.CancelledError, GeneratorExit)):
+            self.error = f"{exc_type.__name__}: {exc}"
+        try:
+            _current.reset(self._token)
+        except ValueError:
+            # Closed from another context, e.g. an abandoned async generator finalised later
+            _current.set(None)
+        self.tracer._finish(self)
+        return False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+class JSONExporter:
+    """Appends finished spans as JSON lines to a file"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _write(self, lines: List[str]):
+        with open(self.path, "a") as f:
+            f.write("".join(lines))
+
+    async def export(self, spans: List[Span]):
+        lines = [json.dumps(span.to_dict()) + "\n" for span in spans]
+        await asyncio.to_thread(self._write, lines)
+
+    async def close(self):
+        pass
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+OTLP_KINDS = {"internal": 1, "server": 2, "client": 3}
+
+class OTLPExporter:
+    """Posts finished spans to an OTLP/HTTP collector as JSON"""
+
+    def __init__(self, endpoint: str, service_name: str, timeout: float = 5.0):
+        endpoint = endpoint.rstrip("/")
+        self.url = endpoint if endpoint.endswith("/v1/traces") else f"{endpoint}/v1/traces"
+        self.service_name = service_name
+        self.timeout = timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def payload(self, spans: List[Span]) -> Dict[str, Any]:
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{
+                "scope": {"name": "tracing"},
+                "spans": [{
+                    "traceId": span.trace_id,
+                    "spanId": span.span_id,
+                    "parentSpanId": span.parent_id or "",
+                    "name": span.name,
+                    "kind": OTLP_KINDS.get(span.kind, 1),
+                    "startTimeUnixNano": str(span.start_ns),
+                    "endTimeUnixNano": str(span.end_ns),
+                    "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in span.attributes.items()],
+                    "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+                } for span in spans],
+            }],
+        }]}
+
+    async def export(self, spans: List[Span]):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        async with self._session.post(self.url, json=self.payload(spans)) as response:
+            if response.status >= 400:
+                raise RuntimeError(f"Collector answered {response.status}")
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+class Tracer:
+    """Creates spans and hands finished ones to an exporter in batches"""
+
+    def __init__(
+        self,
+        service_name: str = "oasiz-backend",
+        exporter=None,
+        max_recent: int = 2048,
+        max_pending: int = 8192,
+        flush_interval: float = 2.0,
+        batch_size: int = 512,
+    ):
+        self.service_name = service_name
+        self.exporter = exporter
+        self.recent: Deque[Span] = deque(maxlen=max_recent)
+        self.pending: Deque[Span] = deque(maxlen=max_pending)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.finished = 0
+        self.exported = 0
+        self.export_errors = 0
+        self._task: Optional[asyncio.Task] = None
+        self._trace_configs: Dict[str, aiohttp.TraceConfig] = {}
+
+    @staticmethod
+    def current() -> Optional[Span]:
+        return _current.get()
+
+    def span(self, name: str, kind: str = "internal", **attributes) -> Span:
+        """A child of the current span, or the root of a new trace"""
+        return Span(self, name, _current.get(), attributes, kind)
+
+    def server_span(self, name: str, traceparent: Optional[str] = None, **attributes) -> Span:
+        """Root span of an incoming request, continuing the caller's trace if it sent one"""
+        match = TRACEPARENT.match(traceparent or "")
+        if match:
+            return Span(self, name, None, attributes, "server", trace_id=match.group(1), parent_id=match.group(2))
+        return Span(self, name, _current.get(), attributes, "server")
+
+    def wrap(self, name: str):
+        """Decorator running each call of a function or coroutine function in a span"""
+        def decorate(func):
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def traced_async(*args, **kwargs):
+                    with self.span(name):
+                        return await func(*args, **kwargs)
+                return traced_async
+
+            @functools.wraps(func)
+            def traced(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+            return traced
+        return decorate
+
+    def client_trace(self, upstream: str) -> aiohttp.TraceConfig:
+        """aiohttp trace hooks recording a client span per request until response headers arrive"""
+        trace = self._trace_configs.get(upstream)
+        if trace is not None:
+            return trace
+
+        async def on_start(session, context, params):
+            span = Span(self, f"{params.method} {upstream}", _current.get(), {"upstream": upstream}, "client")
+            span.start_ns = time.time_ns()
+            context.span = span
+
+        async def on_end(session, context, params):
+            context.span.set("http.status_code", params.response.status)
+            context.span.end_ns = time.time_ns()
+            self._finish(context.span)
+
+        async def on_exception(session, context, params):
+            context.span.error = f"{type(params.exception).__name__}: {params.exception}"
+            context.span.end_ns = time.time_ns()
+            self._finish(context.span)
+
+        trace = aiohttp.TraceConfig()
+        trace.on_request_start.append(on_start)
+        trace.on_request_end.append(on_end)
+        trace.on_request_exception.append(on_exception)
+        trace.freeze()
+        self._trace_configs[upstream] = trace
+        return trace
+
+    async def stream(self, name: str, chunks: AsyncIterator[Any], **attributes) -> AsyncIterator[Any]:
+        """Pass an async iterator through, spanning the time until it is exhausted or closed"""
+        with self.span(name, **attributes) as span:
+            count = 0
+            try:
+                async for chunk in chunks:
+                    count += 1
+                    yield chunk
+            finally:
+                span.set("chunks", count)
+
+    def _finish(self, span: Span):
+        self.finished += 1
+        self.recent.append(span)
+        if self.exporter is not None:
+            self.pending.append(span)
+
+    def trace(self, trace_id: str) -> List[Dict[str, Any]]:
+        """Buffered spans of one trace, in start order"""
+        spans = [span for span in self.recent if span.trace_id == trace_id]
+        return [span.to_dict() for span in sorted(spans, key=lambda span: span.start_ns)]
+
+    def recent_spans(self, limit: int = 100) -> List[Dict[str, Any]]:
+        return [span.to_dict() for span in list(self.recent)[-limit:]]
+
+    async def flush(self):
+        while self.pending and self.exporter is not None:
+            batch = [self.pending.popleft() for _ in range(min(self.batch_size, len(self.pending)))]
+            try:
+                await self.exporter.export(batch)
+                self.exported += len(batch)
+            except Exception as e:
+                self.export_errors += 1
+                logger.warning(f"Dropped {len(batch)} spans: {e}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        if self.exporter is not None and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self.exporter is not None:
+            await self.exporter.close()
+
+    def memory_usage(self) -> int:
+        """Estimated bytes held by buffered spans"""
+        seen = set()
+        size = shallow_sizeof(self.recent, self.pending)
+        # Pending spans are also in the recent buffer unless it has already rotated them out
+        for span in {id(span): span for span in itertools.chain(self.recent, self.pending)}.values():
+            size += shallow_sizeof(span)
+            size += sum(deep_sizeof(value, seen) for value in (span.name, span.trace_id, span.span_id, span.attributes))
+        return size
+
+    def stats(self) -> Dict[str, Any]:
+        """Get tracer statistics"""
+        return {
+            "exporter": type(self.exporter).__name__ if self.exporter else None,
+            "finished": self.finished,
+            "buffered": len(self.recent),
+            "pending": len(self.pending),
+            "exported": self.exported,
+            "export_errors": self.export_errors,
+        }
+
+def create_exporter(kind: Optional[str], target: Optional[str], service_name: str = "oasiz-backend"):
+    """Exporter for TRACE_EXPORTER (``json`` or ``otlp``) and its file or collector URL"""
+    if not kind or kind == "none":
+        return None
+    if kind == "json":
+        return JSONExporter(target or "traces.jsonl")
+    if kind == "otlp":
+        return OTLPExporter(target or "http://localhost:4318", service_name)
+    raise ValueError(f"Unknown trace exporter: {kind}")
+
+class TracingMiddleware:
+    """ASGI middleware opening a server span around each HTTP request"""
+
+    def __init__(self, app, tracer: Tracer, skip=("/metrics",)):
+        self.app = app
+        self.tracer = tracer
+        self.skip = set(skip)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip:
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = None
+        for name, value in scope.get("headers", ()):
+            if name == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+
+        with self.tracer.server_span(f"{scope['method']} {scope['path']}", traceparent) as span:
+            async def send_with_trace(message):
+                if message["type"] == "http.response.start":
+                    span.set("http.status_code", message["status"])
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-trace-id", span.trace_id.encode()))
+                    message = dict(message, headers=headers)
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_trace)
+            finally:
+                route = getattr(scope.get("route"), "path", None)
+                if route:
+                    span.name = f"{scope['method']} {route}"
+                    span.set("http.route", route)
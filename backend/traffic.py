@@ -0,0 +1,312 @@
+"""
+Traffic Recording
+
+This module records the shape and timing of live traffic so it can be
+replayed against a local instance (see benchmarks/bench_replay.py) instead of
+synthetic load. Recording is opt-in and anonymizing:
+
+- Chat text is reduced to the route it would take (a tool intent or plain
+  chat) and its length; the replayer synthesizes a message with the same
+  intent and length
+- Session and generation ids are replaced by salted pseudonyms, so long
+  sessions stay long without the ids being recoverable
+- Other strings keep only their length; numbers, booleans and a few
+  enumerations (frame type, sender, tool name) are kept as they are
+
+HTTP requests are logged with their status, duration and, for streams, the
+time to the first body chunk. WebSocket connections are logged as open,
+inbound frame and close events. Records are buffered and appended to a JSON
+lines file (gzip when the name ends in ``.gz``) by a background task.
+"""
+
+import asyncio
+import gzip
+import hashlib
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+from memory import sampled_sizeof, shallow_sizeof
+
+logger = logging.getLogger(__name__)
+
+# Mirrors the order of the tool patterns in main, so a recorded message is
+# classified the way the backend would route it
+INTENTS: List[Tuple[str, "re.Pattern", str]] = [
+    ("weather", re.compile(r"\bweather\b.*\b(\w+(?:\s+\w+)*)", re.IGNORECASE), "What's the weather in Paris"),
+    ("search", re.compile(r"\bsearch\b.*\b(\w+(?:\s+\w+)*)", re.IGNORECASE), "Search for python programming"),
+    ("code", re.compile(r"\bexecute\b.*\bcode\b", re.IGNORECASE), "Execute this code ```python\nprint(1)\n```"),
+    ("time", re.compile(r"\btime\b|\bdate\b", re.IGNORECASE), "What time is it"),
+    ("joke", re.compile(r"\bjoke\b|\bfunny\b|\bhumor\b", re.IGNORECASE), "Tell me a joke"),
+    ("quote", re.compile(r"\bquote\b|\binspiration\b|\bmotivation\b", re.IGNORECASE), "Give me a quote"),
+    ("play", re.compile(r"\bplay\b.*\b(game|rps|rock|paper|scissors|number|guess|word|hangman)\b", re.IGNORECASE), "Let's play rps"),
+]
+CHAT_TEMPLATE = "Tell me about"
+FILLER = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor".split()
+
+TEXT_KEYS = {"message", "text"}
+ID_KEYS = {"session_id", "generation_id"}
+KEPT_KEYS = {"type", "sender", "tool", "game_type"}
+
+def classify(text: str) -> str:
+    """Intent the backend's routing would give a message"""
+    for intent, pattern, _ in INTENTS:
+        if pattern.search(text):
+            return intent
+    return "chat"
+
+def synthesize_text(intent: str, length: int) -> str:
+    """A message with the given intent, padded to roughly ``length`` characters"""
+    template = next((template for name, _, template in INTENTS if name == intent), CHAT_TEMPLATE)
+    words = itertools.cycle(FILLER)
+    text = template
+    while len(text) < length:
+        # Code blocks must stay at the end of the message to be extracted
+        text = f"Please {text}" if intent == "code" else f"{text} {next(words)}"
+    return text
+
+class TrafficRecorder:
+    """Buffers anonymized request records and appends them to a log file"""
+
+    def __init__(
+        self,
+        path: str,
+        sample_rate: float = 1.0,
+        flush_interval: float = 1.0,
+        max_body: int = 65536,
+        skip_prefixes: Tuple[str, ...] = ("/metrics", "/debug"),
+    ):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.flush_interval = flush_interval
+        self.max_body = max_body
+        self.skip_prefixes = skip_prefixes
+        # Pseudonyms are only stable within one recording
+        self._salt = os.urandom(16)
+        self._origin = time.monotonic()
+        self._buffer: List[Dict[str, Any]] = []
+        self._connections = itertools.count(1)
+        self._random = random.Random()
+        self._task: Optional[asyncio.Task] = None
+        self.recorded = 0
+        self.written = 0
+
+    def pseudonym(self, value: str) -> str:
+        return "p" + hashlib.sha256(self._salt + value.encode("utf-8")).hexdigest()[:12]
+
+    def anonymize(self, value: Any, key: Optional[str] = None) -> Any:
+        """Shape of a JSON value with every identifying string removed"""
+        if isinstance(value, dict):
+            return {k: self.anonymize(v, k) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.anonymize(item) for item in value]
+        if not isinstance(value, str):
+            return value
+        if key in ID_KEYS:
+            return self.pseudonym(value)
+        if key in KEPT_KEYS:
+            return value
+        if key in TEXT_KEYS:
+            return {"$text": classify(value), "len": len(value)}
+        return {"$str": len(value)}
+
+    def anonymize_path(self, scope: Dict[str, Any]) -> str:
+        """The request path with every path parameter pseudonymized"""
+        path = scope["path"]
+        for value in (scope.get("path_params") or {}).values():
+            path = path.replace(f"/{value}", f"/{self.pseudonym(str(value))}", 1)
+        return path
+
+    def anonymize_query(self, query_string: bytes) -> Dict[str, Any]:
+        return {
+            key: self.anonymize(value, key) if not value.isdigit() else int(value)
+            for key, value in parse_qsl(query_string.decode("latin-1"))
+        }
+
+    def should_record(self, path: str) -> bool:
+        if path.startswith(self.skip_prefixes):
+            return False
+        return self.sample_rate >= 1 or self._random.random() < self.sample_rate
+
+    def now(self) -> float:
+        return round(time.monotonic() - self._origin, 6)
+
+    def next_connection(self) -> int:
+        return next(self._connections)
+
+    def record(self, entry: Dict[str, Any]):
+        self.recorded += 1
+        self._buffer.append(entry)
+
+    def _write(self, lines: List[str]):
+        opener = gzip.open if self.path.endswith(".gz") else open
+        with opener(self.path, "at") as f:
+            f.write("".join(lines))
+
+    async def flush(self):
+        if not self._buffer:
+            return
+        batch, self._buffer = self._buffer, []
+        lines = [json.dumps(entry, separators=(",", ":")) + "\n" for entry in batch]
+        try:
+            await asyncio.to_thread(self._write, lines)
+            self.written += len(batch)
+        except OSError as e:
+            logger.error(f"Dropped {len(batch)} traffic records: {e}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def memory_usage(self) -> int:
+        """Estimated bytes of records waiting to be flushed"""
+        return shallow_sizeof(self._buffer) + sampled_sizeof(self._buffer, len(self._buffer))
+
+    def stats(self) -> Dict[str, Any]:
+        """Get recorder statistics"""
+        return {"path": self.path, "recorded": self.recorded, "written": self.written, "buffered": len(self._buffer)}
+
+def _decode_json(data: bytes) -> Any:
+    try:
+        return json.loads(data) if data else None
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        return None
+
+class TrafficRecorderMiddleware:
+    """ASGI middleware feeding HTTP, SSE and WebSocket traffic to a recorder"""
+
+    def __init__(self, app, recorder: TrafficRecorder):
+        self.app = app
+        self.recorder = recorder
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket") or not self.recorder.should_record(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        if scope["type"] == "http":
+            await self._http(scope, receive, send)
+        else:
+            await self._websocket(scope, receive, send)
+
+    async def _http(self, scope, receive, send):
+        recorder = self.recorder
+        body = bytearray()
+        state = {"status": 500, "first": None, "chunks": 0, "bytes": 0}
+        started = time.perf_counter()
+        offset = recorder.now()
+
+        async def recording_receive():
+            message = await receive()
+            if message["type"] == "http.request" and len(body) < recorder.max_body:
+                body.extend(message.get("body", b"")[:recorder.max_body - len(body)])
+            return message
+
+        async def recording_send(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            elif message["type"] == "http.response.body" and message.get("body"):
+                if state["first"] is None:
+                    state["first"] = time.perf_counter() - started
+                state["chunks"] += 1
+                state["bytes"] += len(message["body"])
+            await send(message)
+
+        try:
+            await self.app(scope, recording_receive, recording_send)
+        finally:
+            entry = {
+                "t": offset,
+                "k": "http",
+                "m": scope["method"],
+                "r": getattr(scope.get("route"), "path", None),
+                "p": recorder.anonymize_path(scope),
+                "s": state["status"],
+                "d": round(time.perf_counter() - started, 6),
+                "n": state["chunks"],
+                "o": state["bytes"],
+            }
+            if scope.get("query_string"):
+                entry["q"] = recorder.anonymize_query(scope["query_string"])
+            shape = recorder.anonymize(_decode_json(bytes(body)))
+            if shape is not None:
+                entry["b"] = shape
+            if state["first"] is not None:
+                entry["f"] = round(state["first"], 6)
+            recorder.record(entry)
+
+    async def _websocket(self, scope, receive, send):
+        recorder = self.recorder
+        connection = recorder.next_connection()
+        outbound = 0
+        opened = False
+
+        async def recording_receive():
+            nonlocal opened
+            message = await receive()
+            if message["type"] == "websocket.connect":
+                opened = True
+                recorder.record({
+                    "t": recorder.now(), "k": "ws", "c": connection, "e": "open",
+                    "p": recorder.anonymize_path(scope),
+                    "sp": list(scope.get("subprotocols") or []),
+                })
+            elif message["type"] == "websocket.receive":
+                text = message.get("text")
+                frame = _decode_json(text.encode("utf-8")) if text is not None else None
+                recorder.record({
+                    "t": recorder.now(), "k": "ws", "c": connection, "e": "in",
+                    "b": recorder.anonymize(frame) if frame is not None else {"$bytes": len(message.get("bytes") or b"")},
+                })
+            return message
+
+        async def recording_send(message):
+            nonlocal outbound
+            if message["type"] == "websocket.send":
+                outbound += 1
+            await send(message)
+
+        try:
+            await self.app(scope, recording_receive, recording_send)
+        finally:
+            if opened:
+                recorder.record({"t": recorder.now(), "k": "ws", "c": connection, "e": "close", "n": outbound})
+
+def synthesize(shape: Any, key: Optional[str] = None) -> Any:
+    """A JSON value with the recorded shape, for replay"""
+    if isinstance(shape, dict):
+        if "$text" in shape:
+            return synthesize_text(shape["$text"], shape.get("len", 0))
+        if "$str" in shape:
+            return "x" * shape["$str"]
+        return {k: synthesize(v, k) for k, v in shape.items()}
+    if isinstance(shape, list):
+        return [synthesize(item) for item in shape]
+    return shape
+
+def read_log(path: str) -> List[Dict[str, Any]]:
+    """Records of a traffic log in time order"""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return sorted(records, key=lambda record: record["t"])